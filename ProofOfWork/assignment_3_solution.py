@@ -3,11 +3,43 @@ import time
 import hashlib
 import random
 import json
+import os
+import struct
+import zlib
 from fastecdsa import ecdsa, keys, curve, point
 
+# hash functions a chain can be mined with, all of them give 32 byte digests
+# sha256 is what Bitcoin uses, the chain's choice is kept in its parameters
+HASH_BACKENDS = {
+    "sha256": hashlib.sha256,
+    "sha3_256": hashlib.sha3_256,
+    "blake2b": lambda data: hashlib.blake2b(data, digest_size=32),
+    "blake2s": hashlib.blake2s,
+}
+
+# binary chain file, same layout as Scroogecoin2/chainfile.py with the zlib codec,
+# so its ChainReader opens these files too
+#   header   magic, version, codec, length of the chain parameters and their json
+#   segment  zlib compressed run of records, a record is a 4 byte length and the json of a block
+#   index    one entry per segment: first height, number of blocks, offset, compressed length, crc32
+#   footer   offset of the index, number of segments, magic
+CHAIN_MAGIC = b"CHAINBIN"
+CHAIN_VERSION = 2
+CHAIN_ZLIB = 1
+CHAIN_HEADER = struct.Struct(">8sHB")
+CHAIN_LENGTH = struct.Struct(">I")
+CHAIN_INDEX_ENTRY = struct.Struct(">QIQQI")
+CHAIN_FOOTER = struct.Struct(">QQ8s")
+
 class Miner:
-    def __init__(self):
+    def __init__(self, hash_name="sha256"):
         self.chain = [] # list of all the blocks
+        # hash backend of the chain, sha256 like bitcoin unless another one is picked
+        if hash_name not in HASH_BACKENDS:
+            raise ValueError("unknown hash backend %s, pick one of %s" % (hash_name, ", ".join(sorted(HASH_BACKENDS))))
+        self.hash_name = hash_name
+        # chain parameters, written into the header of an exported chain file
+        self.params = {"hash": hash_name}
 
 
     def genesis_block(self):
@@ -51,12 +83,12 @@ class Miner:
 
     def hash(self, blob):
         """
-        Creates a SHA-256 hash of a Block
+        Creates a hash of a Block with the chain's hash backend, SHA-256 by default
         :param block: Block
         """
         # We must make sure that the Dictionary is Ordered, or we may have inconsistent hashes
         block_string = json.dumps(blob, sort_keys=True).encode()
-        value = hashlib.sha256(block_string).hexdigest()
+        value = HASH_BACKENDS[self.hash_name](block_string).hexdigest()
         #print("hash : " +  value)
         return value
 
@@ -85,6 +117,65 @@ class Miner:
         self.chain.append(block)
         return block
 
+    def export_chain(self, path, segment_size=256):
+        '''
+        writes the chain to a binary chain file, much smaller than chain.json
+        self.params go into the header, so the hash backend travels with the blocks
+        @return: number of blocks written
+        '''
+        params = json.dumps(self.params, sort_keys=True).encode()
+        index = []
+        with open(path + ".tmp", "wb") as outfile:
+            outfile.write(CHAIN_HEADER.pack(CHAIN_MAGIC, CHAIN_VERSION, CHAIN_ZLIB) + CHAIN_LENGTH.pack(len(params)) + params)
+            offset = CHAIN_HEADER.size + CHAIN_LENGTH.size + len(params)
+            for start in range(0, len(self.chain), segment_size):
+                records = []
+                for block in self.chain[start:start + segment_size]:
+                    body = json.dumps(block, sort_keys=True).encode()
+                    records.append(CHAIN_LENGTH.pack(len(body)) + body)
+                data = zlib.compress(b"".join(records), 6)
+                outfile.write(data)
+                index.append((start, len(records), offset, len(data), zlib.crc32(data)))
+                offset += len(data)
+            outfile.write(b"".join(CHAIN_INDEX_ENTRY.pack(*entry) for entry in index))
+            outfile.write(CHAIN_FOOTER.pack(offset, len(index), CHAIN_MAGIC))
+        # the file only appears under path once it is complete
+        os.replace(path + ".tmp", path)
+        return len(self.chain)
+
+    def import_chain(self, path):
+        '''
+        replaces the chain with the blocks of a chain file written by export_chain
+        @raise ValueError: if the file is not a zlib chain file or was mined with another hash backend
+        '''
+        with open(path, "rb") as infile:
+            raw = infile.read()
+        magic, version, codec = CHAIN_HEADER.unpack_from(raw)
+        if magic != CHAIN_MAGIC or version != CHAIN_VERSION or codec != CHAIN_ZLIB:
+            raise ValueError("%s is not a zlib chain file" % path)
+        length, = CHAIN_LENGTH.unpack_from(raw, CHAIN_HEADER.size)
+        start = CHAIN_HEADER.size + CHAIN_LENGTH.size
+        params = json.loads(raw[start:start + length])
+        if params != self.params:
+            raise ValueError("%s holds a chain with %s, not %s" % (path, params, self.params))
+        index_offset, count, magic = CHAIN_FOOTER.unpack_from(raw, len(raw) - CHAIN_FOOTER.size)
+        if magic != CHAIN_MAGIC:
+            raise ValueError("%s has no index, the export did not finish" % path)
+        chain = []
+        for _, blocks, offset, size, crc in CHAIN_INDEX_ENTRY.iter_unpack(raw[index_offset:index_offset + count * CHAIN_INDEX_ENTRY.size]):
+            data = raw[offset:offset + size]
+            if zlib.crc32(data) != crc:
+                raise ValueError("a segment of %s is damaged" % path)
+            data = zlib.decompress(data)
+            position = 0
+            for _ in range(blocks):
+                length, = CHAIN_LENGTH.unpack_from(data, position)
+                position += CHAIN_LENGTH.size
+                chain.append(json.loads(data[position:position + length]))
+                position += length
+        self.chain = chain
+        return len(chain)
+
 
 
 def pad_leading_zeros(hex_str):
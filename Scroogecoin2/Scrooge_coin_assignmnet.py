@@ -1,64 +1,246 @@
+import asyncio
+import concurrent.futures
 import hashlib
 import json
 import pprint
 from fastecdsa import ecdsa, keys, curve, point
 import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import canonical
+import hashing
+from accounts import AccountState, AccountView, is_account_tx
+from audit import Auditor
+from chainfile import ChainFileError, ChainReader, export_chain, import_chain
+from filters import EMPTY_FILTER, block_addresses, entry_matches, filter_entry
+from history import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, AddressIndex, decode_cursor, make_page
+from ingest_server import IngestClient, IngestServer, precheck
+from issuance import MAX_ISSUANCE_RECEIVERS, issuance_body, issue
+from keygen import address_of, generate_keypairs
+from ledger_state import LedgerState, StateView, balance_deltas, list_snapshots, restore_state, write_snapshot, tx_locations
+from ledger_store import SqliteChain, StoreState
+from ledger_types import Block, PrunedTransaction, Transaction, hex_receivers, to_dict
+from merkle import merkle_parent, merkle_proof, merkle_root, root_from_proof
+from profiling import Profiler
+from scheduler import MiningPolicy, MiningScheduler
+from sharding import ShardedLedger
+from sigcache import SignatureCache
+from validation import Reason, check_account_structure, check_structure
+from wallet import InsufficientFunds, Wallet
+
+
+def block_header(block):
+    """
+    the part of a block that gets hashed and signed
+    transactions are committed to through the merkle root, so the cost of
+    sealing a block does not depend on the height of the chain
+    :param block: Block
+    """
+    return {
+        "previous_hash": block["previous_hash"],
+        "index": block["index"],
+        "merkle_root": block["merkle_root"],
+    }
+
+
+def decode_block(raw):
+    """
+    block from its canonical json, as read back from a chain file
+    json has no tuples, signatures are (r, s), pruned transactions become PrunedTransaction again
+    """
+    block = json.loads(raw)
+    for blob in [block] + block["transactions"]:
+        if blob.get("signature") is not None:
+            blob["signature"] = tuple(blob["signature"])
+    block["transactions"] = [PrunedTransaction.from_dict(tx) if tx.get("pruned") else tx for tx in block["transactions"]]
+    return block
+
+
+def is_legacy_block(block):
+    """
+    blocks mined before digest linkage carry the whole previous block in previous_hash
+    """
+    return isinstance(block["previous_hash"], dict) or "merkle_root" not in block
+
 
 class ScroogeCoin(object):
-    def __init__(self):
+    def __init__(self, compact=False, store=None, snapshot_dir=None, snapshot_every=0, private_key=None,
+                 signature_cache=None, profile=False, prune_depth=None, hash_name=None):
+        """
+        :param compact: store mined blocks as compact Block objects instead of dicts
+        :param store: persistent chain such as ledger_store.SqliteChain, the chain is kept in a list if None
+        :param snapshot_dir: directory of ledger state snapshots, import_chain into an empty ledger starts
+        from the newest one that matches the imported blocks, a store only writes them since it answers
+        from its own tables
+        :param snapshot_every: write a snapshot every this many blocks, 0 to only write them on request
+        :param private_key: Scrooge's key, e.g. from keygen.derive_private_key, a random one if None
+        :param signature_cache: sigcache.SignatureCache shared by the validation paths, a new one if None
+        :param profile: time the phases of validate_tx and mine, see self.profiler
+        :param prune_depth: drop the bodies of fully spent transactions once this many blocks are on top of them,
+        None keeps every transaction
+        :param hash_name: hash backend for tx, block, merkle and address hashing, see hashing.BACKENDS
+        sha256 if None, a store keeps the backend it was created with
+        """
+        if store is not None and prune_depth is not None:
+            raise ValueError("pruning is for the in memory chain, a store keeps blocks out of memory already")
+
+        # chain parameters, fixed for the life of a chain and written wherever the chain is
+        stored = store.get_meta("params") if store is not None else None
+        self.params = json.loads(stored) if stored is not None else {"hash": hash_name or hashing.DEFAULT}
+        if hash_name is not None and hash_name != self.params["hash"]:
+            raise ValueError("the chain uses %s, not %s" % (self.params["hash"], hash_name))
+        # unknown names fail here instead of in the first hash
+        hashing.backend(self.params["hash"])
+        self.hash_name = self.params["hash"]
+        if store is not None and stored is None:
+            store.set_meta("params", json.dumps(self.params, sort_keys=True))
+
         # MUST USE secp256k1 curve from fastecdsa
-        self.private_key, self.public_key = keys.gen_keypair(curve.secp256k1)
+        if store is not None and store.get_meta("private_key") is not None:
+            # Scrooge keeps signing with the key the stored chain was signed with
+            self.private_key = int(store.get_meta("private_key"))
+            self.public_key = keys.get_public_key(self.private_key, curve.secp256k1)
+        else:
+            if private_key is not None:
+                self.private_key, self.public_key = private_key, keys.get_public_key(private_key, curve.secp256k1)
+            else:
+                self.private_key, self.public_key = keys.gen_keypair(curve.secp256k1)
+            if store is not None:
+                store.set_meta("private_key", str(self.private_key))
         
         # create the address using public key, and bitwise operation, may need hex(value).hexdigest()
-        self.address = hashlib.sha256(hex(self.public_key.x << 256 | self.public_key.y).encode()).hexdigest()
+        self.address = address_of(self.public_key, self.hash_name)
         
         # list of all the blocks
-        self.chain = []
+        self.chain = store if store is not None else []
         
         # list of all the current transactions
         self.current_transactions = []
+        # inputs used by the first pending_counted of pending_list, see pending_spends
+        self.pending_list = self.current_transactions
+        self.pending_spent = set()
+        self.pending_counted = 0
+        # {tx hash: canonical encoding of the body} of the dict transactions accepted since the last block,
+        # a store writes them out as they are instead of encoding the transactions again
+        self.tx_bodies = {}
+
+        # {reason: count} of rejected transactions, see check_tx
+        self.rejects = {}
+
+        # {address: (x, y)} of every sender, so the chain can be audited later
+        # a store keeps them in its public_keys table and writes new ones with the next block
+        self.public_keys = self.chain.public_keys if hasattr(self.chain, "public_keys") else {}
+        self.remember_key(self.address, self.public_key)
+
+        # store mined blocks as compact Block objects instead of dicts
+        self.compact = compact
+
+        # signatures that already verified are not checked again
+        self.signature_cache = signature_cache if signature_cache is not None else SignatureCache()
+
+        # phase timings and reject counts, only collected if profile is set
+        self.profiler = Profiler(enabled=profile)
+
+        # unspent outputs and balances, kept up to date block by block
+        # a store answers them from its own tables instead, and opens without replaying anything
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_every = snapshot_every
+        if store is not None:
+            self.state = StoreState(store)
+        else:
+            self.state = LedgerState()
+
+        # self.state belongs to the thread holding self.lock, which adds transactions and mines
+        # any other thread reads the StateView published after the last block, see view()
+        self.lock = threading.RLock()
+        self.published = StoreState.copy_of(self.state) if store is not None else StateView.copy_of(self.state)
+
+        # debits and credits of every address, a store keeps its own in the history table
+        self.history = None if hasattr(self.chain, "history_page") else AddressIndex()
+        # address filter of every block, a store keeps them in its filters table
+        # blocks mined before filters existed get theirs here, once
+        self.block_filters = self.chain.filters if hasattr(self.chain, "filters") else []
+        self.index_blocks()
+
+        # {block_num: {tx_num, ...}} fully spent transactions waiting for prune_depth
+        self.prune_depth = prune_depth
+        self.prunable = {}
+        self.pruned = 0
 
     def create_coins(self, receivers: dict):
         """
         Scrooge adds value to some coins
         :param receivers: {account:amount, account:amount, ...}
         """
-        tx = {
-            "sender": self.address,
-            # coins that are created do not come from anywhere
-            "location": {"block": -1, "tx": -1},
-            "receivers": receivers,
-        }
-        tx["hash"] = self.hash(tx)
+        tx = issuance_body(self.address, receivers)
+        tx["hash"], encoded = self.hash_body(tx)
         tx["signature"] = self.sign(tx["hash"])
-        self.current_transactions.append(tx)
+        with self.lock:
+            self.current_transactions.append(tx)
+            self.tx_bodies[tx["hash"]] = encoded
+
+    def create_coins_bulk(self, receivers: dict, chunk_size=MAX_ISSUANCE_RECEIVERS, processes=None):
+        """
+        create_coins for many receivers, e.g. an airdrop
+        receivers are split into transactions of at most chunk_size, signed across a process pool
+        and queued together in the order of receivers
+        :param receivers: {account:amount, account:amount, ...}
+        :param processes: number of signing processes, 1 signs in this process
+        :return: number of transactions queued
+        """
+        txs = issue(self.address, receivers, self.private_key, self.hash_name, chunk_size, processes)
+        with self.lock:
+            self.current_transactions.extend(txs)
+        return len(txs)
 
     def hash(self, blob):
         """
-        Creates a SHA-256 hash of a Block
+        Creates a hash of a Block with the chain's hash backend, SHA-256 by default
         :param block: Block
         """
-        # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        # use json.dumps().encode() and specify the corrent parameters=
-        # use hashlib to hash the output of json.dumps()
-        hash_object = hashlib.sha256(json.dumps(blob, sort_keys=True).encode())
-        return hash_object.hexdigest()
+        # canonical encoding is the same as json.dumps(blob, sort_keys=True).encode()
+        return canonical.digest(blob, self.hash_name)
+
+    def hash_body(self, tx):
+        """
+        hashes the part of tx covered by its signature
+        :return: (hash, canonical encoding of the body), the encoding is None for a compact Transaction,
+        which memoizes its digest itself
+        """
+        if isinstance(tx, canonical.Sealed):
+            return self.hash(tx), None
+        encoded = canonical.dumps(canonical.tx_body(tx))
+        return hashing.hexdigest(self.hash_name, encoded), encoded
 
     def sign(self, hash_):
         # use fastecdsa library
         r, s = ecdsa.sign(hash_, self.private_key, curve=curve.secp256k1)
         return (r,s)
 
-    def get_user_tx_positions(self, address):
+    def get_user_tx_positions(self, address, height=None):
         """
         Scrooge adds value to some coins
         :param address: User.address
+        :param height: only look at the blocks below height, e.g. view().height
         :return: list of all transactions where address is funded
         [{"block":block_num, "tx":tx_num, "amount":amount}, ...]
         """
+        if height is None:
+            height = len(self.chain)
+        if hasattr(self.chain, "positions"):
+            return self.chain.positions(address, height)
+
+        if self.history.height >= height:
+            # the address index has every output paying address, pruned transactions no longer count
+            return [{"block": block_index, "tx": tx_index, "amount": amount}
+                    for block_index, tx_index, amount in self.history.credits(address, height)
+                    if not self.chain[block_index]["transactions"][tx_index].get("pruned")]
+
         funded_transactions = []
 
-        for block in self.chain:
+        for block in self.chain[:height]:
             tx_index = 0
             for old_tx in block["transactions"]:
                 for funded, amount in old_tx["receivers"].items():
@@ -67,7 +249,44 @@ class ScroogeCoin(object):
                 tx_index += 1
         return funded_transactions
 
-    def validate_tx(self, tx, public_key):
+    def get_address_history(self, address, cursor=None, page_size=DEFAULT_PAGE_SIZE, start_height=0, end_height=None):
+        """
+        one page of the debits and credits of address, in chain order
+        :param cursor: "cursor" of the previous page, None for the first page
+        :param start_height: only blocks at start_height and above
+        :param end_height: only blocks below end_height, the published height if None
+        :return: {"entries": [{"block", "tx", "kind": "debit" or "credit", "amount"}, ...],
+        "cursor": cursor of the next page, None on the last page}
+        """
+        if not (1 <= page_size <= MAX_PAGE_SIZE):
+            raise ValueError("page_size must be between 1 and %d" % MAX_PAGE_SIZE)
+        after = decode_cursor(cursor)
+        height = self.view().height
+        end_height = height if end_height is None else min(end_height, height)
+        if self.history is not None:
+            rows = self.history.page(address, after, start_height, end_height, page_size)
+        else:
+            rows = self.chain.history_page(address, after, start_height, end_height, page_size)
+        return make_page(rows, page_size)
+
+    def iter_address_history(self, address, page_size=DEFAULT_PAGE_SIZE, start_height=0, end_height=None):
+        """
+        streams the history of address page by page, only one page is held at a time
+        the end is fixed when the stream starts, blocks mined meanwhile are not included
+        :return: generator of {"block", "tx", "kind", "amount"}
+        """
+        if end_height is None:
+            end_height = self.view().height
+        cursor = None
+        while True:
+            page = self.get_address_history(address, cursor, page_size, start_height, end_height)
+            for entry in page["entries"]:
+                yield entry
+            cursor = page["cursor"]
+            if cursor is None:
+                return
+
+    def validate_tx(self, tx, public_key, audit=False):
         """
         validates a single transaction
 
@@ -80,71 +299,356 @@ class ScroogeCoin(object):
         }
 
         :param public_key: User.public_key
+        :param audit: verify the signature even if it is in the signature cache
 
         :return: if tx is valid return tx
         """
-        is_correct_hash = False
-        base_tx = {
-            "sender": tx["sender"],
-            "location": tx["location"],
-            "receivers": tx["receivers"],
-        }
-        if self.hash(base_tx) == tx["hash"]:
-            is_correct_hash = True
+        if self.check_tx(tx, public_key, audit) is Reason.OK:
+            return tx
+        return None
 
-        is_signed = ecdsa.verify(tx["signature"], tx["hash"], public_key, curve=curve.secp256k1)
+    def check_tx(self, tx, public_key, audit=False, verify=True):
+        """
+        runs the checks of validate_tx cheapest first and stops at the first that fails,
+        so a garbage transaction is turned away before any hashing or curve math
+        structure and amounts, inputs that pay the sender, inputs adding up to the outputs,
+        inputs not spent yet, then the hash and the signature
+        :param audit: verify the signature even if it is in the signature cache
+        :param verify: False stops before the hash and the signature, for callers that check those elsewhere
+        :return: validation.Reason, Reason.OK if tx is valid
+        """
+        lap = self.profiler.lap("validate_tx")
+        reason = check_structure(tx)
+        lap("structure")
+        if reason is not None:
+            return self.reject(reason)
+
+        sender = tx["sender"]
+        positions = [(location["block"], location["tx"]) for location in tx_locations(tx)]
+        # every input must pay the sender, and each input can only be listed once
+        if len(positions) == 0 or len(set(positions)) != len(positions):
+            return self.reject(Reason.FUNDED)
+        amount = 0
+        for blockIndex, txIndex in positions:
+            funded_amount = self.get_output(blockIndex, txIndex, sender)
+            if funded_amount is None or funded_amount < 0:
+                return self.reject(Reason.FUNDED)
+            amount += funded_amount
+        lap("funding")
+
+        # sum of the inputs has to be equal to the sum of the outputs
+        if sum(tx["receivers"].values()) != amount:
+            return self.reject(Reason.ALL_SPENT)
+        lap("spent_sum")
+
+        if self.is_spent(positions, sender):
+            return self.reject(Reason.CONSUMED)
+        lap("consumed")
+        if not verify:
+            return Reason.OK
+
+        hash_, encoded = self.hash_body(tx)
+        if hash_ != tx["hash"]:
+            return self.reject(Reason.HASH)
+        lap("hash")
+
+        if not self.signature_cache.verify(tx["signature"], tx["hash"], public_key, bypass=audit):
+            return self.reject(Reason.SIGNATURE)
+        lap("verify")
+        if encoded is not None:
+            self.tx_bodies[hash_] = encoded
+        return Reason.OK
+
+    def reject(self, reason):
+        """
+        counts a rejected transaction under its reason
+        :return: reason
+        """
+        self.rejects[reason.value] = self.rejects.get(reason.value, 0) + 1
+        self.profiler.reject(reason.value)
+        return reason
 
-        blockIndex = tx["location"]["block"]
-        txIndex = tx["location"]["tx"]
+    def reject_stats(self):
+        """
+        :return: {reason: number of transactions rejected for it}
+        """
+        return dict(self.rejects)
 
-        # what is the meaning of isFunded?
-        is_funded = False
-        list_of_transactions = self.chain[blockIndex]["transactions"]
-        amount = 0
-        if tx["sender"] in list_of_transactions[txIndex]["receivers"]:
-            amount = list_of_transactions[txIndex]["receivers"][tx["sender"]]
-            if amount >= 0:
-                is_funded = True
-
-        is_all_spent = False
-        totalAmountSpent = 0
-        for rec in tx["receivers"].keys():
-            totalAmountSpent += tx["receivers"][rec]
-        is_all_spent = True if totalAmountSpent == amount else False
-
-        consumed_previous = False
-        # for each block after blockIndex , need to verify if blockIndex and tx is not used as location
-        for block in self.chain[blockIndex:]:
-            for transaction in block["transactions"]:
-                if transaction["sender"] == tx["sender"]:
-                    if transaction["location"]["block"] == blockIndex and transaction["location"]["tx"] == txIndex:
-                        consumed_previous = True
-
-
-        if (is_correct_hash and is_signed and is_funded and is_all_spent and not consumed_previous):
-            return tx
-        else:
+    def get_output(self, block_index, tx_index, address):
+        """
+        :return: amount the transaction at block_index, tx_index pays to address,
+        None if there is no such transaction or it does not pay address
+        """
+        if hasattr(self.chain, "output"):
+            return self.chain.output(block_index, tx_index, address)
+
+        if not (0 <= block_index < len(self.chain)):
+            return None
+        list_of_transactions = self.chain[block_index]["transactions"]
+        if not (0 <= tx_index < len(list_of_transactions)):
             return None
+        return list_of_transactions[tx_index]["receivers"].get(address)
+
+    def index_blocks(self, block=None):
+        """
+        adds the blocks at the end of the chain to the address history and the block filters,
+        whichever of them does not have them yet
+        :param block: the last block of the chain, if it is at hand already
+        """
+        filtered = len(self.block_filters)
+        indexed = self.history.height if self.history is not None else len(self.chain)
+        for index in range(min(filtered, indexed), len(self.chain)):
+            current = block if block is not None and index == block["index"] else self.chain[index]
+            if index == indexed:
+                self.history.add_block(current)
+                indexed += 1
+            if index == filtered:
+                self.block_filters.append(filter_entry(current))
+                filtered += 1
+
+    def get_block_filters(self, start=0, stop=None):
+        """
+        address filters of the blocks from start to stop, see filters.py
+        a wallet reads these instead of the blocks and only fetches the blocks that match its address
+        :param stop: the published height if None
+        :return: [{"index", "previous_hash", "hash", "filter": bytes}, ...]
+        """
+        height = self.view().height
+        stop = height if stop is None else min(stop, height)
+        return [self.block_filters[index] for index in range(max(start, 0), stop)]
+
+    def get_tx_proof(self, block_index, tx_index):
+        """
+        proves that a transaction is in a mined block without sending the block
+        :return: {"header": block header, "hash": block hash, "signature": Scrooge's signature of it,
+        "tx_index": tx_index, "tx_count": number of transactions in the block, "tx_hash": hash of the transaction,
+        "proof": merkle_proof of it}
+        """
+        if not (0 <= block_index < len(self.chain)):
+            raise IndexError("no block %d in a chain of %d" % (block_index, len(self.chain)))
+        block = self.chain[block_index]
+        if is_legacy_block(block):
+            raise ValueError("block %d has no merkle root, migrate_chain first" % block_index)
+        hashes = [tx["hash"] for tx in block["transactions"]]
+        return {
+            "header": block_header(block),
+            "hash": block["hash"],
+            "signature": tuple(block["signature"]),
+            "tx_index": tx_index,
+            "tx_count": len(hashes),
+            "tx_hash": hashes[tx_index] if 0 <= tx_index < len(hashes) else None,
+            "proof": merkle_proof(hashes, tx_index, self.hash_name),
+        }
+
+    def is_spent(self, positions, sender):
+        """
+        checks if sender already used any of the positions as a location,
+        in a mined block or in the pending transactions
+        :param positions: [(block_num, tx_num), ...]
+        :param sender: User.address
+        """
+        # positions that exist but are no longer unspent were used by a mined transaction
+        if any(not self.state.is_unspent(block_index, tx_index, sender) for block_index, tx_index in positions):
+            return True
+
+        pending = self.pending_spends()
+        return any((block_index, tx_index, sender) in pending for block_index, tx_index in positions)
+
+    def pending_spends(self):
+        """
+        :return: {(block_num, tx_num, sender), ...} used by current_transactions
+        kept up to date as transactions are added, instead of scanning them on every check
+        """
+        current = self.current_transactions
+        if current is not self.pending_list or len(current) < self.pending_counted:
+            # current_transactions was replaced, by mine() or by hand
+            self.pending_list, self.pending_spent, self.pending_counted = current, set(), 0
+        for transaction in current[self.pending_counted:]:
+            for location in tx_locations(transaction):
+                self.pending_spent.add((location["block"], location["tx"], transaction["sender"]))
+        self.pending_counted = len(current)
+        return self.pending_spent
 
     def mine(self):
         """
         mines a new block onto the chain
+        the writer lock keeps add_tx from slipping a transaction into the block being sealed
         """
-        previous_hash = None
-        if len(self.chain) != 0:
-            previous_hash = self.chain[len(self.chain) - 1]
+        with self.lock:
+            lap = self.profiler.lap("mine")
+            previous_hash = None
+            if len(self.chain) != 0:
+                previous_hash = self.chain[-1]["hash"]
+
+            block = {
+                'previous_hash': previous_hash,
+                'index': len(self.chain),
+                'merkle_root': merkle_root([tx["hash"] for tx in self.current_transactions], self.hash_name),
+                'transactions': self.current_transactions,
+            }
+            lap("merkle")
+
+            block["hash"] = self.hash(block_header(block))   # hash and sign the block
+            lap("hash")
+            block["signature"] = self.sign(block["hash"]) # signed hash of block
+            lap("sign")
+            if self.compact:
+                block = Block.from_dict(block)
+            if hasattr(self.chain, "public_keys"):
+                self.chain.append(block, self.tx_bodies)
+            else:
+                self.chain.append(block)
+            self.tx_bodies = {}
+            lap("append")
+            self.index_blocks(block)
+            lap("index")
+            self.state.apply_block(block)
+            self.current_transactions = []
+            # readers move to the new height in one assignment
+            self.published = self.published.extend(self.state, block)
+            lap("state")
+            if self.prune_depth is not None:
+                self.track_spent(block)
+                self.prune()
+                lap("prune")
+            if self.snapshot_dir is not None and self.snapshot_every and len(self.chain) % self.snapshot_every == 0:
+                self.write_snapshot()
+            return block
+
+    def track_spent(self, block):
+        """
+        marks the transactions whose last unspent output block spent
+        """
+        for tx_index, tx in enumerate(block["transactions"]):
+            if len(tx["receivers"]) == 0:
+                self.prunable.setdefault(block["index"], set()).add(tx_index)
+            for location in tx_locations(tx):
+                position = (location["block"], location["tx"])
+                if not (0 <= position[0] < len(self.chain)):
+                    continue
+                funded_tx = self.chain[position[0]]["transactions"][position[1]]
+                if not any(self.state.is_unspent(position[0], position[1], address) for address in funded_tx["receivers"]):
+                    self.prunable.setdefault(position[0], set()).add(position[1])
+
+    def prune(self):
+        """
+        replaces the fully spent transactions at least prune_depth blocks deep with their hash
+        headers and merkle roots stay, so blocks still verify and unpruned transactions still have proofs
+        a transaction waits until the transactions it spends are pruned, so a copy of the chain
+        replayed without the pruned transactions does not see their inputs as unspent
+        :return: number of transactions pruned
+        """
+        limit = len(self.chain) - 1 - self.prune_depth
+        count = 0
+        for block_index in sorted(index for index in self.prunable if index <= limit):
+            block = self.chain[block_index]
+            transactions = list(block["transactions"])
+            waiting = set()
+            for tx_index in self.prunable.pop(block_index):
+                tx = transactions[tx_index]
+                if tx.get("pruned"):
+                    continue
+                funding = [self.chain[location["block"]]["transactions"][location["tx"]]
+                           for location in tx_locations(tx) if location["block"] >= 0]
+                if not all(funded_tx.get("pruned") for funded_tx in funding):
+                    waiting.add(tx_index)
+                    continue
+                transactions[tx_index] = PrunedTransaction(
+                    bytes.fromhex(tx["hash"]),
+                    [(bytes.fromhex(address), delta) for address, delta in balance_deltas(tx).items()])
+                count += 1
+            if waiting:
+                self.prunable[block_index] = waiting
+            if isinstance(block, Block):
+                block.transactions = tuple(transactions)
+            else:
+                block["transactions"] = transactions
+        self.pruned += count
+        return count
+
+    def view(self):
+        """
+        read only state as of the last mined block, safe to use from any thread
+        without the writer lock, it stays at its height while mining goes on
+        :return: ledger_state.StateView, ledger_store.StoreState on a store
+        """
+        return self.published
 
-        block = {
-            'previous_hash': previous_hash,
-            'index': len(self.chain),
-            'transactions': self.current_transactions,
-        }
+    def write_snapshot(self):
+        """
+        saves the unspent outputs, balances and tip hash at the current height into snapshot_dir
+        :return: path of the snapshot
+        """
+        return write_snapshot(self.state, self.snapshot_dir)
 
-        block["hash"] = self.hash(block)   # hash and sign the block
-        block["signature"] = self.sign(block["hash"]) # signed hash of block
-        self.chain.append(block)
-        self.current_transactions = []
-        return block
+    def export_chain(self, path, codec="zlib", segment_size=256):
+        """
+        writes the chain to a seekable binary chain file, see chainfile.py
+        the public keys of the senders go along with the chain parameters, so the chain can be audited
+        wherever it is imported
+        :param codec: "zlib", "lzma" or "none"
+        :return: number of blocks written
+        """
+        public_keys = {address: list(self.public_keys[address]) for address in self.public_keys}
+        return export_chain(self.chain, path, codec, segment_size, dict(self.params, public_keys=public_keys))
+
+    def import_chain(self, path):
+        """
+        appends the blocks of a chain file after the ones already in the chain
+        the blocks are trusted, audit.Auditor checks them with the public keys that came in the file
+        holds the writer lock like mine(), readers move to the new height at the end
+        pruned transactions only count the balances they moved, their outputs are spent
+        a node starting from an empty in memory chain takes the state from the newest snapshot in
+        snapshot_dir that matches the imported blocks, and replays only the blocks after it
+        :return: number of blocks imported
+        """
+        with self.lock:
+            cold_start = len(self.chain) == 0 and isinstance(self.state, LedgerState)
+            # a store writes the keys with the first imported block
+            with ChainReader(path) as reader:
+                for address, (x, y) in reader.params.get("public_keys", {}).items():
+                    self.remember_key(address, point.Point(x, y, curve=curve.secp256k1))
+            count = 0
+            for block in import_chain(path, start=len(self.chain), decode=decode_block, params=self.params):
+                previous_hash = self.chain[-1]["hash"] if len(self.chain) else None
+                if block["previous_hash"] != previous_hash:
+                    raise ValueError("block %d of %s does not extend the chain" % (block["index"], path))
+                if self.compact:
+                    block = Block.from_dict(block)
+                self.chain.append(block)
+                self.index_blocks(block)
+                if not cold_start:
+                    self.state.apply_block(block)
+                count += 1
+            if cold_start:
+                self.state, _ = restore_state(self.chain, self.snapshot_dir)
+            self.published = self.published.copy_of(self.state)
+            return count
+
+    def migrate_chain(self, chain):
+        """
+        rebuilds a chain mined with nested previous blocks into digest linked blocks
+        transactions are kept as they are, every block is re-hashed and re-signed by Scrooge
+        :param chain: list of blocks, legacy or already migrated
+        :return: the migrated chain
+        """
+        migrated = []
+        previous_hash = None
+        for block in chain:
+            new_block = {
+                'previous_hash': previous_hash,
+                'index': block["index"],
+                'merkle_root': merkle_root([tx["hash"] for tx in block["transactions"]], self.hash_name),
+                'transactions': block["transactions"],
+            }
+            new_block["hash"] = self.hash(block_header(new_block))
+            if is_legacy_block(block) or new_block["hash"] != block["hash"]:
+                new_block["signature"] = self.sign(new_block["hash"])
+            else:
+                new_block["signature"] = block["signature"]
+            migrated.append(new_block)
+            previous_hash = new_block["hash"]
+        return migrated
 
     def add_tx(self, tx, public_key):
         """
@@ -165,29 +669,26 @@ class ScroogeCoin(object):
 
         :return: True if the tx is added to current_transactions
         """
-        tx = self.validate_tx(tx, public_key)
-        if tx != None:
-            self.current_transactions.append(tx)
-            return True
-        else:
-            return False
+        with self.lock:
+            tx = self.validate_tx(tx, public_key)
+            if tx != None:
+                self.current_transactions.append(tx)
+                self.remember_key(tx["sender"], public_key)
+                return True
+            else:
+                return False
+
+    def remember_key(self, address, public_key):
+        if address in self.public_keys:
+            return
+        self.public_keys[address] = (public_key.x, public_key.y)
 
     def show_user_balance(self, address):
         """
         prints balance of address
         :param address: User.address
         """
-        totalBalance = 0
-        for block in self.chain:
-            for transaction in block["transactions"]:
-                if transaction["sender"] == address:
-                    for reciever, amount in transaction["receivers"].items():
-                        if reciever != address:
-                            totalBalance -= amount
-                else:
-                    for reciever, amount in transaction["receivers"].items():
-                        if reciever == address:
-                            totalBalance += amount
+        totalBalance = self.view().balance(address)
         print(totalBalance)
         return totalBalance
 
@@ -197,57 +698,194 @@ class ScroogeCoin(object):
         prints out a single formated block
         :param block_num: index of the block to be printed
         """
-        print(self.chain[block_num])
+        print(to_dict(self.chain[block_num]))
+
+class AccountCoin(ScroogeCoin):
+    """
+    ScroogeCoin on the account model, see accounts.py
+    a transaction names the sender's next nonce and is paid from its balance,
+    so validating it takes a balance and a nonce lookup instead of reading the
+    outputs it spends. Blocks, hashes, signatures and views are ScroogeCoin's.
+    State snapshots, audit.Auditor and the compact types work on unspent
+    outputs and refuse account chains.
+    """
+
+    def __init__(self, private_key=None, signature_cache=None, profile=False, hash_name=None):
+        super().__init__(private_key=private_key, signature_cache=signature_cache, profile=profile, hash_name=hash_name)
+        self.state = AccountState()
+        self.published = AccountView.copy_of(self.state)
+        # {sender: (next nonce, amount debited)} of the first pending_counted of pending_list
+        self.pending_accounts = {}
+
+    def check_tx(self, tx, public_key, audit=False, verify=True):
+        """
+        structure and amounts, the nonce, the balance, then the hash and the signature
+        pending transactions count: a sender's next one takes the nonce after them
+        and is paid from what they left
+        :return: validation.Reason, Reason.OK if tx is valid
+        """
+        lap = self.profiler.lap("validate_tx")
+        reason = check_account_structure(tx)
+        lap("structure")
+        if reason is not None:
+            return self.reject(reason)
+
+        sender = tx["sender"]
+        nonce, debited = self.pending_debits().get(sender, (self.state.nonce(sender), 0))
+        if tx["nonce"] != nonce:
+            return self.reject(Reason.NONCE)
+        lap("nonce")
+
+        if self.state.balance(sender) - debited < sum(tx["receivers"].values()):
+            return self.reject(Reason.BALANCE)
+        lap("balance")
+        if not verify:
+            return Reason.OK
+
+        hash_, encoded = self.hash_body(tx)
+        if hash_ != tx["hash"]:
+            return self.reject(Reason.HASH)
+        lap("hash")
+
+        if not self.signature_cache.verify(tx["signature"], tx["hash"], public_key, bypass=audit):
+            return self.reject(Reason.SIGNATURE)
+        lap("verify")
+        if encoded is not None:
+            self.tx_bodies[hash_] = encoded
+        return Reason.OK
+
+    def pending_debits(self):
+        """
+        :return: {sender: (next nonce, amount debited)} of current_transactions, kept up to date like pending_spends
+        """
+        current = self.current_transactions
+        if current is not self.pending_list or len(current) < self.pending_counted:
+            self.pending_list, self.pending_accounts, self.pending_counted = current, {}, 0
+        for transaction in current[self.pending_counted:]:
+            if is_account_tx(transaction):
+                _, debited = self.pending_accounts.get(transaction["sender"], (0, 0))
+                self.pending_accounts[transaction["sender"]] = (transaction["nonce"] + 1,
+                                                                debited + sum(transaction["receivers"].values()))
+        self.pending_counted = len(current)
+        return self.pending_accounts
+
+    def write_snapshot(self):
+        """
+        snapshots hold unspent outputs, the account state has none
+        """
+        raise ValueError("AccountCoin has no state snapshots, replay the chain instead")
+
+    def get_nonce(self, address):
+        """
+        :return: nonce the next transaction of address has to carry, counting the pending ones
+        """
+        with self.lock:
+            return self.pending_debits().get(address, (self.state.nonce(address), 0))[0]
+
 
 class User(object):
-    def __init__(self, Scrooge):
+    def __init__(self, Scrooge, private_key=None, public_key=None):
+        """
+        :param private_key: a random key is created if None
+        :param public_key: public key of private_key, derived from it if None
+        """
         # MUST USE secp256k1 curve from fastecdsa
-        self.private_key, self.public_key = keys.gen_keypair(curve.secp256k1)
+        if private_key is None:
+            self.private_key, self.public_key = keys.gen_keypair(curve.secp256k1)
+        else:
+            self.private_key = private_key
+            self.public_key = public_key if public_key is not None else keys.get_public_key(private_key, curve.secp256k1)
         
+        # addresses and hashes use the hash backend of Scrooge's chain
+        self.hash_name = Scrooge.hash_name
+
         # create the address using public key, and bitwise operation, may need hex(value).hexdigest()
-        self.address = hashlib.sha256(hex(self.public_key.x << 256 | self.public_key.y).encode()).hexdigest()
-        
+        self.address = address_of(self.public_key, self.hash_name)
+        # blocks are trusted when Scrooge signed them
+        self.scrooge_public_key = Scrooge.public_key
+
+    @classmethod
+    def from_seed(cls, Scrooge, seed, count, start=0, processes=None):
+        """
+        creates count users with keys derived from seed, so runs can be reproduced
+        keys are derived in parallel across processes
+        :param seed: bytes
+        :return: [User, ...]
+        """
+        return [cls(Scrooge, private_key, public_key)
+                for private_key, public_key in generate_keypairs(seed, count, start=start, processes=processes)]
 
     def hash(self, blob):
         """
-        Creates a SHA-256 hash of a Block
+        Creates a hash of a Block with the chain's hash backend, SHA-256 by default
         :param block: Block
         :return: the hash of the blob
         """
-        # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        # use json.dumps().encode() and specify the corrent parameters
-        # use hashlib to hash the output of json.dumps()
-        hash_object = hashlib.sha256(json.dumps(blob, sort_keys=True).encode())
-        value = hash_object.hexdigest()
-        return value
+        # canonical encoding is the same as json.dumps(blob, sort_keys=True).encode()
+        return canonical.digest(blob, self.hash_name)
 
     def sign(self, hash_):
 
         r, s = ecdsa.sign(hash_, self.private_key, curve=curve.secp256k1)
         return (r,s) # use fastecdsa library
 
-    def send_tx(self, receivers, previous_tx_locations):
+    def send_tx(self, receivers, previous_tx_locations, compact=False):
         """
-        creates a TX to be sent
+        creates a TX to be sent, every location in previous_tx_locations is spent
+        under one signature, so their amounts must add up to the receivers
         :param receivers: {account:amount, account:amount, ...}
-        :param previous_tx_locations
+        :param previous_tx_locations: [{"block":block_num, "tx":tx_num, "amount":amount}, ...]
+        :param compact: return a compact Transaction instead of a dict
         """
 
         tx = {
                 "sender": self.address,
-                "location": previous_tx_locations[0],
-                "receivers": receivers,
+                "locations": [to_dict(location) for location in previous_tx_locations],
+                "receivers": hex_receivers(receivers),
             }
-        base_tx = tx
-        # hash_value = self.hash(base_tx),
-        # print(hash_value)
-        hash_object = hashlib.sha256(json.dumps(base_tx, sort_keys=True).encode())
-        hash_value = hash_object.hexdigest()
+        hash_value = self.hash(tx)
         signature = self.sign(hash_value)
         tx["hash"] = hash_value  # hash of TX
         tx["signature"] = signature  # signed hash of TX
+        if compact:
+            return Transaction.from_dict(tx)
+        return tx
+
+    def send_payment(self, receivers, nonce):
+        """
+        creates an account model TX for AccountCoin, paid from this user's balance
+        :param receivers: {account:amount, account:amount, ...}
+        :param nonce: AccountCoin.get_nonce(self.address)
+        """
+        tx = {
+                "sender": self.address,
+                "nonce": nonce,
+                "receivers": hex_receivers(receivers),
+            }
+        tx["hash"] = self.hash(tx)
+        tx["signature"] = self.sign(tx["hash"])
         return tx
 
+    def verify_tx_proof(self, tx_proof, tx_hash=None):
+        """
+        checks a proof from ScroogeCoin.get_tx_proof without the chain:
+        the merkle path leads to the header's root, the header hashes to the
+        block hash, and Scrooge signed that hash
+        the root commits to the number of transactions, so tx_index has to be the position
+        of a transaction and the path has to go all the way down to it
+        :param tx_hash: the transaction expected to be proven, e.g. of a payment to this user
+        :return: True if the transaction is in a block Scrooge mined
+        """
+        if tx_hash is not None and tx_hash != tx_proof["tx_hash"]:
+            return False
+        header = tx_proof["header"]
+        if root_from_proof(tx_proof["tx_hash"], tx_proof["tx_index"], tx_proof["tx_count"], tx_proof["proof"],
+                           self.hash_name) != header["merkle_root"]:
+            return False
+        if self.hash(header) != tx_proof["hash"]:
+            return False
+        return ecdsa.verify(tuple(tx_proof["signature"]), tx_proof["hash"], self.scrooge_public_key, curve=curve.secp256k1)
+
 def main():
 
     # dict - defined using {key:value, key:value, ...} or dict[key] = value
@@ -275,7 +913,7 @@ def main():
     print(Scrooge.add_tx(first_tx, users[0].public_key))
     Scrooge.mine()
 
-    second_tx = users[1].send_tx({users[0].address:20}, Scrooge.get_user_tx_positions(users[1].address))
+    second_tx = users[1].send_tx({users[0].address:20}, Scrooge.get_user_tx_positions(users[1].address)[:1])
     print(Scrooge.add_tx(second_tx, users[1].public_key))
     Scrooge.mine()
 
@@ -290,6 +928,28 @@ def main():
     test_2()
     test_3()
     test_4()
+    test_5()
+    test_6()
+    test_7()
+    test_8()
+    test_9()
+    test_10()
+    test_11()
+    test_12()
+    test_13()
+    test_14()
+    test_15()
+    test_16()
+    test_17()
+    test_18()
+    test_19()
+    test_20()
+    test_21()
+    test_22()
+    test_23()
+    test_24()
+    test_25()
+    test_26()
 
 
 def test_1():
@@ -385,8 +1045,992 @@ def test_4():
     print("#### Passed TestCase_4 ####\n\n")
 
 
+def test_5():
+
+    print("TestCase 5: #### Blocks link by hash and commit to their transactions with a merkle root")
+    Scrooge = ScroogeCoin()
+    users = [User(Scrooge) for i in range(10)]
+    Scrooge.create_coins({users[0].address: 10, users[1].address: 10})
+    Scrooge.create_coins({users[2].address: 10})
+    Scrooge.mine()
+    Scrooge.create_coins({users[3].address: 10})
+    Scrooge.mine()
+
+    assert Scrooge.chain[1]["previous_hash"] == Scrooge.chain[0]["hash"]
+    assert Scrooge.chain[0]["merkle_root"] == merkle_root([tx["hash"] for tx in Scrooge.chain[0]["transactions"]])
+    assert Scrooge.chain[1]["hash"] == Scrooge.hash(block_header(Scrooge.chain[1]))
+
+    # a chain in the old format nests the previous block and gets relinked
+    legacy = [dict(block) for block in Scrooge.chain]
+    legacy[0]["previous_hash"] = None
+    legacy[1]["previous_hash"] = legacy[0]
+    for block in legacy:
+        del block["merkle_root"]
+    migrated = Scrooge.migrate_chain(legacy)
+    assert migrated[1]["previous_hash"] == migrated[0]["hash"]
+    assert migrated[1]["hash"] == Scrooge.chain[1]["hash"]
+    assert ecdsa.verify(migrated[1]["signature"], migrated[1]["hash"], Scrooge.public_key, curve=curve.secp256k1)
+
+    # transactions from before multi input have one location, coins were created at block -1
+    coinbase = {"sender": Scrooge.address, "location": {"block": -1, "tx": -1}, "receivers": {users[4].address: 10}}
+    coinbase["hash"] = Scrooge.hash(canonical.tx_body(coinbase))
+    coinbase["signature"] = Scrooge.sign(coinbase["hash"])
+    spend = {"sender": users[4].address, "location": {"block": 0, "tx": 0}, "receivers": {users[5].address: 10}}
+    spend["hash"] = users[4].hash(canonical.tx_body(spend))
+    spend["signature"] = users[4].sign(spend["hash"])
+    legacy = [{"previous_hash": None, "index": 0, "transactions": [coinbase], "hash": "00"}]
+    legacy.append({"previous_hash": legacy[0], "index": 1, "transactions": [spend], "hash": "01"})
+    Scrooge.chain = Scrooge.migrate_chain(legacy)
+    Scrooge.remember_key(users[4].address, users[4].public_key)
+    report = Auditor(Scrooge, processes=1).audit()
+    assert report["failures"] == [] and report["verified_height"] == 2
+    # and they are no debit of Scrooge's in the address history
+    assert Scrooge.address not in AddressIndex(Scrooge.chain).entries
+    print("#### Passed TestCase_5 ####\n\n")
+
+
+def test_6():
+
+    print("TestCase 6: #### A compact ledger accepts both compact and dict transactions")
+    Scrooge = ScroogeCoin(compact=True)
+    users = [User(Scrooge) for i in range(10)]
+    Scrooge.create_coins({users[0].address: 10, bytes.fromhex(users[1].address): 10})
+    Scrooge.mine()
+    assert isinstance(Scrooge.chain[0], Block)
+    assert Block.from_dict(to_dict(Scrooge.chain[0])).to_dict() == to_dict(Scrooge.chain[0])
+
+    tx = users[0].send_tx({users[2].address: 10}, Scrooge.get_user_tx_positions(users[0].address), compact=True)
+    assert Transaction.from_dict(tx.to_dict()).to_dict() == tx.to_dict()
+    assert Scrooge.add_tx(tx, users[0].public_key) == True
+    # only the 32 byte digest stays with the transaction once it is hashed
+    assert len(tx._digest) == 32 and tx.digest == tx["hash"]
+    # so does the digest of a chain on another backend, with the name of the backend
+    assert canonical.digest(tx, "blake2b") == hashlib.blake2b(tx.encoded, digest_size=32).hexdigest()
+    assert tx._hash_name == "blake2b" and len(tx._digest) == 32
+    tx = users[1].send_tx({users[3].address: 10}, Scrooge.get_user_tx_positions(users[1].address))
+    assert Scrooge.add_tx(tx, users[1].public_key) == True
+    Scrooge.mine()
+
+    assert Scrooge.show_user_balance(users[0].address) == 0
+    assert Scrooge.show_user_balance(users[2].address) == 10
+    assert Scrooge.show_user_balance(users[3].address) == 10
+    assert Scrooge.chain[1]["hash"] == Scrooge.hash(block_header(Scrooge.chain[1]))
+    print("#### Passed TestCase_6 ####\n\n")
+
+
+def test_7():
+
+    print("TestCase 7: #### Spend several inputs with one multi input transaction")
+    Scrooge = ScroogeCoin()
+    users = [User(Scrooge) for i in range(10)]
+    Scrooge.create_coins({users[0].address: 10})
+    Scrooge.create_coins({users[0].address: 5})
+    Scrooge.mine()
+    Scrooge.create_coins({users[0].address: 1})
+    Scrooge.mine()
+    user_0_tx_locations = Scrooge.get_user_tx_positions(users[0].address)
+    assert len(user_0_tx_locations) == 3
+
+    # inputs and outputs have to add up, and an input can not be listed twice
+    tx = users[0].send_tx({users[1].address: 15}, user_0_tx_locations)
+    assert Scrooge.add_tx(tx, users[0].public_key) == False
+    tx = users[0].send_tx({users[1].address: 20}, user_0_tx_locations[:1] * 2)
+    assert Scrooge.add_tx(tx, users[0].public_key) == False
+
+    tx = users[0].send_tx({users[1].address: 12, users[2].address: 4}, user_0_tx_locations)
+    assert Scrooge.add_tx(tx, users[0].public_key) == True
+    # the same inputs can not be spent again while the first spend is pending
+    tx = users[0].send_tx({users[3].address: 1}, user_0_tx_locations[2:])
+    assert Scrooge.add_tx(tx, users[0].public_key) == False
+    Scrooge.mine()
+
+    assert Scrooge.show_user_balance(users[0].address) == 0
+    assert Scrooge.show_user_balance(users[1].address) == 12
+    assert Scrooge.show_user_balance(users[2].address) == 4
+
+    # single location transactions from before multi input still validate
+    location = Scrooge.get_user_tx_positions(users[1].address)[0]
+    tx = {"sender": users[1].address, "location": location, "receivers": {users[3].address: 12}}
+    tx["hash"] = users[1].hash(tx)
+    tx["signature"] = users[1].sign(tx["hash"])
+    assert Transaction.from_dict(tx).to_dict() == tx
+    assert Scrooge.add_tx(Transaction.from_dict(tx), users[1].public_key) == True
+    print("#### Passed TestCase_7 ####\n\n")
+
+
+def test_8():
+
+    print("TestCase 8: #### Run the ledger on a sqlite store and restart it")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "ledger.db")
+        Scrooge = ScroogeCoin(store=SqliteChain(path))
+        users = [User(Scrooge) for i in range(10)]
+        Scrooge.create_coins({users[0].address: 10, users[1].address: 10})
+        Scrooge.mine()
+        tx = users[0].send_tx({users[1].address: 4, users[0].address: 6}, Scrooge.get_user_tx_positions(users[0].address))
+        assert Scrooge.add_tx(tx, users[0].public_key) == True
+        # the sender's key is written in the commit of the next block, not in one of its own
+        stored_keys = "SELECT COUNT(*) FROM public_keys WHERE address = ?"
+        assert Scrooge.chain.conn.execute(stored_keys, (users[0].address,)).fetchone()[0] == 0
+        Scrooge.mine()
+        assert Scrooge.chain.conn.execute(stored_keys, (users[0].address,)).fetchone()[0] == 1
+        assert Scrooge.add_tx(tx, users[0].public_key) == False
+        # the store writes the body encodings made by validation, the same bytes as encoding the whole tx
+        assert canonical.dumps_tx(tx, canonical.dumps(canonical.tx_body(tx))) == canonical.dumps(tx)
+        for body, in Scrooge.chain.conn.execute("SELECT body FROM transactions"):
+            assert body == json.dumps(json.loads(body), sort_keys=True)
+        Scrooge.chain.close()
+
+        Scrooge = ScroogeCoin(store=SqliteChain(path))
+        assert len(Scrooge.chain) == 2
+        assert Scrooge.chain[-1]["previous_hash"] == Scrooge.chain[0]["hash"]
+        assert Scrooge.chain[1]["transactions"][0] == tx
+        assert Scrooge.public_keys[users[0].address] == (users[0].public_key.x, users[0].public_key.y)
+        assert Scrooge.show_user_balance(users[0].address) == 6
+        assert Scrooge.show_user_balance(users[1].address) == 14
+        assert Scrooge.add_tx(tx, users[0].public_key) == False
+
+        tx = users[1].send_tx({users[2].address: 14}, Scrooge.get_user_tx_positions(users[1].address))
+        assert Scrooge.add_tx(tx, users[1].public_key) == True
+        # balances and spent outputs are read from the store's tables, at the height of each view
+        view = Scrooge.view()
+        block = Scrooge.mine()
+        assert ecdsa.verify(block["signature"], block["hash"], Scrooge.public_key, curve=curve.secp256k1)
+        assert Scrooge.show_user_balance(users[2].address) == 14
+        assert view.balance(users[2].address) == 0 and view.is_unspent(1, 0, users[1].address)
+        assert not Scrooge.state.is_unspent(1, 0, users[1].address)
+        Scrooge.chain.close()
+    print("#### Passed TestCase_8 ####\n\n")
+
+
+def test_9():
+
+    print("TestCase 9: #### Restart from a state snapshot and replay only the newer blocks")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "ledger.db")
+        snapshots = os.path.join(directory, "snapshots")
+        Scrooge = ScroogeCoin(store=SqliteChain(path), snapshot_dir=snapshots, snapshot_every=2)
+        users = [User(Scrooge) for i in range(10)]
+        Scrooge.create_coins({users[0].address: 10, users[1].address: 10})
+        Scrooge.mine()
+        tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address))
+        assert Scrooge.add_tx(tx, users[0].public_key) == True
+        Scrooge.mine()
+        Scrooge.create_coins({users[2].address: 5})
+        Scrooge.mine()
+        assert len(list_snapshots(snapshots)) == 1
+        balances, unspent = Scrooge.state.balances, Scrooge.state.unspent
+        Scrooge.chain.close()
+
+        chain = SqliteChain(path)
+        state, replayed = restore_state(chain, snapshots)
+        assert replayed == 1
+        assert state.balances == balances
+        assert state.unspent == unspent
+
+        Scrooge = ScroogeCoin(store=chain, snapshot_dir=snapshots)
+        assert Scrooge.show_user_balance(users[1].address) == 20
+        assert Scrooge.add_tx(tx, users[0].public_key) == False
+
+        # a damaged snapshot is skipped and the chain is replayed from the start
+        with open(list_snapshots(snapshots)[0], "r+b") as snapshot:
+            snapshot.seek(100)
+            snapshot.write(b"x")
+        state, replayed = restore_state(chain, snapshots)
+        assert replayed == 3
+        assert state.balances == Scrooge.state.balances
+
+        # a new in memory node imports the chain and starts from the newest snapshot that matches it
+        exported = os.path.join(directory, "ledger.chain")
+        Scrooge.export_chain(exported)
+        marked, _ = restore_state(chain[:2])
+        # an address only the snapshot knows shows it was loaded instead of replaying every block,
+        # it replaces the damaged snapshot at the same height
+        marked.balances["00" * 32] = 0
+        write_snapshot(marked, snapshots)
+        node = ScroogeCoin(private_key=Scrooge.private_key, snapshot_dir=snapshots)
+        assert node.import_chain(exported) == 3
+        assert node.state.balances == dict(Scrooge.state.balances, **{"00" * 32: 0})
+        assert node.state.unspent == Scrooge.state.unspent and node.view().balance(users[1].address) == 20
+        chain.close()
+    print("#### Passed TestCase_9 ####\n\n")
+
+
+def test_10():
+
+    print("TestCase 10: #### Users created from the same seed get the same keys")
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test seed", 20, processes=2)
+    again = User.from_seed(Scrooge, b"test seed", 5, start=15, processes=1)
+    assert [user.address for user in users[15:]] == [user.address for user in again]
+    assert len(set(user.address for user in users)) == 20
+    assert users[0].public_key == keys.get_public_key(users[0].private_key, curve.secp256k1)
+    # small chunks go to the worker pool, with the same keys
+    pooled = generate_keypairs(b"test seed", 20, processes=2, chunk_size=5)
+    assert [private_key for private_key, _ in pooled] == [user.private_key for user in users]
+
+    Scrooge.create_coins({users[0].address: 10})
+    Scrooge.mine()
+    tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address))
+    assert Scrooge.add_tx(tx, users[0].public_key) == True
+    print("#### Passed TestCase_10 ####\n\n")
+
+
+def test_11():
+
+    print("TestCase 11: #### Signatures that already verified come from the cache")
+    Scrooge = ScroogeCoin()
+    users = [User(Scrooge) for i in range(3)]
+    Scrooge.create_coins({users[0].address: 10})
+    Scrooge.mine()
+    tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address))
+    assert Scrooge.validate_tx(tx, users[0].public_key) == tx
+    assert Scrooge.validate_tx(tx, users[0].public_key) == tx
+    assert Scrooge.signature_cache.stats()["hits"] == 1
+    assert Scrooge.validate_tx(tx, users[0].public_key, audit=True) == tx
+    assert Scrooge.signature_cache.stats()["hits"] == 1
+
+    # a cached signature does not verify for another key
+    assert Scrooge.validate_tx(tx, users[1].public_key) == None
+    assert Scrooge.signature_cache.stats()["misses"] == 2
+    print("#### Passed TestCase_11 ####\n\n")
+
+
+def test_12():
+
+    print("TestCase 12: #### Profile the phases of validation and mining")
+    Scrooge = ScroogeCoin(profile=True)
+    users = [User(Scrooge) for i in range(3)]
+    Scrooge.create_coins({users[0].address: 10})
+    Scrooge.mine()
+    tx = users[0].send_tx({users[1].address: 5}, Scrooge.get_user_tx_positions(users[0].address))
+    assert Scrooge.add_tx(tx, users[0].public_key) == False
+    tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address))
+    assert Scrooge.add_tx(tx, users[0].public_key) == True
+    Scrooge.mine()
+
+    stats = Scrooge.profiler.stats()
+    # the rejected transaction stopped before the signature check
+    assert stats["phases"]["validate_tx.structure"]["calls"] == 2
+    assert stats["phases"]["validate_tx.verify"]["calls"] == 1
+    assert stats["phases"]["mine.sign"]["calls"] == 2
+    assert stats["rejects"] == {"all_spent": 1}
+    assert json.loads(Scrooge.profiler.dump()) == stats
+
+    # nothing is collected unless profiling is turned on
+    Scrooge = ScroogeCoin()
+    Scrooge.mine()
+    assert Scrooge.profiler.stats() == {"phases": {}, "rejects": {}}
+    print("#### Passed TestCase_12 ####\n\n")
+
+
+def test_13():
+
+    print("TestCase 13: #### Mine on size, byte and latency limits")
+    now = [0.0]
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test 13", 4)
+    scheduler = MiningScheduler(Scrooge, MiningPolicy(max_txs=2, max_wait_ms=50), clock=lambda: now[0])
+    Scrooge.create_coins({user.address: 10 for user in users})
+    # create_coins went around the scheduler but is still pending
+    assert scheduler.poll() is None
+    now[0] = 0.05
+    assert scheduler.poll() is not None
+    assert scheduler.metrics()["triggers"] == {"wait": 1}
+
+    txs = [user.send_tx({users[0].address: 10}, Scrooge.get_user_tx_positions(user.address)) for user in users[1:]]
+    assert scheduler.add_tx(txs[0], users[1].public_key) == True
+    assert len(Scrooge.chain) == 1
+    assert scheduler.add_tx(txs[1], users[2].public_key) == True
+    assert len(Scrooge.chain) == 2
+    assert scheduler.add_tx(txs[1], users[2].public_key) == False
+    metrics = scheduler.metrics()
+    assert metrics["triggers"] == {"wait": 1, "txs": 1}
+    assert metrics["fill"]["txs_mean"] == 1.5
+    assert metrics["latency_ms"]["max"] == 50
+
+    # the byte budget seals the pending block before a transaction that would not fit
+    size = len(canonical.dumps(txs[2]))
+    scheduler.policy = MiningPolicy(max_bytes=size + 1)
+    tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address)[:1])
+    assert scheduler.add_tx(tx, users[0].public_key) == True
+    assert scheduler.add_tx(txs[2], users[3].public_key) == True
+    assert len(Scrooge.chain) == 3 and len(Scrooge.chain[-1]["transactions"]) == 1
+    assert scheduler.metrics()["triggers"]["bytes"] == 1
+
+    # a block mined around the scheduler is noticed even when as many transactions are pending again
+    scheduler = MiningScheduler(Scrooge, MiningPolicy(max_wait_ms=50), clock=lambda: now[0])
+    Scrooge.create_coins({users[0].address: 1})
+    assert scheduler.poll() is None
+    Scrooge.mine()
+    now[0] = 1.0
+    Scrooge.create_coins({users[1].address: 1})
+    assert scheduler.poll() is None
+    now[0] = 1.05
+    assert scheduler.poll() is not None and round(scheduler.metrics()["latency_ms"]["max"]) == 50
+    print("#### Passed TestCase_13 ####\n\n")
+
+
+def test_14():
+
+    print("TestCase 14: #### Confirm transactions with merkle proofs")
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test 14", 6)
+    Scrooge.create_coins({user.address: 10 for user in users})
+    Scrooge.mine()
+    txs = [user.send_tx({users[0].address: 10}, Scrooge.get_user_tx_positions(user.address)) for user in users[1:]]
+    for user, tx in zip(users[1:], txs):
+        assert Scrooge.add_tx(tx, user.public_key) == True
+    Scrooge.mine()
+
+    # 5 transactions, odd levels included
+    for i, tx in enumerate(txs):
+        tx_proof = Scrooge.get_tx_proof(1, i)
+        assert len(tx_proof["proof"]) == 3
+        assert users[0].verify_tx_proof(tx_proof, tx["hash"]) == True
+        # proofs survive a trip through json, as a light client would get them
+        assert users[0].verify_tx_proof(json.loads(json.dumps(tx_proof)), tx["hash"]) == True
+    assert users[0].verify_tx_proof(Scrooge.get_tx_proof(0, 0)) == True
+
+    tx_proof = Scrooge.get_tx_proof(1, 2)
+    assert users[0].verify_tx_proof(tx_proof, txs[3]["hash"]) == False
+    assert users[0].verify_tx_proof(dict(tx_proof, tx_index=3)) == False
+    assert users[0].verify_tx_proof(dict(tx_proof, proof=tx_proof["proof"][::-1])) == False
+    assert users[0].verify_tx_proof(dict(tx_proof, header=dict(tx_proof["header"], index=5))) == False
+    # the copy that pads an odd level is no transaction, neither is an inner node of the tree
+    assert users[0].verify_tx_proof(dict(Scrooge.get_tx_proof(1, 4), tx_index=5)) == False
+    assert users[0].verify_tx_proof(dict(tx_proof, tx_count=6)) == False
+    first = Scrooge.get_tx_proof(1, 0)
+    inner = merkle_parent(txs[0]["hash"], txs[1]["hash"])
+    assert users[0].verify_tx_proof(dict(first, tx_hash=inner, proof=first["proof"][1:])) == False
+    hashes = [tx["hash"] for tx in txs[:3]]
+    assert merkle_root(hashes) != merkle_root(hashes + hashes[-1:])
+    # a block signed by somebody other than Scrooge
+    other = ScroogeCoin()
+    other.create_coins({users[0].address: 10})
+    other.mine()
+    assert users[0].verify_tx_proof(other.get_tx_proof(0, 0)) == False
+    print("#### Passed TestCase_14 ####\n\n")
+
+
+def test_15():
+
+    print("TestCase 15: #### Audit the whole ledger, then only the new blocks")
+    directory = tempfile.mkdtemp()
+    Scrooge = ScroogeCoin(store=SqliteChain(os.path.join(directory, "chain.db")))
+    users = User.from_seed(Scrooge, b"test 15", 4)
+    Scrooge.create_coins({user.address: 10 for user in users})
+    Scrooge.mine()
+    for height in range(6):
+        sender, receiver = users[height % 4], users[(height + 1) % 4]
+        positions = [p for p in Scrooge.get_user_tx_positions(sender.address)
+                     if Scrooge.state.is_unspent(p["block"], p["tx"], sender.address)]
+        tx = sender.send_tx({receiver.address: sum(p["amount"] for p in positions)}, positions)
+        assert Scrooge.add_tx(tx, sender.public_key) == True
+        Scrooge.mine()
+
+    checkpoints = os.path.join(directory, "audit")
+    auditor = Auditor(Scrooge, checkpoint_dir=checkpoints, processes=2, chunk_size=2)
+    report = auditor.audit()
+    assert report["failures"] == [] and report["verified_height"] == 7 and report["transactions"] == 7
+    assert auditor.state.unspent == Scrooge.state.unspent
+
+    # a new auditor picks up at the checkpoint, with the keys kept in the store
+    Scrooge.create_coins({users[0].address: 5})
+    Scrooge.mine()
+    Scrooge = ScroogeCoin(store=SqliteChain(os.path.join(directory, "chain.db")))
+    auditor = Auditor(Scrooge, checkpoint_dir=checkpoints, processes=1)
+    assert auditor.verified_height == 7
+    report = auditor.audit()
+    assert report["from_height"] == 7 and report["blocks"] == 1 and report["verified_height"] == 8
+
+    # tampering stops the audit at the damaged block
+    chain = [to_dict(block) for block in Scrooge.chain]
+    Scrooge = ScroogeCoin(private_key=Scrooge.private_key)
+    Scrooge.chain = chain
+    Scrooge.public_keys = dict(Scrooge.public_keys, **{user.address: (user.public_key.x, user.public_key.y) for user in users})
+    receivers = chain[3]["transactions"][0]["receivers"]
+    chain[3]["transactions"][0]["receivers"] = {users[0].address: 1000}
+    report = Auditor(Scrooge, processes=1).audit()
+    assert report["verified_height"] == 3
+    assert [failure["check"] for failure in report["failures"]] == ["hash", "all_spent"]
+
+    chain[3]["transactions"][0]["receivers"] = receivers
+    chain[5]["signature"] = chain[4]["signature"]
+    report = Auditor(Scrooge, processes=2, chunk_size=3).audit()
+    assert report["verified_height"] == 5
+    assert [failure["check"] for failure in report["failures"]] == ["block_signature"]
+    print("#### Passed TestCase_15 ####\n\n")
+
+
+def test_16():
+
+    print("TestCase 16: #### Prune fully spent transactions")
+    for compact in (False, True):
+        Scrooge = ScroogeCoin(compact=compact, prune_depth=2)
+        users = User.from_seed(Scrooge, b"test 16", 3)
+        Scrooge.create_coins({users[0].address: 10, users[1].address: 10})
+        Scrooge.mine()
+        first = users[0].send_tx({users[2].address: 10}, Scrooge.get_user_tx_positions(users[0].address))
+        assert Scrooge.add_tx(first, users[0].public_key) == True
+        Scrooge.mine()
+        # users[1] still holds an output of block 0
+        Scrooge.mine()
+        Scrooge.mine()
+        assert Scrooge.pruned == 0
+        tx = users[1].send_tx({users[2].address: 10}, Scrooge.get_user_tx_positions(users[1].address))
+        assert Scrooge.add_tx(tx, users[1].public_key) == True
+        Scrooge.mine()
+        assert Scrooge.pruned == 1 and Scrooge.chain[0]["transactions"][0]["pruned"] == True
+        tx = users[2].send_tx({users[0].address: 10}, Scrooge.get_user_tx_positions(users[2].address)[:1])
+        assert Scrooge.add_tx(tx, users[2].public_key) == True
+        Scrooge.mine()
+        assert Scrooge.pruned == 2 and to_dict(Scrooge.chain[1]["transactions"][0]) == \
+            {"hash": first["hash"], "pruned": True, "balances": {users[0].address: -10, users[2].address: 10}}
+        # the payment in block 5 is spent in block 6 but needs 2 blocks on top of it
+        tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address)[-1:])
+        assert Scrooge.add_tx(tx, users[0].public_key) == True
+        Scrooge.mine()
+        assert Scrooge.pruned == 2
+        Scrooge.mine()
+        assert Scrooge.pruned == 3
+
+        # balances, validation and proofs keep working
+        assert Scrooge.state.balance(users[1].address) == 10 and Scrooge.state.balance(users[2].address) == 10
+        assert Scrooge.add_tx(first, users[0].public_key) == False
+        assert Scrooge.get_user_tx_positions(users[2].address) == [{"block": 4, "tx": 0, "amount": 10}]
+        assert users[0].verify_tx_proof(Scrooge.get_tx_proof(4, 0)) == True
+        # the merkle roots vouch for the pruned transactions, and inputs from them count as funded
+        assert Auditor(Scrooge, processes=1).audit()["failures"] == []
+
+        # a pruned chain goes through a chain file and back, its pruned transactions stay pruned
+        path = os.path.join(tempfile.mkdtemp(), "pruned.bin")
+        assert Scrooge.export_chain(path) == 8
+        copy = ScroogeCoin(compact=compact, private_key=Scrooge.private_key)
+        assert copy.import_chain(path) == 8 and Auditor(copy, processes=1).audit()["failures"] == []
+        assert [to_dict(block) for block in copy.chain] == [to_dict(block) for block in Scrooge.chain]
+        assert isinstance(copy.chain[1]["transactions"][0], PrunedTransaction)
+        assert copy.state.unspent == Scrooge.state.unspent
+        # the coins a pruned transaction moved still count for its sender and receivers
+        assert copy.state.balances == Scrooge.state.balances
+        assert restore_state(Scrooge.chain)[0].balances == Scrooge.state.balances
+        # and into a store, which keeps the pruned rows as they are
+        stored = ScroogeCoin(compact=compact, store=SqliteChain(":memory:", compact=compact))
+        assert stored.import_chain(path) == 8
+        assert [to_dict(block) for block in stored.chain] == [to_dict(block) for block in Scrooge.chain]
+        assert stored.state.unspent == Scrooge.state.unspent and stored.state.balances == Scrooge.state.balances
+        assert stored.view().balance(users[0].address) == Scrooge.state.balance(users[0].address)
+        stored.chain.close()
+        wallet = Wallet(users[2])
+        with ChainReader(path) as reader:
+            assert wallet.sync(reader) == 8
+        assert wallet.unspent == {(4, 0): 10}
+    print("#### Passed TestCase_16 ####\n\n")
+
+
+def test_17():
+
+    print("TestCase 17: #### Validate on address shards, mine the same blocks")
+    plain = ScroogeCoin()
+    Scrooge = ScroogeCoin(private_key=plain.private_key)
+    users = User.from_seed(Scrooge, b"test 17", 8)
+    ledger = ShardedLedger(Scrooge, shards=3)
+    for coin in (plain, Scrooge):
+        coin.create_coins({user.address: 10 for user in users})
+    plain.mine()
+    ledger.mine()
+
+    for height in range(3):
+        batch = []
+        for i, user in enumerate(users):
+            positions = [p for p in plain.get_user_tx_positions(user.address)
+                         if plain.state.is_unspent(p["block"], p["tx"], user.address)]
+            total = sum(p["amount"] for p in positions)
+            batch.append((user.send_tx({users[(i + height + 1) % 8].address: total}, positions), user.public_key))
+        # the same inputs twice in one batch, and a payment with another user's key
+        batch.append((users[0].send_tx({users[1].address: 10}, batch[0][0]["locations"]), users[0].public_key))
+        batch.append((batch[2][0], users[3].public_key))
+        expected = [plain.add_tx(tx, public_key) for tx, public_key in batch]
+        assert ledger.add_txs(batch) == expected
+        assert expected.count(False) == 2
+        plain.mine()
+        ledger.mine()
+    assert [to_dict(block) for block in Scrooge.chain] == [to_dict(block) for block in plain.chain]
+    for user in users:
+        assert ledger.balance(user.address) == plain.state.balance(user.address)
+
+    # inputs spent by a transaction that went to Scrooge directly are not taken again through the shards
+    positions = [p for p in Scrooge.get_user_tx_positions(users[0].address)
+                 if Scrooge.state.is_unspent(p["block"], p["tx"], users[0].address)]
+    total = sum(p["amount"] for p in positions)
+    direct = users[0].send_tx({users[1].address: total}, positions)
+    around = users[0].send_tx({users[2].address: total}, positions)
+    assert Scrooge.add_tx(direct, users[0].public_key) == True
+    assert ledger.add_tx(around, users[0].public_key) == False
+    assert ledger.mine()["transactions"] == [direct]
+    for user in users:
+        assert ledger.balance(user.address) == Scrooge.state.balance(user.address)
+
+    # a signature the curve math cannot take, or a sender that is no address, is a rejection
+    # and the shards keep working
+    positions = Scrooge.get_user_tx_positions(users[1].address)[-1:]
+    paid = users[1].send_tx({users[2].address: positions[0]["amount"]}, positions)
+    assert ledger.add_txs([(dict(paid, signature=(0, 0)), users[1].public_key),
+                           (dict(paid, sender="bob"), users[1].public_key)]) == [False, False]
+    assert ledger.add_tx(paid, users[1].public_key) == True
+    ledger.close()
+    print("#### Passed TestCase_17 ####\n\n")
+
+
+def test_18():
+
+    print("TestCase 18: #### Export and import the chain as a binary chain file")
+    directory = tempfile.mkdtemp()
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test 18", 3)
+    for height in range(7):
+        Scrooge.create_coins({user.address: height + 1 for user in users})
+        Scrooge.mine()
+    tx = users[0].send_tx({users[1].address: 5}, Scrooge.get_user_tx_positions(users[0].address)[1:3])
+    assert Scrooge.add_tx(tx, users[0].public_key) == True
+    Scrooge.mine()
+
+    for codec in ("zlib", "lzma", "none"):
+        path = os.path.join(directory, "chain-%s.bin" % codec)
+        assert Scrooge.export_chain(path, codec=codec, segment_size=3) == 8
+        copy = ScroogeCoin(compact=True)
+        assert copy.import_chain(path) == 8
+        assert [to_dict(block) for block in copy.chain] == Scrooge.chain
+        assert copy.state.balances == Scrooge.state.balances
+        with ChainReader(path, decode=decode_block) as reader:
+            assert len(reader) == 8 and reader[4] == Scrooge.chain[4] and reader[-1] == Scrooge.chain[7]
+            assert [block["index"] for block in reader.blocks(5)] == [5, 6, 7]
+
+    # the public keys of the senders come along, so the imported chain passes an audit
+    audited = ScroogeCoin(store=SqliteChain(":memory:"), private_key=Scrooge.private_key)
+    assert audited.import_chain(path) == 8 and Auditor(audited, processes=1).audit()["failures"] == []
+    audited.chain.close()
+
+    # resuming picks up after the blocks already there, another chain does not fit
+    partial = ScroogeCoin()
+    partial.chain = Scrooge.chain[:5]
+    assert partial.import_chain(path) == 3 and partial.chain == Scrooge.chain
+    other = ScroogeCoin()
+    other.mine()
+    try:
+        other.import_chain(path)
+        assert False
+    except ValueError:
+        pass
+    print("#### Passed TestCase_18 ####\n\n")
+
+
+def test_19():
+
+    print("TestCase 19: #### Read consistent views while another thread mines")
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test 19", 4)
+    blocks = 80
+    errors = []
+
+    def write():
+        for height in range(blocks):
+            Scrooge.create_coins({user.address: 1 for user in users})
+            sender = users[height % 4]
+            positions = [p for p in Scrooge.get_user_tx_positions(sender.address)
+                         if Scrooge.state.is_unspent(p["block"], p["tx"], sender.address)]
+            if positions:
+                tx = sender.send_tx({users[(height + 1) % 4].address: sum(p["amount"] for p in positions)}, positions)
+                Scrooge.add_tx(tx, sender.public_key)
+            Scrooge.mine()
+
+    def read():
+        last = 0
+        while last < blocks:
+            view = Scrooge.view()
+            # every block creates 4 coins and payments only move them
+            total = sum(view.balance(user.address) for user in users)
+            if view.height < last or total != 4 * view.height or view.balance(Scrooge.address) != -total:
+                errors.append((view.height, total))
+            unspent = sum(p["amount"] for user in users for p in Scrooge.get_user_tx_positions(user.address, view.height)
+                          if view.is_unspent(p["block"], p["tx"], user.address))
+            if unspent != total:
+                errors.append((view.height, unspent))
+            last = view.height
+
+    threads = [threading.Thread(target=read) for i in range(4)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    view = Scrooge.view()
+    assert view.height == blocks and view.tip == Scrooge.chain[-1]["hash"]
+    for user in users:
+        assert view.balance(user.address) == Scrooge.state.balance(user.address)
+    assert {key for key in Scrooge.state.unspent if view.is_unspent(*key)} == set(Scrooge.state.unspent)
+    print("#### Passed TestCase_19 ####\n\n")
+
+
+def test_20():
+
+    print("TestCase 20: #### Pick the hash backend of a chain")
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "chain.db")
+    Scrooge = ScroogeCoin(store=SqliteChain(path), hash_name="blake2b")
+    users = User.from_seed(Scrooge, b"test 20", 2)
+    assert users[0].address == hashlib.blake2b(hex(users[0].public_key.x << 256 | users[0].public_key.y).encode(),
+                                               digest_size=32).hexdigest()
+    Scrooge.create_coins({users[0].address: 10})
+    Scrooge.mine()
+    tx = users[0].send_tx({users[1].address: 10}, Scrooge.get_user_tx_positions(users[0].address))
+    assert tx["hash"] == hashlib.blake2b(canonical.dumps(canonical.tx_body(tx)), digest_size=32).hexdigest()
+    assert Scrooge.add_tx(tx, users[0].public_key) == True
+    Scrooge.mine()
+    assert Scrooge.chain[1]["merkle_root"] == merkle_root([tx["hash"]], "blake2b") == \
+        hashlib.blake2b(b"1:" + tx["hash"].encode(), digest_size=32).hexdigest()
+    assert users[1].verify_tx_proof(Scrooge.get_tx_proof(1, 0)) == True
+    assert Auditor(Scrooge, processes=1).audit()["failures"] == []
+
+    # the backend is a parameter of the chain, restarts and exports keep it
+    assert ScroogeCoin(store=SqliteChain(path)).hash_name == "blake2b"
+    try:
+        ScroogeCoin(store=SqliteChain(path), hash_name="sha256")
+        assert False
+    except ValueError:
+        pass
+    Scrooge.export_chain(os.path.join(directory, "chain.bin"))
+    copy = ScroogeCoin(hash_name="blake2b")
+    assert copy.import_chain(os.path.join(directory, "chain.bin")) == 2
+    try:
+        ScroogeCoin().import_chain(os.path.join(directory, "chain.bin"))
+        assert False
+    except ChainFileError:
+        pass
+
+    # a sha256 user does not accept a blake2b proof
+    assert User(ScroogeCoin(private_key=Scrooge.private_key)).verify_tx_proof(Scrooge.get_tx_proof(1, 0)) == False
+    print("#### Passed TestCase_20 ####\n\n")
+
+
+def test_21():
+
+    print("TestCase 21: #### Reject cheapest check first, with a reason")
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test 21", 3)
+    Scrooge.create_coins({users[0].address: 10, users[1].address: 10})
+    Scrooge.mine()
+    positions = Scrooge.get_user_tx_positions(users[0].address)
+    good = users[0].send_tx({users[1].address: 4, users[2].address: 6}, positions)
+
+    def check(tx, public_key=users[0].public_key):
+        return Scrooge.check_tx(tx, public_key)
+
+    assert check({"sender": users[0].address}) is Reason.MALFORMED
+    assert check(dict(good, signature="forged")) is Reason.MALFORMED
+    assert check(dict(good, receivers={})) is Reason.MALFORMED
+    # every address is a hex digest, anything else would break snapshots, shards and compact types later
+    assert check(users[0].send_tx({"bob": 4, users[2].address: 6}, positions)) is Reason.MALFORMED
+    assert check(dict(good, sender=users[0].address.upper())) is Reason.MALFORMED
+    # r and s outside [1, q - 1] would make the curve math raise instead of fail
+    assert check(dict(good, signature=(0, 0))) is Reason.MALFORMED
+    assert check(dict(good, signature=(good["signature"][0], curve.secp256k1.q))) is Reason.MALFORMED
+    assert Scrooge.validate_tx(dict(good, signature=(0, 0)), users[0].public_key) is None
+    assert check(users[0].send_tx({users[1].address: 11, users[2].address: -1}, positions)) is Reason.AMOUNT
+    assert check(users[0].send_tx({users[1].address: 10, users[2].address: 0}, positions)) is Reason.AMOUNT
+    assert check(users[0].send_tx({users[1].address: 10}, positions + positions)) is Reason.FUNDED
+    assert check(users[0].send_tx({users[1].address: 10}, [{"block": 5, "tx": 0}])) is Reason.FUNDED
+    assert check(users[0].send_tx({users[1].address: 9}, positions)) is Reason.ALL_SPENT
+    assert check(dict(good, receivers={users[1].address: 10})) is Reason.HASH
+    assert check(good, users[1].public_key) is Reason.SIGNATURE
+    # a bad hash is not even looked at once the inputs are gone
+    assert check(good) is Reason.OK and Scrooge.add_tx(good, users[0].public_key) == True
+    assert check(dict(good, hash="00")) is Reason.CONSUMED
+
+    stats = Scrooge.reject_stats()
+    assert stats == {"malformed": 8, "amount": 2, "funded": 2, "all_spent": 1, "hash": 1, "signature": 1, "consumed": 1}
+    assert json.loads(json.dumps(stats)) == stats
+
+    # the ingest server turns garbage away before it reaches the signature workers
+    class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+        calls = 0
+
+        def submit(self, *args, **kwargs):
+            CountingExecutor.calls += 1
+            return super().submit(*args, **kwargs)
+
+    executor = CountingExecutor(1)
+    server = IngestServer(Scrooge, batch_size=0, executor=executor)
+    positions = Scrooge.get_user_tx_positions(users[1].address)
+    # as it comes off the wire, json has no tuples
+    bad = json.loads(json.dumps(users[1].send_tx({users[0].address: 15, users[2].address: -5}, positions)))
+    assert asyncio.run(server.submit(bad, users[1].public_key)) == False and CountingExecutor.calls == 0
+    paid = json.loads(json.dumps(users[1].send_tx({users[0].address: 10}, positions)))
+    assert asyncio.run(server.submit(paid, users[1].public_key)) == True and CountingExecutor.calls == 1
+
+    # over the wire a signature the curve math cannot take is an answer, not a dropped connection
+    async def submit_unsigned():
+        address = await server.start()
+        connection = await IngestClient.connect(address)
+        result = await connection.submit_tx(dict(paid, signature=[0, 0]), users[1].public_key)
+        await connection.close()
+        await server.close()
+        return result
+
+    rejected = server.rejected
+    assert asyncio.run(submit_unsigned()) == False and server.rejected == rejected + 1
+    assert precheck(dict(paid, signature=(0, 0)), users[1].public_key.x, users[1].public_key.y) == (True, False)
+    executor.shutdown()
+    print("#### Passed TestCase_21 ####\n\n")
+
+
+def test_22():
+
+    print("TestCase 22: #### Account model: balances and nonces instead of locations")
+    Scrooge = AccountCoin()
+    users = User.from_seed(Scrooge, b"test 22", 3)
+    Scrooge.create_coins({users[0].address: 10, users[1].address: 5})
+    Scrooge.mine()
+    assert Scrooge.get_nonce(users[0].address) == 0
+
+    first = users[0].send_payment({users[1].address: 4, users[2].address: 2}, 0)
+    assert Scrooge.add_tx(first, users[0].public_key) == True
+    # the pending payment takes nonce 0 and 6 of the 10 coins
+    assert Scrooge.get_nonce(users[0].address) == 1
+    assert Scrooge.check_tx(first, users[0].public_key) is Reason.NONCE
+    assert Scrooge.check_tx(users[0].send_payment({users[2].address: 5}, 1), users[0].public_key) is Reason.BALANCE
+    assert Scrooge.check_tx(users[0].send_payment({users[2].address: 4}, 2), users[0].public_key) is Reason.NONCE
+    assert Scrooge.check_tx(dict(first, nonce=True), users[0].public_key) is Reason.MALFORMED
+    second = users[0].send_payment({users[2].address: 4}, 1)
+    assert Scrooge.check_tx(dict(second, receivers={users[1].address: 4}), users[0].public_key) is Reason.HASH
+    assert Scrooge.check_tx(second, users[1].public_key) is Reason.SIGNATURE
+    assert Scrooge.add_tx(second, users[0].public_key) == True
+    before = Scrooge.view()
+    block = Scrooge.mine()
+
+    assert [Scrooge.show_user_balance(user.address) for user in users] == [0, 9, 6]
+    assert before.balance(users[0].address) == 10 and before.nonce(users[0].address) == 0
+    assert Scrooge.view().nonce(users[0].address) == 2 and Scrooge.get_nonce(users[0].address) == 2
+    # replaying a mined payment fails on its nonce
+    assert Scrooge.add_tx(first, users[0].public_key) == False
+    assert Scrooge.reject_stats()["nonce"] == 3
+
+    # same blocks, merkle proofs and chain files as the location model
+    assert users[2].verify_tx_proof(Scrooge.get_tx_proof(1, 1), second["hash"])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "accounts.chain")
+        Scrooge.export_chain(path)
+        copy = AccountCoin(private_key=Scrooge.private_key)
+        assert copy.import_chain(path) == 2 and copy.chain[-1]["hash"] == block["hash"]
+    assert copy.view().balance(users[1].address) == 9 and copy.get_nonce(users[0].address) == 2
+
+    # what only works on unspent outputs says so instead of failing half way
+    for refused in (Scrooge.write_snapshot, lambda: Auditor(Scrooge), lambda: Transaction.from_dict(second),
+                    lambda: ShardedLedger(Scrooge)):
+        try:
+            refused()
+            assert False
+        except ValueError:
+            pass
+    print("#### Passed TestCase_22 ####\n\n")
+
+
+def test_23():
+
+    print("TestCase 23: #### Pay from a wallet that follows the chain from its own height")
+    Scrooge = ScroogeCoin()
+    users = User.from_seed(Scrooge, b"test 23", 3)
+    wallets = [Wallet(user) for user in users]
+    Scrooge.create_coins({users[0].address: 10})
+    Scrooge.mine()
+    Scrooge.create_coins({users[0].address: 5, users[1].address: 1})
+    Scrooge.mine()
+    assert wallets[0].sync(Scrooge.chain) == 2 and wallets[0].sync(Scrooge.chain) == 0
+    assert wallets[0].balance == 15
+
+    # the oldest output pays, the change comes back
+    first = wallets[0].pay({users[1].address: 7})
+    assert first["locations"] == [{"block": 0, "tx": 0}] and first["receivers"][users[0].address] == 3
+    assert wallets[0].available == 5 and wallets[0].balance == 15
+    try:
+        wallets[0].pay({users[1].address: 6})
+        assert False, "only 5 coins are not pending"
+    except InsufficientFunds:
+        pass
+    second = wallets[0].pay({users[2].address: 5})
+    # Scrooge turns down a payment with a forged signature, its input is free again
+    forged = dict(second, signature=first["signature"])
+    assert Scrooge.add_tx(first, users[0].public_key) == True and Scrooge.add_tx(forged, users[0].public_key) == False
+    wallets[0].release(second)
+    assert wallets[0].available == 5
+    assert Scrooge.add_tx(wallets[0].pay({users[2].address: 4}), users[0].public_key) == True
+    Scrooge.mine()
+
+    # only the new block is read
+    assert [wallet.sync(Scrooge.chain) for wallet in wallets] == [1, 3, 3]
+    assert [wallet.balance for wallet in wallets] == [Scrooge.show_user_balance(user.address) for user in users] == [4, 8, 4]
+    assert wallets[0].pending == set()
+    assert Scrooge.add_tx(wallets[1].pay({users[2].address: 8}), users[1].public_key) == True
+
+    # a block that does not follow the last one read is refused
+    lost = Wallet(users[2])
+    try:
+        lost.apply_block(Scrooge.chain[1])
+        assert False, "block 1 does not come first"
+    except ValueError:
+        pass
+    try:
+        wallets[2].pay({users[0].address: 0})
+        assert False, "nothing to pay"
+    except ValueError:
+        pass
+
+    # the example of main(), with wallets: paying does not ask Scrooge for positions
+    Scrooge = ScroogeCoin()
+    users = [User(Scrooge) for i in range(4)]
+    wallets = [Wallet(user) for user in users]
+    Scrooge.create_coins({users[0].address: 10, users[1].address: 20, users[3].address: 50})
+    Scrooge.mine()
+    wallets[0].sync(Scrooge.chain)
+    assert Scrooge.add_tx(wallets[0].pay({users[1].address: 2}), users[0].public_key) == True
+    Scrooge.mine()
+    wallets[1].sync(Scrooge.chain)
+    assert Scrooge.add_tx(wallets[1].pay({users[0].address: 20}), users[1].public_key) == True
+    Scrooge.mine()
+    assert [Scrooge.show_user_balance(user.address) for user in users] == [28, 2, 0, 50]
+    print("#### Passed TestCase_23 ####\n\n")
+
+
+def test_24():
+
+    print("TestCase 24: #### Issue coins to many users in bounded transactions signed in parallel")
+    key = 2 ** 200 + 24
+    Scrooge = ScroogeCoin(private_key=key)
+    users = User.from_seed(Scrooge, b"test 24", 40)
+    Scrooge.create_coins({users[0].address: 1})
+    assert Scrooge.create_coins_bulk({user.address: i + 1 for i, user in enumerate(users)}, chunk_size=2, processes=2) == 20
+    txs = Scrooge.current_transactions[1:]
+    assert [len(tx["receivers"]) for tx in txs] == [2] * 20
+    # queued in the order of the receivers, whatever worker signed them
+    assert [address for tx in txs for address in tx["receivers"]] == [user.address for user in users]
+
+    # signatures are deterministic, the same as one create_coins per chunk signed here
+    serial = ScroogeCoin(private_key=key)
+    for first in range(0, 40, 2):
+        serial.create_coins({user.address: i + 1 for i, user in enumerate(users) if first <= i < first + 2})
+    assert txs == serial.current_transactions
+    receivers = {user.address: i + 1 for i, user in enumerate(users)}
+    assert issue(Scrooge.address, receivers, key, Scrooge.hash_name, 2, processes=1) == txs
+
+    Scrooge.mine()
+    assert [Scrooge.show_user_balance(user.address) for user in users[:3]] == [2, 2, 3]
+    assert Auditor(Scrooge, processes=1).audit()["failures"] == []
+    try:
+        Scrooge.create_coins_bulk({users[0].address: 1}, chunk_size=0)
+        assert False, "a chunk needs a receiver"
+    except ValueError:
+        pass
+    print("#### Passed TestCase_24 ####\n\n")
+
+
+def test_25():
+
+    print("TestCase 25: #### Page through the debits and credits of an address")
+    key = 2 ** 200 + 25
+    memory = ScroogeCoin(private_key=key, prune_depth=1)
+    stored = ScroogeCoin(private_key=key, store=SqliteChain(":memory:"))
+    users = User.from_seed(memory, b"test 25", 3)
+    for Scrooge in (memory, stored):
+        wallets = [Wallet(user) for user in users]
+        Scrooge.create_coins({users[0].address: 10, users[1].address: 10})
+        Scrooge.mine()
+        for height in range(1, 8):
+            for wallet in wallets[:2]:
+                wallet.sync(Scrooge.chain)
+            # users 0 and 1 pass coins back and forth, keeping change, and pay user 2 one coin
+            assert Scrooge.add_tx(wallets[0].pay({users[1].address: 2, users[2].address: 1}), users[0].public_key) == True
+            assert Scrooge.add_tx(wallets[1].pay({users[0].address: 2}), users[1].public_key) == True
+            Scrooge.mine()
+    assert memory.pruned > 0
+
+    full = list(memory.iter_address_history(users[0].address))
+    # issued once, then a debit, its change and the payment from user 1 per block, block 6 pays exactly
+    assert len(full) == 1 + 7 * 3 - 1
+    assert full[:4] == [{"block": 0, "tx": 0, "kind": "credit", "amount": 10},
+                        {"block": 1, "tx": 0, "kind": "debit", "amount": 10},
+                        {"block": 1, "tx": 0, "kind": "credit", "amount": 7},
+                        {"block": 1, "tx": 1, "kind": "credit", "amount": 2}]
+    # pruned transactions keep their history, and the store has the same one
+    assert list(stored.iter_address_history(users[0].address, page_size=4)) == full
+    assert list(memory.iter_address_history(users[2].address, page_size=1)) == \
+        [{"block": height, "tx": 0, "kind": "credit", "amount": 1} for height in range(1, 8)]
+
+    for Scrooge in (memory, stored):
+        page = Scrooge.get_address_history(users[0].address, page_size=5, start_height=2, end_height=4)
+        assert page["entries"] == full[4:9]
+        page = Scrooge.get_address_history(users[0].address, page["cursor"], 5, 2, 4)
+        assert page["entries"] == full[9:10] and page["cursor"] is None
+        assert Scrooge.get_address_history(users[1].address, page_size=3)["cursor"] is not None
+        assert Scrooge.get_address_history("00" * 32) == {"entries": [], "cursor": None}
+        for bad in ({"cursor": "not a cursor"}, {"page_size": 0}):
+            try:
+                Scrooge.get_address_history(users[0].address, **bad)
+                assert False, "%r is refused" % bad
+            except ValueError:
+                pass
+    print("#### Passed TestCase_25 ####\n\n")
+
+
+def test_26():
+
+    print("TestCase 26: #### Rescan only the blocks whose address filter matches")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chain.db")
+        Scrooge = ScroogeCoin(store=SqliteChain(path))
+        users = User.from_seed(Scrooge, b"test 26", 12)
+        wallets = [Wallet(user) for user in users]
+        Scrooge.create_coins({user.address: 10 for user in users[1:]})
+        Scrooge.mine()
+        # users 1 to 11 pay each other in turn, user 0 is only paid in block 6
+        for height in range(1, 12):
+            wallet = wallets[height]
+            wallet.sync(Scrooge.chain)
+            receiver = users[0] if height == 6 else users[height % 11 + 1]
+            assert Scrooge.add_tx(wallet.pay({receiver.address: 3}), users[height].public_key) == True
+            Scrooge.mine()
+        Scrooge.mine()
+
+        entries = Scrooge.get_block_filters()
+        assert len(entries) == 13 and entries[12]["filter"] == EMPTY_FILTER
+        assert [entry["index"] for entry in Scrooge.get_block_filters(10, 20)] == [10, 11, 12]
+        # an address in a block always matches
+        for entry, block in zip(entries, Scrooge.chain):
+            assert entry["hash"] == block["hash"]
+            assert all(entry_matches(entry, [address]) for address in block_addresses(block))
+
+        # the filters are stored with the chain, a store from before them gets them built on open
+        Scrooge.chain.close()
+        conn = sqlite3.connect(path)
+        conn.execute("DELETE FROM filters WHERE block >= 5")
+        conn.commit()
+        conn.close()
+        Scrooge = ScroogeCoin(store=SqliteChain(path))
+        assert Scrooge.get_block_filters() == entries
+
+        # blocks without user 0 are skipped, the balance is the same as reading them all
+        filtered, full = Wallet(users[0]), Wallet(users[0])
+        assert filtered.sync(Scrooge.chain, Scrooge.block_filters) <= 2
+        assert full.sync(Scrooge.chain) == 13
+        assert (filtered.height, filtered.tip, filtered.unspent) == (full.height, full.tip, full.unspent)
+        assert filtered.balance == Scrooge.show_user_balance(users[0].address) == 3
+        try:
+            Wallet(users[0]).skip_block(entries[1])
+            assert False, "block 1 does not come first"
+        except ValueError:
+            pass
+        Scrooge.chain.close()
+    print("#### Passed TestCase_26 ####\n\n")
 
 
 if __name__ == '__main__':
    main()
-
@@ -0,0 +1,102 @@
+from ledger_state import MAX_VIEW_DEPTH
+
+
+# Account model: instead of pointing at earlier outputs, a transaction names
+# the next nonce of its sender and is paid from the sender's balance
+#
+#   {"sender": address, "nonce": n, "receivers": {address: amount, ...}, "hash": ..., "signature": ...}
+#
+# nonces start at 0 and go up by one per mined transaction of the sender, so a
+# signed transaction can not be replayed. Coins Scrooge creates carry no nonce.
+
+
+def is_account_tx(tx):
+    return "nonce" in tx
+
+
+class AccountState(object):
+    """
+    State of an account chain: the balance and the next nonce of every address
+    validating a transaction is one lookup of each
+    """
+
+    def __init__(self):
+        # number of blocks applied and hash of the last one
+        self.height = 0
+        self.tip = None
+        # {address: balance}
+        self.balances = {}
+        # {address: nonce of its next transaction}
+        self.nonces = {}
+
+    def apply_block(self, block):
+        """
+        debits the senders, bumps their nonces and credits the receivers of every transaction in block
+        :param block: Block, must be the block at self.height
+        """
+        for tx in block["transactions"]:
+            sender = tx["sender"]
+            if is_account_tx(tx):
+                self.balances[sender] = self.balances.get(sender, 0) - sum(tx["receivers"].values())
+                self.nonces[sender] = tx["nonce"] + 1
+            for receiver, amount in tx["receivers"].items():
+                self.balances[receiver] = self.balances.get(receiver, 0) + amount
+        self.height = block["index"] + 1
+        self.tip = block["hash"]
+
+    def balance(self, address):
+        return self.balances.get(address, 0)
+
+    def nonce(self, address):
+        return self.nonces.get(address, 0)
+
+
+class AccountView(object):
+    """
+    Read only AccountState at one height, layered like ledger_state.StateView:
+    a view holds the accounts its block touched and asks its parents for the rest
+    """
+
+    def __init__(self, height, tip, balances, nonces, parent=None):
+        self.height = height
+        self.tip = tip
+        self.balances = balances
+        self.nonces = nonces
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+
+    @classmethod
+    def copy_of(cls, state):
+        return cls(state.height, state.tip, dict(state.balances), dict(state.nonces))
+
+    def extend(self, state, block):
+        """
+        :param state: AccountState that block was just applied to
+        :return: the view after block
+        """
+        if self.depth + 1 >= MAX_VIEW_DEPTH:
+            return AccountView.copy_of(state)
+        balances, nonces = {}, {}
+        for tx in block["transactions"]:
+            sender = tx["sender"]
+            balances[sender] = state.balance(sender)
+            if is_account_tx(tx):
+                nonces[sender] = state.nonce(sender)
+            for receiver in tx["receivers"]:
+                balances[receiver] = state.balance(receiver)
+        return AccountView(state.height, state.tip, balances, nonces, self)
+
+    def _lookup(self, layer, key):
+        view = self
+        while view is not None:
+            table = getattr(view, layer)
+            if key in table:
+                return table[key]
+            view = view.parent
+        return 0
+
+    def balance(self, address):
+        return self._lookup("balances", address)
+
+    def nonce(self, address):
+        return self._lookup("nonces", address)
@@ -0,0 +1,208 @@
+import multiprocessing
+
+from fastecdsa import ecdsa, curve, point
+
+import canonical
+from accounts import AccountState
+from keygen import address_of
+from ledger_state import LedgerState, SnapshotError, is_issuance, list_snapshots, load_snapshot, tx_locations, write_snapshot
+from merkle import merkle_root
+from validation import is_amount
+
+
+# {address: (x, y)} of the audited chain in a worker process, set once by _init_worker
+# instead of being pickled into every task
+_worker_keys = {}
+
+
+def _init_worker(public_keys):
+    global _worker_keys
+    _worker_keys = public_keys
+
+
+def _check_blocks(args, public_keys=None):
+    # runs in the worker processes: every check that needs no ledger state
+    # public_keys is only passed when the blocks are checked in this process
+    blocks, previous_hash, scrooge_key, hash_name = args
+    if public_keys is None:
+        public_keys = _worker_keys
+    scrooge_key = point.Point(*scrooge_key, curve=curve.secp256k1)
+    keys = {}
+    failures = []
+    for block in blocks:
+        index = block["index"]
+        if isinstance(block["previous_hash"], dict) or "merkle_root" not in block:
+            failures.append({"block": index, "tx": None, "check": "legacy"})
+            previous_hash = block["hash"]
+            continue
+        header = {"previous_hash": block["previous_hash"], "index": index, "merkle_root": block["merkle_root"]}
+        if block["previous_hash"] != previous_hash:
+            failures.append({"block": index, "tx": None, "check": "previous_hash"})
+        if merkle_root([tx["hash"] for tx in block["transactions"]], hash_name) != block["merkle_root"]:
+            failures.append({"block": index, "tx": None, "check": "merkle_root"})
+        if canonical.digest(header, hash_name) != block["hash"]:
+            failures.append({"block": index, "tx": None, "check": "block_hash"})
+        elif not ecdsa.verify(tuple(block["signature"]), block["hash"], scrooge_key, curve=curve.secp256k1):
+            failures.append({"block": index, "tx": None, "check": "block_signature"})
+
+        for tx_index, tx in enumerate(block["transactions"]):
+            sender = tx["sender"]
+            if tx.get("pruned"):
+                # only the hash is left, the merkle root above vouches for it
+                continue
+            if canonical.digest(canonical.tx_body(tx), hash_name) != tx["hash"]:
+                failures.append({"block": index, "tx": tx_index, "check": "hash"})
+                continue
+            if sender not in keys:
+                xy = public_keys.get(sender)
+                key = None if xy is None else point.Point(*xy, curve=curve.secp256k1)
+                # the address is derived from the key, a key for another address proves nothing
+                keys[sender] = key if key is not None and address_of(key, hash_name) == sender else None
+            if keys[sender] is None:
+                failures.append({"block": index, "tx": tx_index, "check": "public_key"})
+            elif not ecdsa.verify(tuple(tx["signature"]), tx["hash"], keys[sender], curve=curve.secp256k1):
+                failures.append({"block": index, "tx": tx_index, "check": "signature"})
+        previous_hash = block["hash"]
+    return failures
+
+
+def is_pruned_output(chain, location):
+    """
+    True if the output at location belongs to a transaction that was pruned, the merkle
+    root of its block vouches for it but its amounts are gone
+    """
+    if chain is None or not (0 <= location["block"] < len(chain)):
+        return False
+    transactions = chain[location["block"]]["transactions"]
+    return 0 <= location["tx"] < len(transactions) and bool(transactions[location["tx"]].get("pruned"))
+
+
+def check_funding(state, block, scrooge_address, chain=None):
+    """
+    the stateful rules for one block: every input is an unspent output of the
+    sender, used once, the inputs add up to the outputs, and every amount paid is positive
+    only Scrooge may create coins, with a transaction that has no inputs
+    (or the block -1 location of chains from before multi input)
+    pruned transactions are not checked, and an input from one of them is taken as funded,
+    without its amount the sum of the inputs cannot be checked
+    :param state: LedgerState of the blocks before block
+    :param chain: the audited chain, to tell inputs from pruned transactions
+    :return: [{"block", "tx", "check"}, ...]
+    """
+    failures = []
+    used = set()
+    for tx_index, tx in enumerate(block["transactions"]):
+        if tx.get("pruned"):
+            continue
+        sender = tx["sender"]
+        locations = tx_locations(tx)
+        outputs = sum(tx["receivers"].values())
+        if is_issuance(tx):
+            if sender != scrooge_address:
+                failures.append({"block": block["index"], "tx": tx_index, "check": "funded"})
+            continue
+        if not all(is_amount(amount) for amount in tx["receivers"].values()):
+            failures.append({"block": block["index"], "tx": tx_index, "check": "amount"})
+        inputs = 0
+        from_pruned = False
+        for location in locations:
+            key = (location["block"], location["tx"], sender)
+            if key in used:
+                failures.append({"block": block["index"], "tx": tx_index, "check": "consumed"})
+            elif key in state.unspent:
+                inputs += state.unspent[key]
+            elif is_pruned_output(chain, location):
+                from_pruned = True
+            else:
+                failures.append({"block": block["index"], "tx": tx_index, "check": "funded"})
+            used.add(key)
+        if inputs != outputs and not from_pruned:
+            failures.append({"block": block["index"], "tx": tx_index, "check": "all_spent"})
+    return failures
+
+
+class Auditor(object):
+    """
+    Re-verifies a ScroogeCoin chain end to end
+    block hashes and signatures, transaction hashes and signatures are checked
+    in a process pool, then the funding and double spend rules are replayed in
+    one ordered pass. Everything up to verified_height passed, the next audit
+    starts there, and with checkpoint_dir it survives restarts as a snapshot
+    of the replayed state.
+    """
+
+    def __init__(self, Scrooge, checkpoint_dir=None, processes=None, chunk_size=50):
+        """
+        :param Scrooge: ScroogeCoin whose chain is audited
+        :param checkpoint_dir: directory for the verified state, kept in memory only if None
+        :param processes: number of worker processes, 1 checks everything in this process
+        :param chunk_size: blocks per task handed to a worker
+        """
+        if isinstance(Scrooge.state, AccountState):
+            raise ValueError("the audit replays unspent outputs, an AccountCoin chain has none")
+        self.Scrooge = Scrooge
+        self.checkpoint_dir = checkpoint_dir
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.state = self.load_checkpoint()
+
+    @property
+    def verified_height(self):
+        return self.state.height
+
+    def load_checkpoint(self):
+        """
+        :return: the newest checkpoint that still matches the chain, an empty state if there is none
+        """
+        chain = self.Scrooge.chain
+        for path in list_snapshots(self.checkpoint_dir):
+            try:
+                state = load_snapshot(path)
+            except SnapshotError:
+                continue
+            if state.height <= len(chain) and (state.height == 0 or chain[state.height - 1]["hash"] == state.tip):
+                return state
+        return LedgerState()
+
+    def audit(self):
+        """
+        verifies the blocks mined since verified_height
+        stops at the first block that fails, so verified_height never moves past it
+        :return: {"from_height", "verified_height", "blocks", "transactions", "failures": [{"block", "tx", "check"}, ...]}
+        """
+        chain = self.Scrooge.chain
+        start, stop = self.state.height, len(chain)
+        previous_hash = chain[start - 1]["hash"] if start > 0 else None
+        scrooge_key = (self.Scrooge.public_key.x, self.Scrooge.public_key.y)
+        public_keys = dict(self.Scrooge.public_keys)
+
+        tasks = []
+        for first in range(start, stop, self.chunk_size):
+            blocks = chain[first:min(first + self.chunk_size, stop)]
+            tasks.append((blocks, previous_hash, scrooge_key, self.Scrooge.hash_name))
+            previous_hash = blocks[-1]["hash"]
+        if self.processes == 1 or len(tasks) <= 1:
+            results = [_check_blocks(task, public_keys) for task in tasks]
+        else:
+            with multiprocessing.get_context("forkserver").Pool(
+                    self.processes, initializer=_init_worker, initargs=(public_keys,)) as pool:
+                results = pool.map(_check_blocks, tasks)
+
+        failed = {}
+        for failures in results:
+            for failure in failures:
+                failed.setdefault(failure["block"], []).append(failure)
+
+        report = {"from_height": start, "verified_height": start, "blocks": 0, "transactions": 0, "failures": []}
+        for block in (block for task in tasks for block in task[0]):
+            failures = failed.get(block["index"], []) + check_funding(self.state, block, self.Scrooge.address, chain)
+            if failures:
+                report["failures"] = failures
+                break
+            self.state.apply_block(block)
+            report["blocks"] += 1
+            report["transactions"] += len(block["transactions"])
+        report["verified_height"] = self.state.height
+        if self.checkpoint_dir is not None and report["blocks"]:
+            write_snapshot(self.state, self.checkpoint_dir)
+        return report
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+from Scrooge_coin_assignmnet import AccountCoin, ScroogeCoin, User
+
+
+# The same workload on both ledger models: every user is funded with 10 coins,
+# then in every round each user passes 10 coins on to the next user.
+# Transactions are signed before the clock starts, so the table shows what
+# add_tx and mine cost, and the profiler splits add_tx into its checks.
+
+
+def utxo_rounds(accounts, rounds):
+    """
+    :return: [[(tx, public_key), ...] per round], each spending the output the round before paid
+    """
+    # the coins Scrooge created are all in tx 0 of block 0
+    positions = {user.address: {"block": 0, "tx": 0} for user in accounts}
+    batches = []
+    for round_ in range(rounds):
+        batch = []
+        for i, user in enumerate(accounts):
+            batch.append((user.send_tx({accounts[(i + 1) % len(accounts)].address: 10}, [positions[user.address]]),
+                          user.public_key))
+        # block 1 + round_ holds the batch in order, tx i pays the user after i
+        positions = {accounts[(i + 1) % len(accounts)].address: {"block": 1 + round_, "tx": i}
+                     for i in range(len(accounts))}
+        batches.append(batch)
+    return batches
+
+
+def account_rounds(accounts, rounds):
+    return [[(user.send_payment({accounts[(i + 1) % len(accounts)].address: 10}, round_), user.public_key)
+             for i, user in enumerate(accounts)] for round_ in range(rounds)]
+
+
+def run(model, users, rounds, seed=b"accounts"):
+    Scrooge = AccountCoin(profile=True) if model == "account" else ScroogeCoin(profile=True)
+    accounts = User.from_seed(Scrooge, seed, users)
+    Scrooge.create_coins({user.address: 10 for user in accounts})
+    Scrooge.mine()
+    batches = (account_rounds if model == "account" else utxo_rounds)(accounts, rounds)
+
+    add_seconds = mine_seconds = 0.0
+    for batch in batches:
+        start = time.perf_counter()
+        for tx, public_key in batch:
+            assert Scrooge.add_tx(tx, public_key)
+        add_seconds += time.perf_counter() - start
+        start = time.perf_counter()
+        Scrooge.mine()
+        mine_seconds += time.perf_counter() - start
+
+    txs = users * rounds
+    phases = Scrooge.profiler.stats()["phases"]
+    checks = {name.split(".", 1)[1]: stats["seconds"] / stats["calls"] * 1e6
+              for name, stats in phases.items() if name.startswith("validate_tx.")}
+    assert all(Scrooge.view().balance(user.address) == 10 for user in accounts)
+    return {"model": model, "txs": txs, "add_tx_per_s": txs / add_seconds, "mine_ms": mine_seconds / rounds * 1e3,
+            "checks_us": checks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="utxo and account ledger models on the same payments")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    print("{:<8} {:>6} {:>12} {:>10}  {}".format("model", "txs", "add_tx/s", "mine ms", "checks us per tx"))
+    for model in ("utxo", "account"):
+        row = run(model, args.users, args.rounds)
+        checks = " ".join("%s=%.1f" % (name, us) for name, us in row["checks_us"].items())
+        print("{:<8} {:>6} {:>12.1f} {:>10.2f}  {}".format(row["model"], row["txs"], row["add_tx_per_s"],
+                                                          row["mine_ms"], checks))
+
+
+if __name__ == '__main__':
+    main()
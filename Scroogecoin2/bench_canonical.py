@@ -0,0 +1,40 @@
+import hashlib
+import json
+import timeit
+
+import canonical
+
+
+def sample_tx(i):
+    """
+    a transaction shaped like the ones User.send_tx creates
+    """
+    return {
+        "sender": hashlib.sha256(b"sender%d" % i).hexdigest(),
+        "locations": [{"block": i, "tx": i % 7}],
+        "receivers": {hashlib.sha256(b"receiver%d" % r).hexdigest(): r + 1 for r in range(3)},
+        "hash": hashlib.sha256(b"hash%d" % i).hexdigest(),
+        "signature": (2 ** 255 + i, 2 ** 254 + i),
+    }
+
+
+def json_digest(blob):
+    return hashlib.sha256(json.dumps(blob, sort_keys=True).encode()).hexdigest()
+
+
+def main():
+    txs = [sample_tx(i) for i in range(100)]
+    for tx in txs:
+        assert canonical.dumps(tx) == json.dumps(tx, sort_keys=True).encode()
+
+    number = 200
+    slow = timeit.timeit(lambda: [json_digest(tx) for tx in txs], number=number)
+    fast = timeit.timeit(lambda: [canonical.digest(tx) for tx in txs], number=number)
+    count = number * len(txs)
+    print("json.dumps + sha256   : {:.2f} us/tx".format(slow / count * 1e6))
+    print("canonical.digest      : {:.2f} us/tx".format(fast / count * 1e6))
+    print("speedup               : {:.2f}x".format(slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+
+from chainfile import ChainReader, export_chain, import_chain
+
+
+POW_CHAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ProofOfWork", "chain.json")
+
+
+def sample_chain(blocks, txs_per_block):
+    """
+    blocks shaped like the ones ScroogeCoin.mine creates
+    """
+    chain = []
+    previous_hash = None
+    for index in range(blocks):
+        transactions = [{
+            "sender": hashlib.sha256(b"sender%d" % (index * txs_per_block + i)).hexdigest(),
+            "locations": [{"block": max(0, index - 1), "tx": i}],
+            "receivers": {hashlib.sha256(b"receiver%d" % r).hexdigest(): r + 1 for r in range(2)},
+            "hash": hashlib.sha256(b"tx%d.%d" % (index, i)).hexdigest(),
+            "signature": [2 ** 255 + i, 2 ** 254 + index],
+        } for i in range(txs_per_block)]
+        block = {
+            "previous_hash": previous_hash,
+            "index": index,
+            "merkle_root": hashlib.sha256(b"root%d" % index).hexdigest(),
+            "transactions": transactions,
+            "hash": hashlib.sha256(b"block%d" % index).hexdigest(),
+            "signature": [2 ** 255 + index, 2 ** 254 + index],
+        }
+        chain.append(block)
+        previous_hash = block["hash"]
+    return chain
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def bench(name, chain, directory):
+    rows = []
+    for label, indent in (("json indent=4", 4), ("json compact", None)):
+        path = os.path.join(directory, "chain.json")
+
+        def write():
+            with open(path, "w") as outfile:
+                json.dump(chain, outfile, sort_keys=True, indent=indent)
+
+        _, write_seconds = timed(write)
+        loaded, load_seconds = timed(lambda: json.load(open(path)))
+        assert loaded == chain
+        # without an index the whole file is parsed to reach one block
+        _, seek_seconds = timed(lambda: json.load(open(path))[len(chain) // 2])
+        rows.append((label, os.path.getsize(path), write_seconds, load_seconds, seek_seconds))
+
+    heights = random.Random(0).sample(range(len(chain)), min(100, len(chain)))
+    for codec in ("none", "zlib", "lzma"):
+        path = os.path.join(directory, "chain-%s.bin" % codec)
+        _, write_seconds = timed(lambda: export_chain(chain, path, codec=codec))
+        loaded, load_seconds = timed(lambda: list(import_chain(path)))
+        assert loaded == chain
+        with ChainReader(path) as reader:
+            _, seek_seconds = timed(lambda: [reader[height] for height in heights])
+        rows.append(("chainfile " + codec, os.path.getsize(path), write_seconds, load_seconds, seek_seconds / len(heights)))
+
+    print(name)
+    print("{:<18} {:>12} {:>10} {:>10} {:>12}".format("format", "bytes", "write ms", "load ms", "seek ms"))
+    for label, size, write_seconds, load_seconds, seek_seconds in rows:
+        print("{:<18} {:>12} {:>10.1f} {:>10.1f} {:>12.3f}".format(
+            label, size, write_seconds * 1000, load_seconds * 1000, seek_seconds * 1000))
+    print()
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    bench("ScroogeCoin, 2000 blocks of 20 transactions", sample_chain(2000, 20), directory)
+    with open(POW_CHAIN) as infile:
+        bench("ProofOfWork chain.json", json.load(infile), directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import os
+import tempfile
+import time
+
+from bench_chainfile import sample_chain
+from chainfile import ChainReader, export_chain
+from filters import entry_matches, filter_entry
+
+
+# Rescanning a chain for one address: every block read from a chain file and
+# searched, against reading only the blocks whose address filter matches.
+# The address is paid in one block, so nearly every read with the filters is
+# a block that concerns it.
+
+
+def rescan(blocks, address):
+    """
+    :return: [(block_num, tx_num), ...] of the transactions address took part in
+    """
+    found = []
+    for block in blocks:
+        for tx_index, tx in enumerate(block["transactions"]):
+            if tx["sender"] == address or address in tx["receivers"]:
+                found.append((block["index"], tx_index))
+    return found
+
+
+def filtered_blocks(reader, entries, address):
+    for entry in entries:
+        if entry_matches(entry, [address]):
+            yield reader[entry["index"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wallet rescan with and without per block address filters")
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--txs-per-block", type=int, default=50)
+    args = parser.parse_args()
+
+    chain = sample_chain(args.blocks, args.txs_per_block)
+    start = time.perf_counter()
+    entries = [filter_entry(block) for block in chain]
+    build_seconds = time.perf_counter() - start
+    filter_bytes = sum(len(entry["filter"]) for entry in entries)
+    address = chain[args.blocks // 2]["transactions"][0]["sender"]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chain.bin")
+        export_chain(chain, path, segment_size=16)
+        with ChainReader(path) as reader:
+            start = time.perf_counter()
+            full = rescan(reader.blocks(), address)
+            full_seconds = time.perf_counter() - start
+        with ChainReader(path) as reader:
+            start = time.perf_counter()
+            matched = list(filtered_blocks(reader, entries, address))
+            filtered = rescan(matched, address)
+            filtered_seconds = time.perf_counter() - start
+    assert filtered == full
+
+    print("blocks %d, %d txs each, filters %.1f bytes per block, built in %.3f ms per block" % (
+        args.blocks, args.txs_per_block, filter_bytes / args.blocks, build_seconds / args.blocks * 1e3))
+    print("{:<10} {:>12} {:>12}".format("rescan", "blocks read", "seconds"))
+    print("{:<10} {:>12} {:>12.4f}".format("full", args.blocks, full_seconds))
+    print("{:<10} {:>12} {:>12.4f}".format("filtered", len(matched), filtered_seconds))
+
+
+if __name__ == '__main__':
+    main()
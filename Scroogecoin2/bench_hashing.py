@@ -0,0 +1,43 @@
+import hashlib
+import timeit
+
+import canonical
+import hashing
+from merkle import merkle_root
+
+
+def sample_tx(i):
+    """
+    a transaction shaped like the ones User.send_tx creates
+    """
+    return {
+        "sender": hashlib.sha256(b"sender%d" % i).hexdigest(),
+        "locations": [{"block": i, "tx": i % 7}],
+        "receivers": {hashlib.sha256(b"receiver%d" % r).hexdigest(): r + 1 for r in range(3)},
+    }
+
+
+def main():
+    txs = [sample_tx(i) for i in range(100)]
+    leaves = [hashlib.sha256(b"%d" % i).hexdigest() for i in range(1024)]
+    print("{:<10} {:>12} {:>16} {:>14}".format("backend", "tx us", "merkle 1024 ms", "pow kH/s"))
+    for name in sorted(hashing.BACKENDS):
+        tx_seconds = timeit.timeit(lambda: [canonical.digest(tx, name) for tx in txs], number=200) / (200 * len(txs))
+        merkle_seconds = timeit.timeit(lambda: merkle_root(leaves, name), number=20) / 20
+
+        # every proof of work try encodes and hashes the whole block header, like Miner.mine
+        block = {"previous_hash": 0, "index": 0, "transactions": [], "bits": 0x03000001, "nonce": 0, "time": "0"}
+        tries = 50000
+
+        def pow_tries():
+            for nonce in range(tries):
+                block["nonce"] = nonce
+                canonical.digest(block, name)
+
+        pow_seconds = timeit.timeit(pow_tries, number=1)
+        print("{:<10} {:>12.2f} {:>16.3f} {:>14.1f}".format(
+            name, tx_seconds * 1e6, merkle_seconds * 1e3, tries / pow_seconds / 1e3))
+
+
+if __name__ == '__main__':
+    main()
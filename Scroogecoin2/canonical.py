@@ -0,0 +1,103 @@
+import json
+
+import hashing
+
+
+# json.dumps(blob, sort_keys=True) builds a new JSONEncoder on every call,
+# one shared encoder keeps the C fast path and gives byte identical output
+_encoder = json.JSONEncoder(sort_keys=True)
+
+# the fields of a transaction that are covered by its hash and signature
+TX_BODY = ("sender", "location", "locations", "nonce", "receivers")
+TX_BODY_FIELDS = frozenset(TX_BODY)
+# the fields a signed transaction has on top of its body
+SEAL_FIELDS = frozenset(("hash", "signature"))
+
+
+def dumps(blob):
+    """
+    Canonical encoding, same bytes as json.dumps(blob, sort_keys=True).encode()
+    :param blob: json serializable object or Sealed object
+    :return: bytes
+    """
+    if isinstance(blob, Sealed):
+        return blob.encoded
+    return _encoder.encode(blob).encode()
+
+
+def digest(blob, hash_name=hashing.DEFAULT):
+    """
+    Creates a hash of the canonical encoding of blob, SHA-256 unless hash_name says otherwise
+    Sealed objects only get hashed once with the backend of their chain
+    :param blob: json serializable object or Sealed object
+    :param hash_name: one of hashing.BACKENDS
+    :return: hex digest
+    """
+    if isinstance(blob, Sealed):
+        return blob.digest_with(hash_name)
+    return hashing.hexdigest(hash_name, _encoder.encode(blob).encode())
+
+
+def tx_body(tx):
+    """
+    the part of a transaction that gets hashed, without hash and signature
+    :param tx: Transaction
+    """
+    if isinstance(tx, Sealed):
+        return tx
+    return {key: tx[key] for key in TX_BODY if key in tx}
+
+
+def dumps_tx(tx, body=None):
+    """
+    Canonical encoding of a signed transaction, same bytes as dumps(tx)
+    "hash" sorts before every body field and "signature" after them, so the
+    encoding of the body made to check the hash is spliced in instead of
+    encoding the body a second time
+    :param tx: transaction dict with hash and signature
+    :param body: dumps(tx_body(tx)), tx is encoded from scratch if None
+    :return: bytes
+    """
+    if body is None or len(body) <= 2 or set(tx) - TX_BODY_FIELDS != SEAL_FIELDS:
+        return dumps(tx)
+    return b"".join((b'{"hash": ', _encoder.encode(tx["hash"]).encode(), b", ", body[1:-1],
+                     b', "signature": ', _encoder.encode(tx["signature"]).encode(), b"}"))
+
+
+class Sealed(object):
+    """
+    Base class for immutable ledger objects
+    the digest is computed once and kept as 32 raw bytes with the name of its
+    hash backend, so sign, validate, mine and persist share it on any chain.
+    The encoding is made again when it is asked for, keeping it would cost
+    more memory than the object itself
+    """
+    __slots__ = ("_digest", "_hash_name")
+
+    def canonical(self):
+        """
+        :return: the json serializable form that gets hashed
+        """
+        raise NotImplementedError
+
+    @property
+    def encoded(self):
+        return _encoder.encode(self.canonical()).encode()
+
+    @property
+    def digest(self):
+        return self.digest_with(hashing.DEFAULT)
+
+    def digest_with(self, hash_name):
+        """
+        :return: hex digest of the encoding with hash_name, only the last backend asked for is kept,
+        an object belongs to one chain
+        """
+        try:
+            if self._hash_name == hash_name:
+                return self._digest.hex()
+        except AttributeError:
+            pass
+        self._digest = hashing.new(hash_name, self.encoded).digest()
+        self._hash_name = hash_name
+        return self._digest.hex()
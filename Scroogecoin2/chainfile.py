@@ -0,0 +1,220 @@
+import bisect
+import json
+import lzma
+import os
+import struct
+import zlib
+
+import canonical
+import hashing
+from ledger_types import to_dict
+
+
+# Binary chain file, for ScroogeCoin.chain and Miner.chain alike
+#
+#   header   magic, version, codec, length of the chain parameters and their canonical json
+#   segment  compressed run of records, a record is a 4 byte length and the canonical json of a block
+#   ...
+#   index    one entry per segment: first height, number of blocks, offset, compressed length, crc32
+#   footer   offset of the index, number of segments, magic
+#
+# the index is at the end so blocks can be written as they come, and a reader
+# only decompresses the segment holding the height it seeks.
+
+MAGIC = b"CHAINBIN"
+# version 1 files have no chain parameters and are read as sha256 chains
+VERSION = 2
+HEADER = struct.Struct(">8sHB")
+LENGTH = struct.Struct(">I")
+INDEX_ENTRY = struct.Struct(">QIQQI")
+FOOTER = struct.Struct(">QQ8s")
+
+CODECS = {
+    "none": (0, lambda data: data, lambda data: data),
+    "zlib": (1, lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress),
+}
+CODEC_NAMES = {number: name for name, (number, _, _) in CODECS.items()}
+
+
+class ChainFileError(Exception):
+    pass
+
+
+class ChainWriter(object):
+    """
+    Streams blocks into a chain file, a segment is compressed and written
+    once it holds segment_size blocks
+    the file only appears under path once close() wrote the index
+    """
+
+    def __init__(self, path, codec="zlib", segment_size=256, params=None):
+        """
+        :param params: chain parameters such as {"hash": "sha256"}, readers find them in ChainReader.params
+        """
+        if codec not in CODECS:
+            raise ValueError("unknown codec %s" % codec)
+        self.path = path
+        self.codec = codec
+        self.segment_size = segment_size
+        encoded_params = canonical.dumps(params or {})
+        self.outfile = open(path + ".tmp", "wb")
+        self.outfile.write(HEADER.pack(MAGIC, VERSION, CODECS[codec][0]) + LENGTH.pack(len(encoded_params)) + encoded_params)
+        self.offset = HEADER.size + LENGTH.size + len(encoded_params)
+        self.height = 0
+        self.records = []
+        self.index = []
+
+    def append(self, block):
+        """
+        :param block: Block or dict, anything canonical.dumps encodes
+        """
+        body = canonical.dumps(to_dict(block))
+        self.records.append(LENGTH.pack(len(body)) + body)
+        if len(self.records) == self.segment_size:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        data = CODECS[self.codec][1](b"".join(self.records))
+        self.outfile.write(data)
+        self.index.append((self.height, len(self.records), self.offset, len(data), zlib.crc32(data)))
+        self.offset += len(data)
+        self.height += len(self.records)
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.outfile.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+        self.outfile.write(FOOTER.pack(self.offset, len(self.index), MAGIC))
+        self.outfile.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.outfile.close()
+            os.remove(self.path + ".tmp")
+
+
+class ChainReader(object):
+    """
+    Reads a chain file, blocks come back as dicts
+    reader[height] decompresses one segment, iteration streams segment by segment
+    """
+
+    def __init__(self, path, decode=json.loads):
+        """
+        :param decode: turns the canonical json of a block back into a block
+        """
+        self.path = path
+        self.decode = decode
+        self.infile = open(path, "rb")
+        magic, version, codec = HEADER.unpack(self.infile.read(HEADER.size))
+        if magic != MAGIC or version not in (1, VERSION) or codec not in CODEC_NAMES:
+            raise ChainFileError("%s is not a chain file this version can read" % path)
+        # every chain was hashed with sha256 before the parameters were recorded
+        self.params = {"hash": hashing.DEFAULT}
+        if version >= 2:
+            length, = LENGTH.unpack(self.infile.read(LENGTH.size))
+            self.params = json.loads(self.infile.read(length))
+        self.decompress = CODECS[CODEC_NAMES[codec]][2]
+
+        self.infile.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, count, magic = FOOTER.unpack(self.infile.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ChainFileError("%s has no index, the export did not finish" % path)
+        self.infile.seek(index_offset)
+        self.index = list(INDEX_ENTRY.iter_unpack(self.infile.read(count * INDEX_ENTRY.size)))
+        self.starts = [entry[0] for entry in self.index]
+        self.height = self.index[-1][0] + self.index[-1][1] if self.index else 0
+        # the segment read last, reading neighbouring heights does not decompress it again
+        self.cached = (None, None)
+
+    def close(self):
+        self.infile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.height
+
+    def segment(self, number):
+        """
+        :return: [canonical json of a block, ...] of segment number
+        """
+        if self.cached[0] == number:
+            return self.cached[1]
+        _, count, offset, length, crc = self.index[number]
+        self.infile.seek(offset)
+        data = self.infile.read(length)
+        if zlib.crc32(data) != crc:
+            raise ChainFileError("segment %d of %s is damaged" % (number, self.path))
+        data = self.decompress(data)
+        records = []
+        position = 0
+        for _ in range(count):
+            length, = LENGTH.unpack_from(data, position)
+            position += LENGTH.size
+            records.append(data[position:position + length])
+            position += length
+        self.cached = (number, records)
+        return records
+
+    def __getitem__(self, height):
+        if height < 0:
+            height += self.height
+        if not (0 <= height < self.height):
+            raise IndexError("block index out of range")
+        number = bisect.bisect_right(self.starts, height) - 1
+        return self.decode(self.segment(number)[height - self.starts[number]])
+
+    def __iter__(self):
+        return self.blocks()
+
+    def blocks(self, start=0):
+        """
+        streams the blocks from height start to the end
+        """
+        if start >= self.height:
+            return
+        first = bisect.bisect_right(self.starts, start) - 1
+        for number in range(first, len(self.index)):
+            records = self.segment(number)
+            skip = start - self.starts[number] if number == first else 0
+            for record in records[skip:]:
+                yield self.decode(record)
+
+
+def export_chain(chain, path, codec="zlib", segment_size=256, params=None):
+    """
+    writes every block of chain to path
+    :return: number of blocks written
+    """
+    with ChainWriter(path, codec, segment_size, params) as writer:
+        for block in chain:
+            writer.append(block)
+    return writer.height
+
+
+def import_chain(path, start=0, decode=json.loads, params=None):
+    """
+    streams the blocks of a chain file from height start
+    :param params: chain parameters the file must have been written with, entries of the file
+    that are not in params, such as the public keys of the senders, are not compared
+    :raises ChainFileError: if its parameters differ
+    """
+    with ChainReader(path, decode) as reader:
+        if params is not None and any(reader.params.get(key) != value for key, value in params.items()):
+            raise ChainFileError("%s holds a chain with %s, not %s" % (path, reader.params, params))
+        for block in reader.blocks(start):
+            yield block
@@ -0,0 +1,104 @@
+import hashlib
+import struct
+
+from history import is_debit
+
+
+# Bloom filter of the addresses a block touches
+#
+#   count   4 byte number of addresses n
+#   bits    BITS_PER_ADDRESS * n bits, rounded up to whole bytes
+#
+# every address sets K bits picked by a hash keyed with the block hash, so a
+# false positive in one block says nothing about the next. A Golomb coded set
+# would be a little smaller, but it has to be decoded whole for every query,
+# which in pure python costs more than looking at the block; here a query is
+# one hash and K bit tests. Addresses in the block always match, others match
+# with about 0.05%.
+
+BITS_PER_ADDRESS = 16
+K = 11
+COUNT = struct.Struct(">I")
+EMPTY_FILTER = COUNT.pack(0)
+
+
+def block_addresses(block):
+    """
+    senders and receivers of the transactions in block, pruned transactions have none left
+    """
+    addresses = set()
+    for tx in block["transactions"]:
+        if tx.get("pruned"):
+            continue
+        if is_debit(tx):
+            addresses.add(tx["sender"])
+        addresses.update(tx["receivers"])
+    return addresses
+
+
+def _filter_key(block_hash):
+    return bytes.fromhex(block_hash)[:16]
+
+
+def _hashes(key, address):
+    # the K bit indexes are h1 + i * h2 modulo the filter size
+    digest = hashlib.blake2b(address.encode(), digest_size=16, key=key).digest()
+    return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+
+
+def build_filter(block_hash, addresses):
+    """
+    :param block_hash: hex hash of the block, keys the hash of every address
+    :param addresses: iterable of hex addresses
+    :return: bytes
+    """
+    addresses = set(addresses)
+    if not addresses:
+        return EMPTY_FILTER
+    key = _filter_key(block_hash)
+    bits = bytearray((BITS_PER_ADDRESS * len(addresses) + 7) // 8)
+    size = len(bits) * 8
+    for address in addresses:
+        h1, h2 = _hashes(key, address)
+        for i in range(K):
+            index = (h1 + i * h2) % size
+            bits[index >> 3] |= 1 << (index & 7)
+    return COUNT.pack(len(addresses)) + bytes(bits)
+
+
+def match_any(data, block_hash, addresses):
+    """
+    :return: True if any of addresses may be in the block, False if none is
+    """
+    size = (len(data) - COUNT.size) * 8
+    if size == 0:
+        return False
+    key = _filter_key(block_hash)
+    for address in addresses:
+        h1, h2 = _hashes(key, address)
+        for i in range(K):
+            index = (h1 + i * h2) % size
+            # most addresses miss on the first bit or two
+            if not data[COUNT.size + (index >> 3)] >> (index & 7) & 1:
+                break
+        else:
+            return True
+    return False
+
+
+def filter_entry(block):
+    """
+    what is served alongside the block header: enough to follow the chain
+    and decide whether the block is worth fetching
+    :return: {"index", "previous_hash", "hash", "filter": bytes}
+    """
+    return {
+        "index": block["index"],
+        "previous_hash": block["previous_hash"],
+        "hash": block["hash"],
+        "filter": build_filter(block["hash"], block_addresses(block)),
+    }
+
+
+def entry_matches(entry, addresses):
+    return match_any(entry["filter"], entry["hash"], addresses)
@@ -0,0 +1,34 @@
+import hashlib
+
+
+# Hash functions a chain can be built on. Every backend gives 32 byte digests,
+# so hashes and addresses keep fitting the compact types, the sqlite store and
+# the snapshot records. sha256 is what Bitcoin uses and what every chain used
+# before the choice existed.
+BACKENDS = {
+    "sha256": hashlib.sha256,
+    "sha3_256": hashlib.sha3_256,
+    "blake2b": lambda data=b"": hashlib.blake2b(data, digest_size=32),
+    "blake2s": hashlib.blake2s,
+}
+
+DEFAULT = "sha256"
+
+
+def backend(name):
+    """
+    :param name: one of BACKENDS
+    :return: constructor of hashlib style hash objects, new(data=b"")
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("unknown hash backend %s, pick one of %s" % (name, ", ".join(sorted(BACKENDS))))
+
+
+def new(name, data=b""):
+    return backend(name)(data)
+
+
+def hexdigest(name, data):
+    return backend(name)(data).hexdigest()
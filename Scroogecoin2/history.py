@@ -0,0 +1,116 @@
+import base64
+import bisect
+import struct
+
+from ledger_state import is_issuance
+
+
+# every transaction an address took part in, as debits (it sent the transaction)
+# and credits (it is paid by it), in chain order: block, tx, debits before credits
+KINDS = ("debit", "credit")
+DEBIT, CREDIT = 0, 1
+
+# a cursor is the position of the last entry handed out, opaque to callers
+CURSOR = struct.Struct(">QIB")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(block, tx, kind):
+    return base64.urlsafe_b64encode(CURSOR.pack(block, tx, kind)).decode()
+
+
+def decode_cursor(cursor):
+    """
+    :return: (block, tx, kind) of a cursor from encode_cursor, (-1, 0, 0) if cursor is None
+    :raises ValueError: if cursor was not made by encode_cursor
+    """
+    if cursor is None:
+        return (-1, 0, 0)
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode())
+        block, tx, kind = CURSOR.unpack(raw)
+    except (AttributeError, struct.error, ValueError):
+        raise ValueError("not a history cursor: %r" % (cursor,))
+    if kind not in (DEBIT, CREDIT):
+        raise ValueError("not a history cursor: %r" % (cursor,))
+    return block, tx, kind
+
+
+def is_debit(tx):
+    """
+    a transaction debits its sender unless it creates coins, pruned transactions have no sender left
+    """
+    return tx["sender"] is not None and ("nonce" in tx or not is_issuance(tx))
+
+
+def block_entries(block):
+    """
+    :return: [(address, block_num, tx_num, kind, amount), ...] of every transaction in block
+    transactions that are pruned already have nothing left to index
+    """
+    entries = []
+    for tx_index, tx in enumerate(block["transactions"]):
+        if tx.get("pruned"):
+            continue
+        receivers = tx["receivers"]
+        if is_debit(tx):
+            entries.append((tx["sender"], block["index"], tx_index, DEBIT, sum(receivers.values())))
+        for address, amount in receivers.items():
+            entries.append((address, block["index"], tx_index, CREDIT, amount))
+    return entries
+
+
+def to_entry(block, tx, kind, amount):
+    return {"block": block, "tx": tx, "kind": KINDS[kind], "amount": amount}
+
+
+def make_page(rows, limit):
+    """
+    :param rows: up to limit + 1 (block, tx, kind, amount) after the cursor, one more than limit means there are more
+    :return: {"entries": [{"block", "tx", "kind", "amount"}, ...], "cursor": cursor of the next page or None}
+    """
+    page = rows[:limit]
+    cursor = encode_cursor(*page[-1][:3]) if len(rows) > limit else None
+    return {"entries": [to_entry(*row) for row in page], "cursor": cursor}
+
+
+class AddressIndex(object):
+    """
+    Per address history of an in memory chain, kept up to date block by block
+    entries only ever get appended, so readers below the published height
+    need no lock. Pruning a transaction does not remove its entries.
+    """
+
+    def __init__(self, chain=()):
+        # {address: [(block_num, tx_num, kind, amount), ...]} in chain order
+        self.entries = {}
+        # number of blocks indexed
+        self.height = 0
+        for block in chain:
+            self.add_block(block)
+
+    def add_block(self, block):
+        for address, block_index, tx_index, kind, amount in block_entries(block):
+            self.entries.setdefault(address, []).append((block_index, tx_index, kind, amount))
+        self.height = block["index"] + 1
+
+    def credits(self, address, height):
+        """
+        :return: [(block_num, tx_num, amount), ...] of the outputs paying address in the blocks below height
+        """
+        entries = self.entries.get(address, [])
+        return [(block, tx, amount) for block, tx, kind, amount in entries[:bisect.bisect_left(entries, (height,))]
+                if kind == CREDIT]
+
+    def page(self, address, after, start_height, end_height, limit):
+        """
+        :param after: (block, tx, kind) of the last entry already seen
+        :return: up to limit + 1 rows after it with start_height <= block < end_height
+        """
+        entries = self.entries.get(address, [])
+        first = max(bisect.bisect_left(entries, (after[0], after[1], after[2] + 1)),
+                    bisect.bisect_left(entries, (start_height,)))
+        last = bisect.bisect_left(entries, (end_height,))
+        return entries[first:min(last, first + limit + 1)]
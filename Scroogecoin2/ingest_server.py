@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import struct
+import time
+
+from fastecdsa import ecdsa, curve, point
+
+import canonical
+import hashing
+from history import DEFAULT_PAGE_SIZE
+from ledger_types import to_dict
+from scheduler import MiningPolicy, MiningScheduler
+from validation import Reason
+
+
+# every message is a 4 byte big endian length followed by that many bytes of json
+LENGTH = struct.Struct(">I")
+MAX_MESSAGE = 1 << 20
+# blocks per answer to the blocks op, so a reply of full blocks stays under MAX_MESSAGE
+BLOCKS_LIMIT = 10
+FILTERS_LIMIT = 1000
+
+
+class ProtocolError(Exception):
+    pass
+
+
+async def read_message(reader):
+    """
+    :return: the decoded message, None when the other side closed the connection
+    """
+    try:
+        header = await reader.readexactly(LENGTH.size)
+    except asyncio.IncompleteReadError:
+        return None
+    length, = LENGTH.unpack(header)
+    if length > MAX_MESSAGE:
+        raise ProtocolError("message of %d bytes is too large" % length)
+    return json.loads(await reader.readexactly(length))
+
+
+def encode_message(message):
+    body = canonical.dumps(message)
+    return LENGTH.pack(len(body)) + body
+
+
+def public_key_from_json(value):
+    x, y = value
+    return point.Point(x, y, curve=curve.secp256k1)
+
+
+def precheck(tx, x, y, hash_name=hashing.DEFAULT):
+    """
+    the stateless part of validate_tx, runs in a worker process
+    :return: (hash matches the body, signature verifies)
+    """
+    is_correct_hash = canonical.digest(canonical.tx_body(tx), hash_name) == tx["hash"]
+    public_key = point.Point(x, y, curve=curve.secp256k1)
+    try:
+        is_signed = ecdsa.verify(tuple(tx["signature"]), tx["hash"], public_key, curve=curve.secp256k1)
+    except ecdsa.EcdsaError:
+        # a signature the curve math cannot take is a bad signature, not a failed worker
+        is_signed = False
+    return is_correct_hash, is_signed
+
+
+class IngestServer(object):
+    """
+    Accepts transactions from many clients over a local TCP or unix socket
+    the checks that need no hashing or curve math run first on the event loop,
+    only what passes them goes to a process pool for the hash and signature,
+    the result lands in Scrooge's signature cache, and the full checks run one
+    at a time on the event loop through Scrooge.add_tx
+    accepted transactions are mined by a MiningScheduler
+
+    requests:
+        {"op": "submit_tx", "tx": tx, "public_key": [x, y]}  -> {"ok": true, "result": accepted}
+        {"op": "balance", "address": address}                -> {"ok": true, "result": balance}
+        {"op": "positions", "address": address}              -> {"ok": true, "result": positions}
+        {"op": "tx_proof", "block": block, "tx": tx}          -> {"ok": true, "result": Scrooge.get_tx_proof(block, tx)}
+        {"op": "blocks", "start": height, "limit": count}    -> {"ok": true, "result": [block, ...]}
+        {"op": "filters", "start": height, "limit": count}   -> {"ok": true, "result": [filter entry, ...]}
+        {"op": "history", "address": address, "cursor": cursor, "limit": count, "start": height, "end": height}
+                                                             -> {"ok": true, "result": Scrooge.get_address_history(...)}
+    """
+
+    def __init__(self, Scrooge, batch_size=100, workers=None, executor=None, scheduler=None):
+        """
+        :param Scrooge: ScroogeCoin the transactions go to
+        :param batch_size: mine when this many transactions are pending, 0 to never mine
+        :param workers: size of the verification process pool
+        :param executor: use this executor for verification instead of a new process pool
+        :param scheduler: MiningScheduler deciding when to mine, replaces batch_size
+        """
+        self.Scrooge = Scrooge
+        if scheduler is None:
+            scheduler = MiningScheduler(Scrooge, MiningPolicy(max_txs=batch_size or None))
+        self.scheduler = scheduler
+        self.scheduler_task = None
+        self.own_executor = executor is None
+        if executor is None:
+            # forked workers would inherit the open client sockets and keep them from closing
+            executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("forkserver"))
+        self.executor = executor
+        self.server = None
+        self.path = None
+        self.connections = set()
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """
+        listens on path if given, on host:port otherwise (port 0 picks a free port)
+        :return: the address clients connect to, a path or (host, port)
+        """
+        self.scheduler_task = asyncio.ensure_future(self.scheduler.run())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=path)
+            self.path = path
+            return path
+        self.server = await asyncio.start_server(self.handle, host=host, port=port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            # let the open connections finish the request they are on
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.server.wait_closed()
+        if self.scheduler_task is not None:
+            self.scheduler_task.cancel()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        if self.own_executor:
+            self.executor.shutdown()
+
+    async def handle(self, reader, writer):
+        # requests of one connection are answered in order, connections run concurrently
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except (ProtocolError, ValueError) as error:
+                    writer.write(encode_message({"ok": False, "error": str(error)}))
+                    break
+                if request is None:
+                    break
+                try:
+                    response = {"ok": True, "result": await self.dispatch(request)}
+                except (IndexError, KeyError, TypeError, ValueError) as error:
+                    response = {"ok": False, "error": "bad request: %r" % (error,)}
+                writer.write(encode_message(response))
+                await writer.drain()
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def dispatch(self, request):
+        op = request["op"]
+        if op == "submit_tx":
+            return await self.submit(request["tx"], public_key_from_json(request["public_key"]))
+        if op == "balance":
+            return self.Scrooge.view().balance(request["address"])
+        if op == "positions":
+            return self.Scrooge.get_user_tx_positions(request["address"], self.Scrooge.view().height)
+        if op == "tx_proof":
+            return self.Scrooge.get_tx_proof(request["block"], request["tx"])
+        if op == "filters":
+            # entries are small, many more fit in a message than blocks
+            start = request["start"]
+            limit = min(request.get("limit", FILTERS_LIMIT), FILTERS_LIMIT)
+            return [dict(entry, filter=entry["filter"].hex())
+                    for entry in self.Scrooge.get_block_filters(start, start + limit)]
+        if op == "history":
+            return self.Scrooge.get_address_history(request["address"], request.get("cursor"),
+                                                    request.get("limit", DEFAULT_PAGE_SIZE),
+                                                    request.get("start", 0), request.get("end"))
+        if op == "blocks":
+            # up to the published height, a wallet never sees a block its balance query could not
+            start = request["start"]
+            if start < 0:
+                raise ValueError("no block %d" % start)
+            stop = min(start + min(request.get("limit", BLOCKS_LIMIT), BLOCKS_LIMIT), self.Scrooge.view().height)
+            return [to_dict(self.Scrooge.chain[index]) for index in range(start, stop)]
+        raise ValueError("unknown op %s" % op)
+
+    async def submit(self, tx, public_key):
+        """
+        :return: True if the transaction was added to Scrooge's pending transactions
+        """
+        # structure, funding and double spends are cheap, garbage never costs a signature check
+        with self.Scrooge.lock:
+            reason = self.Scrooge.check_tx(tx, public_key, verify=False)
+        if reason is not Reason.OK:
+            self.rejected += 1
+            return False
+
+        tx["signature"] = tuple(tx["signature"])
+        loop = asyncio.get_running_loop()
+        is_correct_hash, is_signed = await loop.run_in_executor(
+            self.executor, precheck, tx, public_key.x, public_key.y, self.Scrooge.hash_name)
+        if not (is_correct_hash and is_signed):
+            self.rejected += 1
+            return False
+
+        self.Scrooge.signature_cache.add(tx["signature"], tx["hash"], public_key)
+        if not self.scheduler.add_tx(tx, public_key):
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+
+class IngestClient(object):
+    """
+    client for IngestServer, one request at a time per connection
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, address):
+        """
+        :param address: a unix socket path or (host, port)
+        """
+        if isinstance(address, str):
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+        return cls(reader, writer)
+
+    async def request(self, message):
+        self.writer.write(encode_message(message))
+        await self.writer.drain()
+        response = await read_message(self.reader)
+        if response is None or not response["ok"]:
+            raise ProtocolError(response["error"] if response else "connection closed")
+        return response["result"]
+
+    async def submit_tx(self, tx, public_key):
+        return await self.request({"op": "submit_tx", "tx": tx, "public_key": [public_key.x, public_key.y]})
+
+    async def balance(self, address):
+        return await self.request({"op": "balance", "address": address})
+
+    async def positions(self, address):
+        return await self.request({"op": "positions", "address": address})
+
+    async def blocks(self, start, limit=None):
+        """
+        :return: the mined blocks from height start on, at most limit of them, for Wallet.apply_block
+        """
+        return await self.request({"op": "blocks", "start": start, "limit": limit or BLOCKS_LIMIT})
+
+    async def filters(self, start, limit=None):
+        """
+        :return: filter entries from height start on, for Wallet.skip_block and filters.entry_matches
+        """
+        entries = await self.request({"op": "filters", "start": start, "limit": limit or FILTERS_LIMIT})
+        return [dict(entry, filter=bytes.fromhex(entry["filter"])) for entry in entries]
+
+    async def history(self, address, cursor=None, limit=DEFAULT_PAGE_SIZE, start=0, end=None):
+        """
+        :return: one page of the history of address, pass its "cursor" back for the next one
+        """
+        return await self.request({"op": "history", "address": address, "cursor": cursor, "limit": limit,
+                                   "start": start, "end": end})
+
+    async def tx_proof(self, block, tx):
+        """
+        :return: proof for User.verify_tx_proof
+        """
+        return await self.request({"op": "tx_proof", "block": block, "tx": tx})
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def load_test(users=200, clients=20, batch_size=50, workers=None, path=None, max_wait_ms=None, max_bytes=None):
+    """
+    funds users, then has clients submit one payment per user plus balance
+    queries concurrently over localhost
+    blocks are sealed at batch_size transactions, max_wait_ms or max_bytes, whichever comes first
+    :return: {"submitted", "accepted", "seconds", "tx_per_s", "blocks", "mining"}
+    """
+    from Scrooge_coin_assignmnet import ScroogeCoin, User
+
+    Scrooge = ScroogeCoin()
+    accounts = User.from_seed(Scrooge, b"ingest load test", users)
+    Scrooge.create_coins({user.address: 10 for user in accounts})
+    Scrooge.mine()
+    txs = [(user, user.send_tx({accounts[(i + 1) % users].address: 10}, Scrooge.get_user_tx_positions(user.address)))
+           for i, user in enumerate(accounts)]
+
+    policy = MiningPolicy(max_txs=batch_size or None, max_wait_ms=max_wait_ms, max_bytes=max_bytes)
+    server = IngestServer(Scrooge, workers=workers, scheduler=MiningScheduler(Scrooge, policy))
+    address = await server.start(path=path)
+
+    async def client(share):
+        connection = await IngestClient.connect(address)
+        accepted = 0
+        for user, tx in share:
+            accepted += await connection.submit_tx(tx, user.public_key)
+            await connection.balance(user.address)
+        await connection.close()
+        return accepted
+
+    start = time.perf_counter()
+    accepted = sum(await asyncio.gather(*[client(txs[i::clients]) for i in range(clients)]))
+    seconds = time.perf_counter() - start
+    await server.close()
+    return {"submitted": len(txs), "accepted": accepted, "seconds": seconds,
+            "tx_per_s": len(txs) / seconds, "blocks": len(Scrooge.chain), "mining": server.scheduler.metrics()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test the ScroogeCoin ingestion server on localhost")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--max-wait-ms", type=float, default=None, help="seal a block once a transaction waited this long")
+    parser.add_argument("--max-bytes", type=int, default=None, help="encoded size a block may hold")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--unix", help="listen on this unix socket path instead of tcp")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(load_test(args.users, args.clients, args.batch_size, args.workers, args.unix,
+                                                args.max_wait_ms, args.max_bytes)), indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import time
+
+from fastecdsa import ecdsa, curve
+
+import canonical
+from ledger_types import hex_receivers
+
+
+# receivers per issuance transaction, keeps one airdrop from becoming a single huge transaction
+MAX_ISSUANCE_RECEIVERS = 256
+# issuance transactions handed to a worker at a time
+SIGN_BATCH = 16
+
+
+def issuance_body(sender, receivers):
+    """
+    a transaction that creates coins, they do not come from anywhere
+    :param receivers: {account:amount, account:amount, ...}
+    """
+    return {
+        "sender": sender,
+        "locations": [],
+        "receivers": hex_receivers(receivers),
+    }
+
+
+def _sign_bodies(args):
+    # runs in the worker processes, the signatures are deterministic (RFC 6979)
+    bodies, private_key, hash_name = args
+    signed = []
+    for body in bodies:
+        hash_ = canonical.digest(body, hash_name)
+        signed.append((hash_, ecdsa.sign(hash_, private_key, curve=curve.secp256k1)))
+    return signed
+
+
+def issue(sender, receivers, private_key, hash_name, chunk_size=MAX_ISSUANCE_RECEIVERS, processes=None):
+    """
+    splits receivers into transactions of at most chunk_size receivers, hashed and signed across a process pool
+    the result does not depend on the number of processes
+    :param processes: number of worker processes, 1 signs everything in this process
+    :return: [tx, ...] in the order of receivers
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    items = list(receivers.items())
+    bodies = [issuance_body(sender, dict(items[first:first + chunk_size])) for first in range(0, len(items), chunk_size)]
+    tasks = [(bodies[first:first + SIGN_BATCH], private_key, hash_name) for first in range(0, len(bodies), SIGN_BATCH)]
+    if processes == 1 or len(tasks) <= 1:
+        results = map(_sign_bodies, tasks)
+    else:
+        with multiprocessing.get_context("forkserver").Pool(processes) as pool:
+            results = pool.map(_sign_bodies, tasks)
+
+    txs = []
+    for body, (hash_, signature) in zip(bodies, (pair for result in results for pair in result)):
+        body["hash"] = hash_
+        body["signature"] = signature
+        txs.append(body)
+    return txs
+
+
+def benchmark(users=20000, chunk_size=64, process_counts=(1, 2, 4), seed=b"issuance"):
+    """
+    issues 10 coins to each of users addresses with every process count
+    :return: [{"processes", "txs", "seconds", "tx_per_s"}, ...]
+    """
+    from Scrooge_coin_assignmnet import ScroogeCoin
+
+    Scrooge = ScroogeCoin()
+    receivers = {hashlib.sha256(seed + b"%d" % i).hexdigest(): 10 for i in range(users)}
+    rows = []
+    for processes in process_counts:
+        start = time.perf_counter()
+        count = Scrooge.create_coins_bulk(receivers, chunk_size, processes)
+        seconds = time.perf_counter() - start
+        Scrooge.current_transactions = []
+        rows.append({"processes": processes, "txs": count, "seconds": seconds, "tx_per_s": count / seconds})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bulk coin issuance throughput by number of signing processes")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.users, args.chunk_size, args.processes), indent=4))
+
+
+if __name__ == '__main__':
+    main()
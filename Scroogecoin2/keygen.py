@@ -0,0 +1,95 @@
+import functools
+import hashlib
+import hmac
+import multiprocessing
+
+from fastecdsa import keys, curve, point
+
+import hashing
+
+
+# room left above the base key, so base + index never wraps around the curve order
+MAX_INDEX = 2 ** 64
+
+
+def seed_base_key(seed):
+    """
+    the first private key of a seed
+    """
+    digest = hmac.new(seed, b"scrooge key derivation", hashlib.sha256).digest()
+    return int.from_bytes(digest, 'big') % (curve.secp256k1.q - MAX_INDEX) + 1
+
+
+def derive_private_key(seed, index):
+    """
+    deterministic private key number index of a seed, the same seed and index always give the same key
+    keys of one seed are consecutive numbers, so their public keys can be computed with one point
+    addition each instead of a full multiplication
+    NOTE: anyone who knows one key of a seed can compute the others, use this for tests and load runs
+    :param seed: bytes
+    :param index: 0 <= index < MAX_INDEX
+    :return: private key of secp256k1
+    """
+    if not (0 <= index < MAX_INDEX):
+        raise ValueError("key index out of range")
+    return seed_base_key(seed) + index
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def address_from_point(x, y, hash_name=hashing.DEFAULT):
+    """
+    address of a public key, cached because the same keys get looked up over and over
+    """
+    return hashing.hexdigest(hash_name, hex(x << 256 | y).encode())
+
+
+def address_of(public_key, hash_name=hashing.DEFAULT):
+    """
+    create the address using public key, and bitwise operation
+    :param public_key: fastecdsa Point
+    :param hash_name: hash backend of the chain, see hashing.BACKENDS
+    """
+    return address_from_point(public_key.x, public_key.y, hash_name)
+
+
+def derive_keypair(seed, index):
+    """
+    :return: (private_key, public_key) number index of seed, MUST USE secp256k1 curve
+    """
+    private_key = derive_private_key(seed, index)
+    return private_key, keys.get_public_key(private_key, curve.secp256k1)
+
+
+def _derive_range(args):
+    # runs in the worker processes, points go back as plain ints
+    # one multiplication for the first key, then public key i + 1 = public key i + G
+    seed, start, stop = args
+    private_key, public_key = derive_keypair(seed, start)
+    pairs = []
+    for index in range(start, stop):
+        pairs.append((private_key, public_key.x, public_key.y))
+        private_key += 1
+        public_key = public_key + curve.secp256k1.G
+    return pairs
+
+
+def generate_keypairs(seed, count, start=0, processes=None, chunk_size=10000):
+    """
+    derives keys start ... start + count - 1 of seed, spread over a process pool
+    the result does not depend on the number of processes
+    :param processes: number of worker processes, 1 derives everything in this process
+    :return: [(private_key, public_key), ...] in index order
+    """
+    ranges = [(seed, first, min(first + chunk_size, start + count)) for first in range(start, start + count, chunk_size)]
+    if processes == 1 or len(ranges) <= 1:
+        chunks = map(_derive_range, ranges)
+    else:
+        # forked workers would copy the locks of whatever threads are running, and can hang on them
+        with multiprocessing.get_context("forkserver").Pool(processes) as pool:
+            chunks = pool.map(_derive_range, ranges)
+
+    keypairs = []
+    for chunk in chunks:
+        for private_key, x, y in chunk:
+            keypairs.append((private_key, point.Point(x, y, curve=curve.secp256k1)))
+    return keypairs
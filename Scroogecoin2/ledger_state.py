@@ -0,0 +1,258 @@
+import hashlib
+import os
+import struct
+
+
+SNAPSHOT_MAGIC = b"SCROOGE-SNAPSHOT"
+SNAPSHOT_VERSION = 1
+
+# magic, version, height, tip hash, number of unspent outputs, number of balances
+HEADER = struct.Struct(">16sHQ32sQQ")
+# address, block, tx, amount
+UNSPENT_RECORD = struct.Struct(">32sqqq")
+# address, balance
+BALANCE_RECORD = struct.Struct(">32sq")
+
+NO_TIP = bytes(32)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def tx_locations(tx):
+    """
+    inputs of a transaction, transactions from before multi input carry a single location
+    :param tx: Transaction
+    :return: [{"block":block_num, "tx":tx_num}, ...]
+    """
+    if "locations" in tx:
+        return tx["locations"]
+    return [tx["location"]]
+
+
+def is_issuance(tx):
+    """
+    a transaction that creates coins: it has no inputs, or before multi input
+    it named block -1 as its single location
+    """
+    return all(location["block"] < 0 for location in tx_locations(tx))
+
+
+def balance_deltas(tx):
+    """
+    what tx does to balances under the rule of ScroogeCoin.show_user_balance,
+    coins paid back to the sender do not count
+    :return: {address: balance delta}
+    """
+    if tx.get("pruned"):
+        return tx["balances"]
+    sender = tx["sender"]
+    deltas = {}
+    for receiver, amount in tx["receivers"].items():
+        if receiver != sender:
+            deltas[receiver] = deltas.get(receiver, 0) + amount
+            deltas[sender] = deltas.get(sender, 0) - amount
+    return deltas
+
+
+class LedgerState(object):
+    """
+    State derived from the chain: the unspent outputs and the balance of every address
+    kept up to date block by block, so queries do not have to scan the chain
+    """
+
+    def __init__(self):
+        # number of blocks applied and hash of the last one
+        self.height = 0
+        self.tip = None
+        # {(block_num, tx_num, address): amount}
+        self.unspent = {}
+        # {address: balance}, same rule as ScroogeCoin.show_user_balance
+        self.balances = {}
+
+    def apply_block(self, block):
+        """
+        spends the inputs and adds the outputs of every transaction in block
+        :param block: Block, must be the block at self.height
+        """
+        for tx_index, tx in enumerate(block["transactions"]):
+            if tx.get("pruned"):
+                # its outputs were all spent before it was pruned, only the balances it moved are left
+                for address, delta in tx["balances"].items():
+                    self.balances[address] = self.balances.get(address, 0) + delta
+                continue
+            sender = tx["sender"]
+            for location in tx_locations(tx):
+                self.unspent.pop((location["block"], location["tx"], sender), None)
+            for receiver, amount in tx["receivers"].items():
+                self.unspent[(block["index"], tx_index, receiver)] = amount
+                if receiver != sender:
+                    self.balances[receiver] = self.balances.get(receiver, 0) + amount
+                    self.balances[sender] = self.balances.get(sender, 0) - amount
+        self.height = block["index"] + 1
+        self.tip = block["hash"]
+
+    def is_unspent(self, block_index, tx_index, address):
+        return (block_index, tx_index, address) in self.unspent
+
+    def balance(self, address):
+        return self.balances.get(address, 0)
+
+
+# a view shares the layers below it, every this many blocks a full copy starts over
+MAX_VIEW_DEPTH = 32
+
+
+class StateView(object):
+    """
+    Read only LedgerState at one height, other threads can query it while the
+    state moves on. A view holds only the changes of its block and looks
+    further down its parents for the rest, so publishing one per block does not
+    copy the whole state. Views are never changed once made.
+    """
+
+    def __init__(self, height, tip, unspent, balances, parent=None):
+        """
+        :param unspent: {(block_num, tx_num, address): amount, or None once spent}
+        :param balances: {address: balance}
+        """
+        self.height = height
+        self.tip = tip
+        self.unspent = unspent
+        self.balances = balances
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+
+    @classmethod
+    def copy_of(cls, state):
+        return cls(state.height, state.tip, dict(state.unspent), dict(state.balances))
+
+    def extend(self, state, block):
+        """
+        :param state: LedgerState that block was just applied to
+        :return: the view after block
+        """
+        if self.depth + 1 >= MAX_VIEW_DEPTH:
+            return StateView.copy_of(state)
+        unspent, balances = {}, {}
+        for tx_index, tx in enumerate(block["transactions"]):
+            if tx.get("pruned"):
+                for address in tx["balances"]:
+                    balances[address] = state.balance(address)
+                continue
+            sender = tx["sender"]
+            for location in tx_locations(tx):
+                unspent[(location["block"], location["tx"], sender)] = None
+            for receiver, amount in tx["receivers"].items():
+                unspent[(block["index"], tx_index, receiver)] = amount
+                balances[receiver] = state.balance(receiver)
+                balances[sender] = state.balance(sender)
+        return StateView(state.height, state.tip, unspent, balances, self)
+
+    def _lookup(self, layer, key, default):
+        view = self
+        while view is not None:
+            table = getattr(view, layer)
+            if key in table:
+                return table[key]
+            view = view.parent
+        return default
+
+    def is_unspent(self, block_index, tx_index, address):
+        return self._lookup("unspent", (block_index, tx_index, address), None) is not None
+
+    def balance(self, address):
+        return self._lookup("balances", address, 0)
+
+
+def snapshot_path(directory, height):
+    return os.path.join(directory, "snapshot-%010d.snap" % height)
+
+
+def write_snapshot(state, directory):
+    """
+    writes the state into directory as snapshot-<height>.snap
+    the file is a fixed header, fixed size records and a trailing sha256 of everything before it
+    :return: path of the snapshot
+    """
+    tip = NO_TIP if state.tip is None else bytes.fromhex(state.tip)
+    parts = [HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, state.height, tip, len(state.unspent), len(state.balances))]
+    parts.extend(UNSPENT_RECORD.pack(bytes.fromhex(address), block_index, tx_index, amount)
+                 for (block_index, tx_index, address), amount in state.unspent.items())
+    parts.extend(BALANCE_RECORD.pack(bytes.fromhex(address), balance) for address, balance in state.balances.items())
+    data = b"".join(parts)
+
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, state.height)
+    # write next to the final name and rename, a crash never leaves half a snapshot behind
+    with open(path + ".tmp", "wb") as outfile:
+        outfile.write(data)
+        outfile.write(hashlib.sha256(data).digest())
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def load_snapshot(path):
+    """
+    reads a snapshot written by write_snapshot
+    :raises SnapshotError: if the file is damaged or from another version
+    :return: LedgerState
+    """
+    with open(path, "rb") as infile:
+        raw = infile.read()
+    data, checksum = raw[:-32], raw[-32:]
+    if len(raw) < HEADER.size + 32 or hashlib.sha256(data).digest() != checksum:
+        raise SnapshotError("integrity check failed for %s" % path)
+
+    magic, version, height, tip, unspent_count, balance_count = HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise SnapshotError("unsupported snapshot %s" % path)
+    unspent_end = HEADER.size + unspent_count * UNSPENT_RECORD.size
+    if unspent_end + balance_count * BALANCE_RECORD.size != len(data):
+        raise SnapshotError("truncated snapshot %s" % path)
+
+    state = LedgerState()
+    state.height = height
+    state.tip = None if tip == NO_TIP else tip.hex()
+    state.unspent = {(block_index, tx_index, address.hex()): amount for address, block_index, tx_index, amount
+                     in UNSPENT_RECORD.iter_unpack(data[HEADER.size:unspent_end])}
+    state.balances = {address.hex(): balance for address, balance in BALANCE_RECORD.iter_unpack(data[unspent_end:])}
+    return state
+
+
+def list_snapshots(directory):
+    """
+    :return: snapshot paths in directory, newest first
+    """
+    if directory is None or not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.startswith("snapshot-") and name.endswith(".snap")]
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def restore_state(chain, directory=None):
+    """
+    rebuilds the state of chain from the newest usable snapshot in directory
+    and replays only the blocks mined after it
+    snapshots that are damaged, ahead of the chain or from a different chain are skipped
+    :return: (LedgerState, number of blocks replayed)
+    """
+    state = LedgerState()
+    for path in list_snapshots(directory):
+        try:
+            candidate = load_snapshot(path)
+        except SnapshotError:
+            continue
+        if candidate.height > len(chain):
+            continue
+        if candidate.height > 0 and chain[candidate.height - 1]["hash"] != candidate.tip:
+            continue
+        state = candidate
+        break
+
+    replayed = 0
+    for index in range(state.height, len(chain)):
+        state.apply_block(chain[index])
+        replayed += 1
+    return state, replayed
@@ -0,0 +1,395 @@
+import json
+import sqlite3
+
+import canonical
+from history import block_entries
+from ledger_state import tx_locations
+from ledger_types import Block, PrunedTransaction, to_dict
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    idx INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    previous_hash TEXT,
+    merkle_root TEXT NOT NULL,
+    signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    block INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (block, tx)
+);
+CREATE INDEX IF NOT EXISTS transactions_sender ON transactions (sender);
+CREATE TABLE IF NOT EXISTS outputs (
+    block INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (block, tx, address)
+);
+CREATE INDEX IF NOT EXISTS outputs_address ON outputs (address);
+CREATE TABLE IF NOT EXISTS spends (
+    block INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    spent_block INTEGER NOT NULL,
+    spent_tx INTEGER NOT NULL,
+    PRIMARY KEY (block, tx, address)
+);
+CREATE TABLE IF NOT EXISTS pruned_balances (
+    block INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    PRIMARY KEY (block, tx, address)
+);
+CREATE TABLE IF NOT EXISTS history (
+    address TEXT NOT NULL,
+    block INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (address, block, tx, kind)
+);
+CREATE TABLE IF NOT EXISTS filters (
+    block INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    previous_hash TEXT,
+    filter BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS public_keys (
+    address TEXT PRIMARY KEY,
+    x TEXT NOT NULL,
+    y TEXT NOT NULL
+);
+"""
+
+
+HISTORY_INSERT = "INSERT OR IGNORE INTO history (address, block, tx, kind, amount) VALUES (?, ?, ?, ?, ?)"
+
+
+def load_tx(body):
+    tx = json.loads(body)
+    if tx.get("pruned"):
+        return PrunedTransaction.from_dict(tx)
+    # json has no tuples, signatures are (r, s)
+    if "signature" in tx:
+        tx["signature"] = tuple(tx["signature"])
+    return tx
+
+
+class SqliteFilters(object):
+    """
+    block filters kept next to the chain, reads like the ScroogeCoin.block_filters list
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM filters").fetchone()[0]
+
+    def __getitem__(self, index):
+        row = self.conn.execute("SELECT hash, previous_hash, filter FROM filters WHERE block = ?", (index,)).fetchone()
+        if row is None:
+            raise IndexError("no filter for block %d" % index)
+        return {"index": index, "previous_hash": row[1], "hash": row[0], "filter": bytes(row[2])}
+
+    def append(self, entry):
+        with self.conn:
+            self.conn.execute("INSERT INTO filters (block, hash, previous_hash, filter) VALUES (?, ?, ?, ?)",
+                              (entry["index"], entry["hash"], entry["previous_hash"], entry["filter"]))
+
+
+class SqlitePublicKeys(object):
+    """
+    public keys kept next to the chain, reads like the ScroogeCoin.public_keys dict
+    new keys wait in memory and are written in the commit of the next block, see SqliteChain.append
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        # {address: (x, y)} not written yet
+        self.pending = {}
+
+    def _row(self, address):
+        return self.conn.execute("SELECT x, y FROM public_keys WHERE address = ?", (address,)).fetchone()
+
+    def __contains__(self, address):
+        return address in self.pending or self._row(address) is not None
+
+    def __getitem__(self, address):
+        if address in self.pending:
+            return self.pending[address]
+        row = self._row(address)
+        if row is None:
+            raise KeyError(address)
+        return int(row[0]), int(row[1])
+
+    def __setitem__(self, address, xy):
+        self.pending[address] = xy
+
+    def get(self, address, default=None):
+        try:
+            return self[address]
+        except KeyError:
+            return default
+
+    def keys(self):
+        stored = [address for address, in self.conn.execute("SELECT address FROM public_keys")]
+        known = set(stored)
+        return stored + [address for address in self.pending if address not in known]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def rows(self):
+        """
+        :return: [(address, x, y), ...] of the pending keys, as they are written
+        """
+        return [(address, str(x), str(y)) for address, (x, y) in self.pending.items()]
+
+
+class SqliteChain(object):
+    """
+    Persistent chain on sqlite, can be used in place of the ScroogeCoin.chain list
+    blocks are read back on demand, so the ledger does not have to fit in memory
+    indexes on address and location answer position, output, balance and
+    spent queries without loading blocks, see StoreState
+    """
+
+    def __init__(self, path, compact=False):
+        """
+        :param path: database file, ":memory:" for a throw away store
+        :param compact: hand out Block objects instead of dicts
+        """
+        self.path = path
+        self.compact = compact
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.height = self.conn.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+        self.filters = SqliteFilters(self.conn)
+        self.public_keys = SqlitePublicKeys(self.conn)
+        if self.height and self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 0:
+            # a store from before the history table, index the blocks it already has
+            with self.conn:
+                for block in self:
+                    self.conn.executemany(HISTORY_INSERT, block_entries(block))
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def __len__(self):
+        return self.height
+
+    def __iter__(self):
+        for index in range(self.height):
+            yield self.load_block(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.load_block(i) for i in range(*index.indices(self.height))]
+        if index < 0:
+            index += self.height
+        if not (0 <= index < self.height):
+            raise IndexError("block index out of range")
+        return self.load_block(index)
+
+    def load_block(self, index):
+        """
+        reads one block back into the shape ScroogeCoin.mine created
+        :param index: block number
+        """
+        hash_, previous_hash, root, signature = self.conn.execute(
+            "SELECT hash, previous_hash, merkle_root, signature FROM blocks WHERE idx = ?", (index,)).fetchone()
+        rows = self.conn.execute("SELECT body FROM transactions WHERE block = ? ORDER BY tx", (index,))
+        block = {
+            "previous_hash": previous_hash,
+            "index": index,
+            "merkle_root": root,
+            "transactions": [load_tx(body) for body, in rows],
+            "hash": hash_,
+            "signature": tuple(json.loads(signature)),
+        }
+        if self.compact:
+            return Block.from_dict(block)
+        return block
+
+    def append(self, block, bodies=None):
+        """
+        writes a mined block with its transactions, outputs, spends, history and the public keys
+        that came with its transactions in one commit
+        a pruned transaction, as an imported chain file may hold, has no sender, outputs or
+        spends left, only the balances it moved
+        :param block: Block
+        :param bodies: {tx hash: canonical encoding of the body} made while validating, see canonical.dumps_tx
+        """
+        bodies = bodies or {}
+        index = block["index"]
+        txs, outputs, spends, pruned = [], [], [], []
+        for tx_index, tx in enumerate(block["transactions"]):
+            tx = to_dict(tx)
+            if tx.get("pruned"):
+                txs.append((index, tx_index, tx["hash"], "", canonical.dumps(tx).decode()))
+                pruned.extend((index, tx_index, address, delta) for address, delta in tx["balances"].items())
+                continue
+            txs.append((index, tx_index, tx["hash"], tx["sender"], canonical.dumps_tx(tx, bodies.get(tx["hash"])).decode()))
+            for address, amount in tx["receivers"].items():
+                outputs.append((index, tx_index, address, amount))
+            for location in tx_locations(tx):
+                if location["block"] >= 0:
+                    spends.append((location["block"], location["tx"], tx["sender"], index, tx_index))
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO blocks (idx, hash, previous_hash, merkle_root, signature) VALUES (?, ?, ?, ?, ?)",
+                (index, block["hash"], block["previous_hash"], block["merkle_root"], json.dumps(block["signature"])))
+            self.conn.executemany("INSERT INTO transactions (block, tx, hash, sender, body) VALUES (?, ?, ?, ?, ?)", txs)
+            self.conn.executemany("INSERT INTO outputs (block, tx, address, amount) VALUES (?, ?, ?, ?)", outputs)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO spends (block, tx, address, spent_block, spent_tx) VALUES (?, ?, ?, ?, ?)", spends)
+            self.conn.executemany("INSERT INTO pruned_balances (block, tx, address, delta) VALUES (?, ?, ?, ?)", pruned)
+            self.conn.executemany(HISTORY_INSERT, block_entries(block))
+            self.conn.executemany("INSERT OR IGNORE INTO public_keys (address, x, y) VALUES (?, ?, ?)",
+                                  self.public_keys.rows())
+        self.public_keys.pending = {}
+        self.height += 1
+
+    def output(self, block, tx, address):
+        """
+        :return: amount paid to address by the transaction at block, tx or None
+        """
+        row = self.conn.execute(
+            "SELECT amount FROM outputs WHERE block = ? AND tx = ? AND address = ?", (block, tx, address)).fetchone()
+        return None if row is None else row[0]
+
+    def positions(self, address, height=None):
+        """
+        :param height: only outputs of the blocks below height
+        :return: [{"block":block_num, "tx":tx_num, "amount":amount}, ...] of every output paying address
+        """
+        if height is None:
+            height = self.height
+        rows = self.conn.execute(
+            "SELECT block, tx, amount FROM outputs WHERE address = ? AND block < ? ORDER BY block, tx", (address, height))
+        return [{"block": block, "tx": tx, "amount": amount} for block, tx, amount in rows]
+
+    def history_page(self, address, after, start_height, end_height, limit):
+        """
+        same as history.AddressIndex.page, read from the history table
+        """
+        rows = self.conn.execute(
+            "SELECT block, tx, kind, amount FROM history WHERE address = ? AND (block, tx, kind) > (?, ?, ?) "
+            "AND block >= ? AND block < ? ORDER BY block, tx, kind LIMIT ?",
+            (address, after[0], after[1], after[2], start_height, end_height, limit + 1))
+        return rows.fetchall()
+
+
+class StoreState(object):
+    """
+    LedgerState of a SqliteChain, answered from its outputs, spends and transactions tables
+    nothing is held in memory, so a store opens at any height without replaying blocks.
+    Queries only see the blocks below height, so a StoreState is also its own
+    read only view: rows of a block being written are not counted until the
+    block is applied.
+    """
+
+    def __init__(self, chain, height=None, tip=None):
+        """
+        :param chain: SqliteChain
+        :param height: the height of chain if None
+        """
+        self.chain = chain
+        self.height = len(chain) if height is None else height
+        if height is None and self.height > 0:
+            tip = chain.conn.execute("SELECT hash FROM blocks WHERE idx = ?", (self.height - 1,)).fetchone()[0]
+        self.tip = tip
+
+    @classmethod
+    def copy_of(cls, state):
+        return cls(state.chain, state.height, state.tip)
+
+    def extend(self, state, block):
+        """
+        same as StateView.extend, the tables already have block
+        """
+        return self.copy_of(state)
+
+    def apply_block(self, block):
+        """
+        moves to the height after block, SqliteChain.append wrote its outputs and spends already
+        """
+        self.height = block["index"] + 1
+        self.tip = block["hash"]
+
+    def is_unspent(self, block_index, tx_index, address):
+        row = self.chain.conn.execute(
+            "SELECT 1 FROM outputs WHERE block = ? AND tx = ? AND address = ? AND block < ? AND NOT EXISTS "
+            "(SELECT 1 FROM spends WHERE block = ? AND tx = ? AND address = ? AND spent_block < ?)",
+            (block_index, tx_index, address, self.height, block_index, tx_index, address, self.height)).fetchone()
+        return row is not None
+
+    def balance(self, address):
+        """
+        same rule as ScroogeCoin.show_user_balance, coins received from others
+        minus coins sent to others, plus what pruned transactions moved
+        """
+        received = self.chain.conn.execute(
+            "SELECT COALESCE(SUM(o.amount), 0) FROM outputs o JOIN transactions t ON o.block = t.block AND o.tx = t.tx "
+            "WHERE o.address = ? AND t.sender != ? AND o.block < ?", (address, address, self.height)).fetchone()[0]
+        sent = self.chain.conn.execute(
+            "SELECT COALESCE(SUM(o.amount), 0) FROM transactions t JOIN outputs o ON o.block = t.block AND o.tx = t.tx "
+            "WHERE t.sender = ? AND o.address != ? AND t.block < ?", (address, address, self.height)).fetchone()[0]
+        pruned = self.chain.conn.execute(
+            "SELECT COALESCE(SUM(delta), 0) FROM pruned_balances WHERE address = ? AND block < ?",
+            (address, self.height)).fetchone()[0]
+        return received - sent + pruned
+
+    @property
+    def unspent(self):
+        """
+        {(block_num, tx_num, address): amount} read from the tables, for snapshots and shards
+        """
+        rows = self.chain.conn.execute(
+            "SELECT o.block, o.tx, o.address, o.amount FROM outputs o LEFT JOIN spends s "
+            "ON s.block = o.block AND s.tx = o.tx AND s.address = o.address AND s.spent_block < ? "
+            "WHERE o.block < ? AND s.block IS NULL", (self.height, self.height))
+        return {(block_index, tx_index, address): amount for block_index, tx_index, address, amount in rows}
+
+    @property
+    def balances(self):
+        """
+        {address: balance} read from the tables, for snapshots and shards
+        """
+        balances = {}
+        rows = self.chain.conn.execute(
+            "SELECT o.address, t.sender, o.amount FROM outputs o JOIN transactions t ON o.block = t.block AND o.tx = t.tx "
+            "WHERE o.address != t.sender AND o.block < ?", (self.height,))
+        for receiver, sender, amount in rows:
+            balances[receiver] = balances.get(receiver, 0) + amount
+            balances[sender] = balances.get(sender, 0) - amount
+        rows = self.chain.conn.execute("SELECT address, delta FROM pruned_balances WHERE block < ?", (self.height,))
+        for address, delta in rows:
+            balances[address] = balances.get(address, 0) + delta
+        return balances
@@ -0,0 +1,332 @@
+import canonical
+
+# Compact versions of the transaction and block dicts for large ledgers.
+# Addresses and hashes are stored as raw bytes instead of hex strings, and the
+# objects convert losslessly to and from the dict shape. They also answer
+# tx["sender"], block["transactions"], ... like the dicts do, so ScroogeCoin
+# can read either.
+
+
+def to_bytes(hex_value):
+    return None if hex_value is None else bytes.fromhex(hex_value)
+
+
+def to_hex(raw):
+    return None if raw is None else raw.hex()
+
+
+def signature_to_bytes(signature):
+    if signature is None:
+        return None
+    r, s = signature
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+
+def signature_from_bytes(raw):
+    if raw is None:
+        return None
+    return (int.from_bytes(raw[:32], 'big'), int.from_bytes(raw[32:], 'big'))
+
+
+class Location(object):
+    """
+    position of a transaction in the chain, get_user_tx_positions also reports the amount
+    """
+    __slots__ = ("block", "tx", "amount")
+
+    def __init__(self, block, tx, amount=None):
+        self.block = block
+        self.tx = tx
+        self.amount = amount
+
+    def __getitem__(self, key):
+        if key == "block":
+            return self.block
+        if key == "tx":
+            return self.tx
+        if key == "amount" and self.amount is not None:
+            return self.amount
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ("block", "tx") or (key == "amount" and self.amount is not None)
+
+    def __eq__(self, other):
+        return self.block == other["block"] and self.tx == other["tx"]
+
+    def __hash__(self):
+        return hash((self.block, self.tx))
+
+    def __repr__(self):
+        return "Location(block=%d, tx=%d)" % (self.block, self.tx)
+
+    def to_dict(self):
+        if self.amount is None:
+            return {"block": self.block, "tx": self.tx}
+        return {"block": self.block, "tx": self.tx, "amount": self.amount}
+
+    @classmethod
+    def from_dict(cls, location):
+        if isinstance(location, cls):
+            return location
+        return cls(location["block"], location["tx"], location.get("amount"))
+
+
+class Transaction(canonical.Sealed):
+    """
+    compact transaction, receivers are kept as one bytes string of
+    32 byte addresses plus a tuple of amounts in the same order
+    transactions from before multi input keep their single Location, so they hash the same
+    """
+    __slots__ = ("_sender", "_locations", "_receivers", "_amounts", "_hash", "_signature")
+
+    def __init__(self, sender, locations, receivers, hash_=None, signature=None):
+        """
+        :param sender: 32 byte address
+        :param locations: [Location, ...], or a single Location for the old format
+        :param receivers: [(32 byte address, amount), ...]
+        :param hash_: 32 byte digest of the body
+        :param signature: 64 bytes, r and s
+        """
+        self._sender = sender
+        self._locations = locations if isinstance(locations, Location) else tuple(locations)
+        self._receivers = b"".join(address for address, _ in receivers)
+        self._amounts = tuple(amount for _, amount in receivers)
+        self._hash = hash_
+        self._signature = signature
+
+    @property
+    def FIELDS(self):
+        if isinstance(self._locations, Location):
+            return ("sender", "location", "receivers", "hash", "signature")
+        return ("sender", "locations", "receivers", "hash", "signature")
+
+    @property
+    def location(self):
+        return self._locations
+
+    @property
+    def locations(self):
+        if isinstance(self._locations, Location):
+            return (self._locations,)
+        return self._locations
+
+    @property
+    def sender(self):
+        return self._sender.hex()
+
+    @property
+    def receivers(self):
+        return {self._receivers[i * 32:(i + 1) * 32].hex(): amount for i, amount in enumerate(self._amounts)}
+
+    @property
+    def hash(self):
+        return to_hex(self._hash)
+
+    @property
+    def signature(self):
+        return signature_from_bytes(self._signature)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return self[key] if key in self.FIELDS else default
+
+    def canonical(self):
+        tx = {
+            "sender": self.sender,
+            "receivers": self.receivers,
+        }
+        if isinstance(self._locations, Location):
+            tx["location"] = self._locations.to_dict()
+        else:
+            tx["locations"] = [location.to_dict() for location in self._locations]
+        return tx
+
+    def to_dict(self):
+        tx = self.canonical()
+        if self._hash is not None:
+            tx["hash"] = self.hash
+        if self._signature is not None:
+            tx["signature"] = self.signature
+        return tx
+
+    @classmethod
+    def from_dict(cls, tx):
+        if isinstance(tx, (cls, PrunedTransaction)):
+            return tx
+        if tx.get("pruned"):
+            return PrunedTransaction.from_dict(tx)
+        if "nonce" in tx:
+            raise ValueError("account model transactions have no compact form")
+        return cls(
+            to_bytes(tx["sender"]),
+            Location.from_dict(tx["location"]) if "location" in tx
+            else [Location.from_dict(location) for location in tx["locations"]],
+            [(to_bytes(address), amount) for address, amount in tx["receivers"].items()],
+            to_bytes(tx.get("hash")),
+            signature_to_bytes(tx.get("signature")),
+        )
+
+
+class PrunedTransaction(object):
+    """
+    what is left of a transaction once all of its outputs are spent: the hash
+    the block's merkle root commits to, and the balances it moved, which a
+    replay of the chain still has to count
+    reads like a transaction with no sender, inputs or receivers, so scans of
+    the chain pass over it
+    """
+    __slots__ = ("_hash", "_balances")
+
+    FIELDS = ("sender", "locations", "receivers", "hash", "pruned", "balances")
+
+    def __init__(self, hash_, balances=()):
+        """
+        :param hash_: 32 byte digest of the transaction
+        :param balances: [(32 byte address, balance delta), ...] see ledger_state.balance_deltas
+        """
+        self._hash = hash_
+        self._balances = tuple(balances)
+
+    sender = None
+    pruned = True
+
+    @property
+    def locations(self):
+        return ()
+
+    @property
+    def receivers(self):
+        return {}
+
+    @property
+    def hash(self):
+        return to_hex(self._hash)
+
+    @property
+    def balances(self):
+        return {address.hex(): delta for address, delta in self._balances}
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return self[key] if key in self.FIELDS else default
+
+    def __repr__(self):
+        return "PrunedTransaction(%s)" % self.hash
+
+    def to_dict(self):
+        return {"hash": self.hash, "pruned": True, "balances": self.balances}
+
+    @classmethod
+    def from_dict(cls, tx):
+        if isinstance(tx, cls):
+            return tx
+        return cls(to_bytes(tx["hash"]), [(to_bytes(address), delta) for address, delta in tx["balances"].items()])
+
+
+class Block(canonical.Sealed):
+    """
+    compact block, the canonical form is the block header
+    """
+    __slots__ = ("index", "_previous_hash", "_merkle_root", "transactions", "_hash", "_signature")
+
+    FIELDS = ("previous_hash", "index", "merkle_root", "transactions", "hash", "signature")
+
+    def __init__(self, index, previous_hash, merkle_root, transactions, hash_=None, signature=None):
+        self.index = index
+        self._previous_hash = previous_hash
+        self._merkle_root = merkle_root
+        self.transactions = tuple(transactions)
+        self._hash = hash_
+        self._signature = signature
+
+    @property
+    def previous_hash(self):
+        return to_hex(self._previous_hash)
+
+    @property
+    def merkle_root(self):
+        return to_hex(self._merkle_root)
+
+    @property
+    def hash(self):
+        return to_hex(self._hash)
+
+    @property
+    def signature(self):
+        return signature_from_bytes(self._signature)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return self[key] if key in self.FIELDS else default
+
+    def canonical(self):
+        return {
+            "previous_hash": self.previous_hash,
+            "index": self.index,
+            "merkle_root": self.merkle_root,
+        }
+
+    def to_dict(self):
+        block = self.canonical()
+        block["transactions"] = [tx.to_dict() for tx in self.transactions]
+        if self._hash is not None:
+            block["hash"] = self.hash
+        if self._signature is not None:
+            block["signature"] = self.signature
+        return block
+
+    @classmethod
+    def from_dict(cls, block):
+        if isinstance(block, cls):
+            return block
+        return cls(
+            block["index"],
+            to_bytes(block["previous_hash"]),
+            to_bytes(block["merkle_root"]),
+            [Transaction.from_dict(tx) for tx in block["transactions"]],
+            to_bytes(block.get("hash")),
+            signature_to_bytes(block.get("signature")),
+        )
+
+
+def hex_receivers(receivers):
+    """
+    receivers keyed by hex addresses, accepts 32 byte addresses as keys too
+    :param receivers: {account:amount, account:amount, ...}
+    """
+    return {(to_hex(address) if isinstance(address, bytes) else address): amount
+            for address, amount in receivers.items()}
+
+
+def to_dict(obj):
+    """
+    dict shape of a Location, Transaction, PrunedTransaction or Block, dicts are returned as they are
+    unless they are blocks holding compact or pruned transactions, as prune leaves them
+    """
+    if isinstance(obj, (Location, Transaction, PrunedTransaction, Block)):
+        return obj.to_dict()
+    if isinstance(obj, dict) and not all(isinstance(tx, dict) for tx in obj.get("transactions", ())):
+        return dict(obj, transactions=[to_dict(tx) for tx in obj["transactions"]])
+    return obj
@@ -0,0 +1,135 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import time
+
+from Scrooge_coin_assignmnet import ScroogeCoin, User
+from profiling import percentile
+from wallet import Wallet
+
+
+OPERATIONS = ["create_coins", "get_user_tx_positions", "wallet_sync", "send_tx", "add_tx", "mine", "show_user_balance"]
+
+
+class Recorder(object):
+    """
+    collects the latency of every call, grouped by chain height segment
+    """
+
+    def __init__(self, segment_size):
+        self.segment_size = segment_size
+        # {(segment, operation): [seconds, ...]}
+        self.samples = {}
+
+    def timed(self, height, operation, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        self.samples.setdefault((height // self.segment_size, operation), []).append(elapsed)
+        return result
+
+    def report(self):
+        """
+        :return: [{"heights": "a-b", "operation": name, "count", "ops_per_s", "p50_ms", "p90_ms", "p99_ms"}, ...]
+        """
+        rows = []
+        for segment in sorted(set(segment for segment, _ in self.samples)):
+            for operation in OPERATIONS:
+                values = self.samples.get((segment, operation))
+                if not values:
+                    continue
+                rows.append({
+                    "heights": "%d-%d" % (segment * self.segment_size, (segment + 1) * self.segment_size - 1),
+                    "operation": operation,
+                    "count": len(values),
+                    "ops_per_s": len(values) / sum(values) if sum(values) > 0 else 0.0,
+                    "p50_ms": percentile(values, 0.50) * 1000,
+                    "p90_ms": percentile(values, 0.90) * 1000,
+                    "p99_ms": percentile(values, 0.99) * 1000,
+                })
+        return rows
+
+
+def run(users=100, txs_per_block=20, blocks=50, coins=1000, segments=5, seed=b"loadgen", profile=False, wallets=False):
+    """
+    runs a synthetic workload against a fresh ScroogeCoin
+    every user gets coins in the first block, then each block carries up to
+    txs_per_block payments from distinct random senders to random receivers
+    :param profile: also collect the phase timings of validate_tx and mine
+    :param wallets: senders pay from a Wallet synced to the tip instead of asking Scrooge for their positions
+    :return: (Recorder with the latencies of every operation, the ScroogeCoin it ran against)
+    """
+    rng = random.Random(seed)
+    recorder = Recorder(max(1, blocks // segments))
+    Scrooge = ScroogeCoin(profile=profile)
+    accounts = User.from_seed(Scrooge, seed, users)
+
+    recorder.timed(0, "create_coins", Scrooge.create_coins, {user.address: coins for user in accounts})
+    recorder.timed(0, "mine", Scrooge.mine)
+
+    if wallets:
+        wallet_of = {user.address: Wallet(user) for user in accounts}
+
+    for height in range(1, blocks):
+        for sender in rng.sample(accounts, min(txs_per_block, users)):
+            if wallets:
+                wallet = wallet_of[sender.address]
+                recorder.timed(height, "wallet_sync", wallet.sync, Scrooge.chain)
+                if wallet.available == 0:
+                    continue
+                receiver = rng.choice(accounts)
+                tx = recorder.timed(height, "send_tx", wallet.pay, {receiver.address: rng.randint(1, wallet.available)})
+                if not recorder.timed(height, "add_tx", Scrooge.add_tx, tx, sender.public_key):
+                    wallet.release(tx)
+                continue
+            positions = recorder.timed(height, "get_user_tx_positions", Scrooge.get_user_tx_positions, sender.address)
+            unspent = [p for p in positions if Scrooge.state.is_unspent(p["block"], p["tx"], sender.address)]
+            total = sum(p["amount"] for p in unspent)
+            if total == 0:
+                continue
+            receiver = rng.choice(accounts)
+            amount = rng.randint(1, total)
+            receivers = {receiver.address: amount}
+            if receiver is not sender and amount < total:
+                receivers[sender.address] = total - amount
+            elif receiver is sender:
+                receivers = {sender.address: total}
+            tx = recorder.timed(height, "send_tx", sender.send_tx, receivers, unspent)
+            recorder.timed(height, "add_tx", Scrooge.add_tx, tx, sender.public_key)
+        recorder.timed(height, "mine", Scrooge.mine)
+        recorder.timed(height, "show_user_balance", Scrooge.show_user_balance, rng.choice(accounts).address)
+    return recorder, Scrooge
+
+
+def main():
+    parser = argparse.ArgumentParser(description="synthetic load and scaling benchmark for ScroogeCoin")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--txs-per-block", type=int, default=20)
+    parser.add_argument("--blocks", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=5, help="number of height ranges to report")
+    parser.add_argument("--seed", default="loadgen")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    parser.add_argument("--wallets", action="store_true", help="pay from client side wallets instead of get_user_tx_positions")
+    parser.add_argument("--profile", help="write the validate_tx / mine phase profile to this json file")
+    args = parser.parse_args()
+
+    # show_user_balance prints every balance it computes
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        recorder, Scrooge = run(args.users, args.txs_per_block, args.blocks, segments=args.segments,
+                                seed=args.seed.encode(), profile=args.profile is not None, wallets=args.wallets)
+    if args.profile is not None:
+        Scrooge.profiler.dump(args.profile)
+    rows = recorder.report()
+    if args.json:
+        print(json.dumps(rows, indent=4))
+        return
+    print("{:<12} {:<22} {:>7} {:>10} {:>9} {:>9} {:>9}".format(
+        "heights", "operation", "count", "ops/s", "p50 ms", "p90 ms", "p99 ms"))
+    for row in rows:
+        print("{heights:<12} {operation:<22} {count:>7} {ops_per_s:>10.1f} {p50_ms:>9.3f} {p90_ms:>9.3f} {p99_ms:>9.3f}".format(**row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import hashing
+
+
+def merkle_parent(left, right, hash_name=hashing.DEFAULT):
+    """
+    Hashes two child nodes into their parent node
+    :param left: hex digest of the left child
+    :param right: hex digest of the right child
+    :param hash_name: one of hashing.BACKENDS
+    :return: hex digest of the parent
+    """
+    return hashing.hexdigest(hash_name, (left + right).encode())
+
+
+def commit_count(tree_root, count, hash_name=hashing.DEFAULT):
+    """
+    Binds the number of transactions to the root of their tree
+    an odd node at the end of a level is paired with itself (like bitcoin), so
+    [a, b, c] and [a, b, c, c] have the same tree, but not the same count. The ":"
+    never appears in the hex of a node, so this hash is never mistaken for one.
+    :return: hex digest of the root a block header carries
+    """
+    return hashing.hexdigest(hash_name, b"%d:" % count + tree_root.encode())
+
+
+def proof_length(count):
+    """
+    :return: number of siblings on the path from a leaf to the root of a tree of count leaves
+    """
+    length = 0
+    while count > 1:
+        count = (count + 1) // 2
+        length += 1
+    return length
+
+
+def merkle_root(hashes, hash_name=hashing.DEFAULT):
+    """
+    Computes the merkle root of a list of transaction hashes
+    an odd node at the end of a level is paired with itself (like bitcoin),
+    the number of hashes is committed on top, see commit_count
+    :param hashes: [tx["hash"], tx["hash"], ...]
+    :return: hex digest of the root
+    """
+    level = list(hashes)
+    if len(level) == 0:
+        return commit_count(hashing.hexdigest(hash_name, b""), 0, hash_name)
+
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [merkle_parent(level[i], level[i + 1], hash_name) for i in range(0, len(level), 2)]
+    return commit_count(level[0], len(hashes), hash_name)
+
+
+def merkle_proof(hashes, index, hash_name=hashing.DEFAULT):
+    """
+    Collects the sibling of every node on the path from a leaf to the root
+    :param hashes: [tx["hash"], tx["hash"], ...]
+    :param index: position of the leaf in hashes
+    :return: [sibling hex digest, ...] from the leaf level up, log2(len(hashes)) long
+    """
+    if not 0 <= index < len(hashes):
+        raise IndexError("no transaction %d in a block of %d" % (index, len(hashes)))
+    level = list(hashes)
+    proof = []
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        proof.append(level[index ^ 1])
+        level = [merkle_parent(level[i], level[i + 1], hash_name) for i in range(0, len(level), 2)]
+        index //= 2
+    return proof
+
+
+def root_from_proof(leaf, index, count, proof, hash_name=hashing.DEFAULT):
+    """
+    Recomputes the merkle root from a leaf and the proof of merkle_proof
+    the bits of index tell on which side the sibling sits at every level
+    :param count: number of transactions in the block, the root commits to it
+    :return: hex digest of the root, None if index is not a leaf of count or proof is not a full path
+    """
+    if not (isinstance(index, int) and isinstance(count, int) and 0 <= index < count):
+        return None
+    if len(proof) != proof_length(count):
+        return None
+    node = leaf
+    for sibling in proof:
+        if index % 2 == 0:
+            node = merkle_parent(node, sibling, hash_name)
+        else:
+            node = merkle_parent(sibling, node, hash_name)
+        index //= 2
+    return commit_count(node, count, hash_name)
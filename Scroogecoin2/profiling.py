@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+
+def percentile(values, fraction):
+    """
+    nearest rank percentile of a list of numbers
+    """
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _no_lap(phase):
+    pass
+
+
+class Profiler(object):
+    """
+    Opt-in timing of the phases of validation and mining
+    when disabled lap() hands out a function that does nothing, so the
+    instrumented code pays one empty call per phase
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # {"validate_tx.hash": [calls, seconds], ...}
+        self.phases = {}
+        # {"hash": count, ...} of the checks that failed
+        self.rejects = {}
+
+    def lap(self, prefix):
+        """
+        :param prefix: name of the instrumented function
+        :return: lap(phase), charges the time since the previous lap to prefix.phase
+        """
+        if not self.enabled:
+            return _no_lap
+        last = [time.perf_counter()]
+
+        def lap(phase):
+            now = time.perf_counter()
+            name = prefix + "." + phase
+            with self.lock:
+                totals = self.phases.setdefault(name, [0, 0.0])
+                totals[0] += 1
+                totals[1] += now - last[0]
+            last[0] = time.perf_counter()
+        return lap
+
+    def reject(self, check):
+        """
+        counts a transaction that failed check
+        """
+        if self.enabled:
+            with self.lock:
+                self.rejects[check] = self.rejects.get(check, 0) + 1
+
+    def stats(self):
+        """
+        :return: {"phases": {name: {"calls": int, "seconds": float}}, "rejects": {check: count}}
+        """
+        with self.lock:
+            return {
+                "phases": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.phases.items()},
+                "rejects": dict(self.rejects),
+            }
+
+    def dump(self, path=None):
+        """
+        :param path: file to write the stats to as json
+        :return: the json text
+        """
+        text = json.dumps(self.stats(), sort_keys=True, indent=4)
+        if path is not None:
+            with open(path, "w") as outfile:
+                outfile.write(text)
+        return text
+
+    def reset(self):
+        with self.lock:
+            self.phases = {}
+            self.rejects = {}
@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import threading
+import time
+
+import canonical
+from profiling import percentile
+
+
+# metrics cover the most recent blocks and transactions, a long running server
+# does not keep its whole history or sort it on every metrics() call
+BLOCK_WINDOW = 1000
+LATENCY_WINDOW = 10000
+
+
+class MiningPolicy(object):
+    """
+    when to seal a block, whichever limit is reached first
+    a limit of None is never reached
+    """
+
+    def __init__(self, max_txs=None, max_wait_ms=None, max_bytes=None):
+        """
+        :param max_txs: seal once this many transactions are pending
+        :param max_wait_ms: seal once the oldest pending transaction waited this long
+        :param max_bytes: canonical encoded size a block may hold
+        """
+        self.max_txs = max_txs
+        self.max_wait_ms = max_wait_ms
+        self.max_bytes = max_bytes
+
+
+class MiningScheduler(object):
+    """
+    Calls Scrooge.mine() on a MiningPolicy instead of leaving it to the caller
+    and keeps metrics on how full blocks are and how long transactions wait
+    """
+
+    def __init__(self, Scrooge, policy, clock=time.monotonic):
+        self.Scrooge = Scrooge
+        self.policy = policy
+        self.clock = clock
+        self.lock = threading.RLock()
+        # (arrival time, encoded size) of every pending transaction, in the order of current_transactions
+        self.pending = []
+        self.pending_bytes = 0
+        # the current_transactions list self.pending follows, mine() replaces it
+        self.pending_list = Scrooge.current_transactions
+        self.blocks = 0
+        self.triggers = {}
+        # transactions and bytes of the last BLOCK_WINDOW blocks, waits of the last LATENCY_WINDOW transactions
+        self.block_txs = collections.deque(maxlen=BLOCK_WINDOW)
+        self.block_bytes = collections.deque(maxlen=BLOCK_WINDOW)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def _sync_pending(self):
+        # transactions added to Scrooge without going through add_tx, e.g. create_coins
+        now = self.clock()
+        current = self.Scrooge.current_transactions
+        if current is not self.pending_list or len(current) < len(self.pending):
+            # somebody else mined, or replaced current_transactions by hand
+            self.pending_list, self.pending, self.pending_bytes = current, [], 0
+        for tx in current[len(self.pending):]:
+            size = len(canonical.dumps(tx))
+            self.pending.append((now, size))
+            self.pending_bytes += size
+
+    def add_tx(self, tx, public_key):
+        """
+        Scrooge.add_tx, sealing a block before tx if tx would not fit in the byte budget
+        and after it if a limit is reached
+        :return: True if tx was accepted
+        """
+        with self.lock:
+            self._sync_pending()
+            size = len(canonical.dumps(tx))
+            if self.policy.max_bytes is not None and self.pending and self.pending_bytes + size > self.policy.max_bytes:
+                self.seal("bytes")
+            if not self.Scrooge.add_tx(tx, public_key):
+                return False
+            self.pending.append((self.clock(), size))
+            self.pending_bytes += size
+            self.poll()
+            return True
+
+    def due(self):
+        """
+        :return: the name of the limit that is reached, None if no block is due
+        """
+        if not self.pending:
+            return None
+        if self.policy.max_txs is not None and len(self.pending) >= self.policy.max_txs:
+            return "txs"
+        if self.policy.max_bytes is not None and self.pending_bytes >= self.policy.max_bytes:
+            return "bytes"
+        if self.policy.max_wait_ms is not None and (self.clock() - self.pending[0][0]) * 1000 >= self.policy.max_wait_ms:
+            return "wait"
+        return None
+
+    def poll(self):
+        """
+        seals a block if one is due
+        :return: the mined block or None
+        """
+        with self.lock:
+            self._sync_pending()
+            reason = self.due()
+            if reason is None:
+                return None
+            return self.seal(reason)
+
+    def seal(self, reason):
+        with self.lock:
+            self._sync_pending()
+            block = self.Scrooge.mine()
+            now = self.clock()
+            self.blocks += 1
+            self.triggers[reason] = self.triggers.get(reason, 0) + 1
+            self.block_txs.append(len(self.pending))
+            self.block_bytes.append(self.pending_bytes)
+            self.latencies.extend(now - arrival for arrival, _ in self.pending)
+            self.pending_list, self.pending, self.pending_bytes = self.Scrooge.current_transactions, [], 0
+            return block
+
+    async def run(self, interval=0.01):
+        """
+        polls every interval seconds so the wait limit fires without new transactions
+        """
+        while True:
+            self.poll()
+            await asyncio.sleep(interval)
+
+    def metrics(self):
+        """
+        :return: {"blocks", "triggers", "fill", "latency_ms"}
+        fill is the mean share of max_txs / max_bytes a block used, over the last BLOCK_WINDOW blocks
+        latencies are of the last LATENCY_WINDOW transactions
+        """
+        with self.lock:
+            fill = {}
+            if self.block_txs:
+                fill["txs_mean"] = sum(self.block_txs) / len(self.block_txs)
+                fill["bytes_mean"] = sum(self.block_bytes) / len(self.block_bytes)
+                if self.policy.max_txs:
+                    fill["txs_ratio"] = fill["txs_mean"] / self.policy.max_txs
+                if self.policy.max_bytes:
+                    fill["bytes_ratio"] = fill["bytes_mean"] / self.policy.max_bytes
+            return {
+                "blocks": self.blocks,
+                "triggers": dict(self.triggers),
+                "fill": fill,
+                "latency_ms": {
+                    "p50": percentile(self.latencies, 0.50) * 1000,
+                    "p90": percentile(self.latencies, 0.90) * 1000,
+                    "p99": percentile(self.latencies, 0.99) * 1000,
+                    "max": max(self.latencies) * 1000 if self.latencies else 0.0,
+                },
+            }
@@ -0,0 +1,266 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+from fastecdsa import ecdsa, curve, point
+
+import canonical
+import hashing
+from accounts import AccountState
+from ledger_state import tx_locations
+from ledger_types import to_dict
+from validation import check_structure
+
+
+def shard_of(address, shards):
+    """
+    :param address: hex address
+    :return: number of the shard that owns address
+    """
+    return int(address[:16], 16) % shards
+
+
+class Shard(object):
+    """
+    The part of the ledger state owned by one shard: unspent outputs paying
+    and balances of the addresses with shard_of(address) == number
+    every input of a transaction is an output paying its sender, so the shard
+    of the sender can validate it alone
+    """
+
+    def __init__(self, number, shards, hash_name=hashing.DEFAULT):
+        self.number = number
+        self.shards = shards
+        self.hash_name = hash_name
+        # {(block_num, tx_num, address): amount}
+        self.unspent = {}
+        # {address: balance}
+        self.balances = {}
+        # (block_num, tx_num, address) used by accepted transactions that are not mined yet
+        self.pending = set()
+
+    def validate(self, tx, x, y):
+        """
+        same decision as ScroogeCoin.validate_tx for a sender this shard owns, cheapest check first
+        accepted transactions reserve their inputs until the next block
+        :return: True if tx is valid
+        """
+        if check_structure(tx) is not None:
+            return False
+        sender = tx["sender"]
+        keys = [(location["block"], location["tx"], sender) for location in tx_locations(tx)]
+        if len(keys) == 0 or len(set(keys)) != len(keys):
+            return False
+        if any(key not in self.unspent or key in self.pending for key in keys):
+            return False
+        if sum(self.unspent[key] for key in keys) != sum(tx["receivers"].values()):
+            return False
+        if canonical.digest(canonical.tx_body(tx), self.hash_name) != tx["hash"]:
+            return False
+        public_key = point.Point(x, y, curve=curve.secp256k1)
+        if not ecdsa.verify(tuple(tx["signature"]), tx["hash"], public_key, curve=curve.secp256k1):
+            return False
+        self.pending.update(keys)
+        return True
+
+    def apply(self, spent, outputs, balances):
+        """
+        applies this shard's part of a mined block, see block_deltas
+        """
+        for key in spent:
+            self.unspent.pop(key, None)
+        self.unspent.update(outputs)
+        for address, delta in balances.items():
+            self.balances[address] = self.balances.get(address, 0) + delta
+        self.pending = set()
+
+
+def block_deltas(block, shards):
+    """
+    splits the changes block makes to the ledger state by shard
+    :return: [(spent keys, {key: amount}, {address: balance delta}), ...] one per shard
+    """
+    deltas = [([], {}, {}) for _ in range(shards)]
+    for tx_index, tx in enumerate(block["transactions"]):
+        sender = tx["sender"]
+        if sender is None:
+            continue
+        sender_shard = deltas[shard_of(sender, shards)]
+        for location in tx_locations(tx):
+            sender_shard[0].append((location["block"], location["tx"], sender))
+        for receiver, amount in tx["receivers"].items():
+            receiver_shard = deltas[shard_of(receiver, shards)]
+            receiver_shard[1][(block["index"], tx_index, receiver)] = amount
+            if receiver != sender:
+                receiver_shard[2][receiver] = receiver_shard[2].get(receiver, 0) + amount
+                sender_shard[2][sender] = sender_shard[2].get(sender, 0) - amount
+    return deltas
+
+
+def _shard_main(conn, number, shards, hash_name):
+    # runs in the shard process, answers requests from ShardedLedger until told to stop
+    shard = Shard(number, shards, hash_name)
+    while True:
+        op, args = conn.recv()
+        if op == "validate":
+            conn.send([shard.validate(tx, x, y) for tx, x, y in args])
+        elif op == "apply":
+            shard.apply(*args)
+            conn.send(None)
+        elif op == "load":
+            shard.unspent, shard.balances = args
+            shard.pending = set()
+            conn.send(None)
+        elif op == "balance":
+            conn.send(shard.balances.get(args, 0))
+        elif op == "stop":
+            conn.send(None)
+            return
+
+
+class ShardedLedger(object):
+    """
+    Runs the validation of a ScroogeCoin on shard processes
+    unspent outputs and balances are split by address across the shards and a
+    transaction goes to the shard of its sender, so shards validate their part
+    of a batch at the same time. Accepted transactions join
+    Scrooge.current_transactions in the order they were submitted, and
+    blocks come from Scrooge.mine(), so the chain is the same as with
+    Scrooge.add_tx. Scrooge keeps its own state for the queries it answers.
+    """
+
+    def __init__(self, Scrooge, shards=4):
+        if isinstance(Scrooge.state, AccountState):
+            raise ValueError("shards split unspent outputs, an AccountCoin chain has none")
+        self.Scrooge = Scrooge
+        self.shards = shards
+        context = multiprocessing.get_context("forkserver")
+        self.connections = []
+        self.processes = []
+        for number in range(shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_shard_main, args=(child, number, shards, Scrooge.hash_name),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        self.load()
+
+    def request(self, requests):
+        """
+        sends {shard: (op, args)} to the shards at once
+        :return: {shard: answer}
+        """
+        for number, message in requests.items():
+            self.connections[number].send(message)
+        return {number: self.connections[number].recv() for number in requests}
+
+    def load(self):
+        """
+        hands every shard its part of Scrooge.state, pending transactions are dropped
+        """
+        parts = [({}, {}) for _ in range(self.shards)]
+        for key, amount in self.Scrooge.state.unspent.items():
+            parts[shard_of(key[2], self.shards)][0][key] = amount
+        for address, balance in self.Scrooge.state.balances.items():
+            parts[shard_of(address, self.shards)][1][address] = balance
+        self.request({number: ("load", part) for number, part in enumerate(parts)})
+
+    def add_txs(self, batch):
+        """
+        validates a batch of transactions, every shard takes the ones of its senders in order
+        :param batch: [(tx, public_key), ...]
+        :return: [True if the tx is added to current_transactions, ...] in batch order
+        """
+        routed = {}
+        for position, (tx, public_key) in enumerate(batch):
+            tx = to_dict(tx)
+            # a shard that raises on a transaction is gone for good, so nothing malformed is sent
+            if check_structure(tx) is not None:
+                continue
+            routed.setdefault(shard_of(tx["sender"], self.shards), []).append((position, tx, public_key))
+        answers = self.request({number: ("validate", [(tx, public_key.x, public_key.y) for _, tx, public_key in items])
+                                for number, items in routed.items()})
+
+        accepted = [False] * len(batch)
+        for number, items in routed.items():
+            for (position, _, _), is_valid in zip(items, answers[number]):
+                accepted[position] = is_valid
+        with self.Scrooge.lock:
+            for position, (tx, public_key) in enumerate(batch):
+                if not accepted[position]:
+                    continue
+                # shards only know their own reservations, Scrooge.add_tx and blocks mined
+                # without self.mine() go around them
+                sender = tx["sender"]
+                pending = self.Scrooge.pending_spends()
+                if any((location["block"], location["tx"], sender) in pending
+                       or not self.Scrooge.state.is_unspent(location["block"], location["tx"], sender)
+                       for location in tx_locations(tx)):
+                    accepted[position] = False
+                    continue
+                self.Scrooge.current_transactions.append(tx)
+                self.Scrooge.remember_key(sender, public_key)
+        return accepted
+
+    def add_tx(self, tx, public_key):
+        return self.add_txs([(tx, public_key)])[0]
+
+    def mine(self):
+        """
+        Scrooge.mine(), then every shard applies its part of the block
+        """
+        block = self.Scrooge.mine()
+        self.request({number: ("apply", delta) for number, delta in enumerate(block_deltas(block, self.shards))})
+        return block
+
+    def balance(self, address):
+        return self.request({shard_of(address, self.shards): ("balance", address)})[shard_of(address, self.shards)]
+
+    def close(self):
+        self.request({number: ("stop", None) for number in range(self.shards)})
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+
+
+def benchmark(users=2000, shard_counts=(1, 2, 4), seed=b"sharding"):
+    """
+    validates one payment per user, as a single batch, with every shard count
+    :return: [{"shards", "txs", "seconds", "tx_per_s"}, ...]
+    """
+    from Scrooge_coin_assignmnet import ScroogeCoin, User
+
+    Scrooge = ScroogeCoin()
+    accounts = User.from_seed(Scrooge, seed, users)
+    Scrooge.create_coins({user.address: 10 for user in accounts})
+    Scrooge.mine()
+    batch = [(user.send_tx({accounts[(i + 1) % users].address: 10}, Scrooge.get_user_tx_positions(user.address)),
+              user.public_key) for i, user in enumerate(accounts)]
+
+    rows = []
+    for shards in shard_counts:
+        ledger = ShardedLedger(Scrooge, shards)
+        start = time.perf_counter()
+        accepted = ledger.add_txs(batch)
+        seconds = time.perf_counter() - start
+        ledger.close()
+        assert all(accepted)
+        Scrooge.current_transactions = []
+        rows.append({"shards": shards, "txs": len(batch), "seconds": seconds, "tx_per_s": len(batch) / seconds})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="validation throughput of the sharded ledger by number of shards")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.users, args.shards), indent=4))
+
+
+if __name__ == '__main__':
+    main()
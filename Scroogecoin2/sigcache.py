@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+from fastecdsa import ecdsa, curve
+
+
+class SignatureCache(object):
+    """
+    Bounded LRU cache of (hash, signature, public key) triples that already verified
+    only good signatures are remembered, a bad one is checked again every time
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, signature, hash_, public_key, bypass=False):
+        """
+        same result as ecdsa.verify(signature, hash_, public_key, curve=curve.secp256k1)
+        :param bypass: always do the curve math and leave the cache alone, for audits
+        """
+        if bypass:
+            return ecdsa.verify(signature, hash_, public_key, curve=curve.secp256k1)
+
+        key = (hash_, tuple(signature), public_key.x, public_key.y)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+
+        is_signed = ecdsa.verify(signature, hash_, public_key, curve=curve.secp256k1)
+        if is_signed:
+            self.add(signature, hash_, public_key)
+        return is_signed
+
+    def add(self, signature, hash_, public_key):
+        """
+        remembers a triple that was verified somewhere else, e.g. in a worker process
+        """
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[(hash_, tuple(signature), public_key.x, public_key.y)] = True
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        :return: {"hits": int, "misses": int, "size": int, "maxsize": int}
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,92 @@
+import enum
+
+from fastecdsa import curve
+
+from ledger_state import tx_locations
+
+
+class Reason(str, enum.Enum):
+    """
+    outcome of ScroogeCoin.check_tx, the value is the name used in stats
+    checks run in this order, cheapest first, and the first failure is the reason
+    """
+    OK = "ok"
+    # not shaped like a transaction at all
+    MALFORMED = "malformed"
+    # an amount that is not a positive integer
+    AMOUNT = "amount"
+    # no inputs, an input listed twice, or an input that does not pay the sender
+    FUNDED = "funded"
+    # inputs and outputs do not add up
+    ALL_SPENT = "all_spent"
+    # an input already spent, in the chain or by a pending transaction
+    CONSUMED = "consumed"
+    # account model: not the next nonce of the sender
+    NONCE = "nonce"
+    # account model: the balance of the sender does not cover the outputs
+    BALANCE = "balance"
+    HASH = "hash"
+    SIGNATURE = "signature"
+
+
+HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+def is_amount(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def is_address(value):
+    """
+    a 64 character lowercase hex digest, the form snapshots, shards and the compact types rely on
+    """
+    return isinstance(value, str) and len(value) == 64 and HEX_DIGITS.issuperset(value)
+
+
+def is_signature_part(value):
+    """
+    r or s of a secp256k1 signature, anything outside [1, q - 1] makes ecdsa.verify raise instead of fail
+    """
+    return isinstance(value, int) and not isinstance(value, bool) and 1 <= value < curve.secp256k1.q
+
+
+def _check_fields(tx, check_inputs):
+    try:
+        if not is_address(tx["sender"]) or not isinstance(tx["hash"], str):
+            return Reason.MALFORMED
+        r, s = tx["signature"]
+        if not (is_signature_part(r) and is_signature_part(s)):
+            return Reason.MALFORMED
+        if not check_inputs(tx):
+            return Reason.MALFORMED
+        receivers = tx["receivers"]
+        if len(receivers) == 0 or not all(is_address(address) for address in receivers):
+            return Reason.MALFORMED
+    except (KeyError, TypeError, ValueError):
+        return Reason.MALFORMED
+    if not all(is_amount(amount) for amount in receivers.values()):
+        return Reason.AMOUNT
+    return None
+
+
+def _has_locations(tx):
+    return all(isinstance(location["block"], int) and isinstance(location["tx"], int) for location in tx_locations(tx))
+
+
+def _has_nonce(tx):
+    nonce = tx["nonce"]
+    return isinstance(nonce, int) and not isinstance(nonce, bool) and nonce >= 0
+
+
+def check_structure(tx):
+    """
+    :return: Reason.MALFORMED or Reason.AMOUNT if tx can be rejected without looking at the ledger, else None
+    """
+    return _check_fields(tx, _has_locations)
+
+
+def check_account_structure(tx):
+    """
+    check_structure for account model transactions, which carry a nonce instead of locations
+    """
+    return _check_fields(tx, _has_nonce)
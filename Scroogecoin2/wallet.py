@@ -0,0 +1,129 @@
+from filters import entry_matches
+from ledger_state import tx_locations
+from ledger_types import to_dict
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+class Wallet(object):
+    """
+    Keeps the unspent outputs of one User on the client side
+    the wallet reads each block once, from the height it has seen up to the
+    tip, so paying does not ask Scrooge to scan the chain for positions.
+    Inputs of a payment stay pending until a block spends them, or release()
+    hands them back if Scrooge turned the payment down.
+    """
+
+    def __init__(self, user):
+        """
+        :param user: User whose outputs are tracked and who signs the payments
+        """
+        self.user = user
+        self.address = user.address
+        # number of blocks read and hash of the last one
+        self.height = 0
+        self.tip = None
+        # {(block_num, tx_num): amount} outputs paying address that are not spent in a block yet
+        self.unspent = {}
+        # (block_num, tx_num) used by payments that are not mined yet
+        self.pending = set()
+
+    @property
+    def balance(self):
+        """
+        coins of the mined blocks read so far, same as ScroogeCoin.show_user_balance at self.height
+        """
+        return sum(self.unspent.values())
+
+    @property
+    def available(self):
+        """
+        coins not tied up in pending payments
+        """
+        return sum(amount for position, amount in self.unspent.items() if position not in self.pending)
+
+    def apply_block(self, block):
+        """
+        reads the next block, it must be the block at self.height
+        :param block: Block or dict, e.g. from the ingest server's blocks op
+        """
+        if block["index"] != self.height or (self.height and block["previous_hash"] != self.tip):
+            raise ValueError("block %s does not follow height %d" % (block["index"], self.height))
+        for tx_index, tx in enumerate(block["transactions"]):
+            if tx.get("pruned"):
+                continue
+            if tx["sender"] == self.address:
+                for location in tx_locations(tx):
+                    position = (location["block"], location["tx"])
+                    self.unspent.pop(position, None)
+                    self.pending.discard(position)
+            amount = tx["receivers"].get(self.address)
+            if amount is not None:
+                self.unspent[(block["index"], tx_index)] = amount
+        self.height = block["index"] + 1
+        self.tip = block["hash"]
+
+    def skip_block(self, entry):
+        """
+        passes over the next block without reading it, after its filter ruled out this wallet's address
+        :param entry: filter entry of the block, see ScroogeCoin.get_block_filters
+        """
+        if entry["index"] != self.height or (self.height and entry["previous_hash"] != self.tip):
+            raise ValueError("block %s does not follow height %d" % (entry["index"], self.height))
+        self.height = entry["index"] + 1
+        self.tip = entry["hash"]
+
+    def sync(self, chain, filters=None):
+        """
+        reads the blocks of chain from self.height to its end
+        :param chain: ScroogeCoin.chain, a SqliteChain or a chainfile.ChainReader
+        :param filters: ScroogeCoin.block_filters, only blocks whose filter matches the address are read,
+        the others are skipped
+        :return: number of blocks read
+        """
+        count = 0
+        stop = len(chain) if filters is None else min(len(chain), len(filters))
+        for index in range(self.height, stop):
+            if filters is not None and not entry_matches(filters[index], [self.address]):
+                self.skip_block(filters[index])
+                continue
+            self.apply_block(chain[index])
+            count += 1
+        return count
+
+    def pay(self, receivers, compact=False):
+        """
+        signs a payment from the oldest outputs that are not pending, any change goes back to the wallet
+        :param receivers: {account:amount, account:amount, ...}
+        :raises ValueError: if receivers do not add up to a positive amount
+        :raises InsufficientFunds: if the available coins do not cover receivers
+        :return: tx for ScroogeCoin.add_tx
+        """
+        total = sum(receivers.values())
+        if total <= 0:
+            raise ValueError("a payment of %d coins" % total)
+        inputs, covered = [], 0
+        for position in sorted(self.unspent):
+            if covered >= total:
+                break
+            if position not in self.pending:
+                inputs.append(position)
+                covered += self.unspent[position]
+        if covered < total:
+            raise InsufficientFunds("%d available, %d to pay" % (self.available, total))
+
+        receivers = dict(receivers)
+        if covered > total:
+            receivers[self.address] = receivers.get(self.address, 0) + covered - total
+        tx = self.user.send_tx(receivers, [{"block": block, "tx": tx} for block, tx in inputs], compact)
+        self.pending.update(inputs)
+        return tx
+
+    def release(self, tx):
+        """
+        frees the inputs of a payment Scrooge rejected, so they can be spent again
+        """
+        for location in tx_locations(to_dict(tx)):
+            self.pending.discard((location["block"], location["tx"]))